@@ -0,0 +1,71 @@
+"""
+Parsing address_components of the recorded place details and geocoding
+fixtures in tests/test_location.py, 100k times each, with the previous
+per-field list comprehensions versus parse_address_components_many.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_address_components
+"""
+import time
+
+from tests.test_location import geocode_api_response, google_palce_api_response
+
+from fielder_backend_utils.location import parse_address_components_many
+
+COUNT = 100_000
+
+
+def old_parse(info):
+    building = [
+        _["long_name"]
+        for _ in info
+        if "street_number" in _["types"] or "premise" in _["types"]
+    ]
+    street = [_["long_name"] for _ in info if "route" in _["types"]]
+    city = [_["long_name"] for _ in info if "postal_town" in _["types"]]
+    administrative_areas_names = [
+        _["long_name"] for _ in info if "administrative_area_level_2" in _["types"]
+    ] + [_["long_name"] for _ in info if "administrative_area_level_1" in _["types"]]
+    country = [_["long_name"] for _ in info if "country" in _["types"]]
+    postal_code = [_["long_name"] for _ in info if "postal_code" in _["types"]]
+    return {
+        "building": building[0] if building else None,
+        "street": street[0] if street else None,
+        "city": city[0] if city else None,
+        "county": ", ".join(administrative_areas_names)
+        if administrative_areas_names
+        else None,
+        "country": country[0] if country else None,
+        "postal_code": postal_code[0] if postal_code else None,
+    }
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:<36} {time.perf_counter() - start:6.2f}s")
+    return result
+
+
+def main():
+    results = [
+        google_palce_api_response["result"],
+        geocode_api_response["results"][0],
+    ] * (COUNT // 2)
+
+    expected = timed(
+        "old list comprehensions",
+        lambda: [old_parse(r["address_components"]) for r in results],
+    )
+    assert (
+        timed(
+            "parse_address_components_many",
+            lambda: parse_address_components_many(results),
+        )
+        == expected
+    )
+
+
+if __name__ == "__main__":
+    main()
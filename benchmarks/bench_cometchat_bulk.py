@@ -0,0 +1,67 @@
+"""
+Throughput of CometChat bulk provisioning and broadcast against a local
+stand-in server that adds LATENCY seconds to every request.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_cometchat_bulk
+"""
+import time
+
+from fielder_backend_utils.cometchat import CometChatHelper
+from fielder_backend_utils.cometchat.dataclasses import CometChatUser
+from tests.mock_server import MockServer
+
+LATENCY = 0.02
+USERS = 400
+RECEIVERS = 5000
+
+
+def handler(method, path, headers, body):
+    time.sleep(LATENCY)
+    if path == "/users":
+        return 200, {}, {"data": body}
+    return 200, {}, {"data": {}}
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:7.2f}s {count / elapsed:9.1f}/s")
+
+
+def main():
+    users = [CometChatUser(uid=f"u{i}", name=f"User {i}") for i in range(USERS)]
+    receivers = [f"u{i}" for i in range(RECEIVERS)]
+    with MockServer(handler) as server:
+        helper = CometChatHelper("APP", "eu", "KEY")
+        helper.base_url = server.url
+
+        timed(
+            "create_user, serial",
+            USERS,
+            lambda: [helper.create_user(u.uid, u.name) for u in users],
+        )
+        for workers in (8, 32):
+            timed(
+                f"bulk_create_or_update_users, {workers} workers",
+                USERS,
+                lambda: helper.bulk_create_or_update_users(users, max_workers=workers),
+            )
+        timed(
+            "broadcast_text_message, 1 worker",
+            RECEIVERS,
+            lambda: helper.broadcast_text_message(
+                "hi", "admin", receivers, max_workers=1
+            ),
+        )
+        timed(
+            "broadcast_text_message, 8 workers",
+            RECEIVERS,
+            lambda: helper.broadcast_text_message("hi", "admin", receivers),
+        )
+
+
+if __name__ == "__main__":
+    main()
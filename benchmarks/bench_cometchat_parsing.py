@@ -0,0 +1,108 @@
+"""
+CometChat response parsing and error dispatch over recorded responses,
+compared with the previous implementation (json parsed twice, sequential
+enum comparisons, deepcopy of the headers, CometChatUser(**data)).
+
+Run from the repository root:
+
+    python -m benchmarks.bench_cometchat_parsing
+"""
+import json
+import timeit
+from copy import deepcopy
+
+from requests import Response
+
+from fielder_backend_utils.cometchat import CometChatHelper
+from fielder_backend_utils.cometchat.dataclasses import CometChatUser
+from fielder_backend_utils.cometchat.enums import CometChatErrorCodes
+from fielder_backend_utils.cometchat.exceptions import CometChatException
+
+NUMBER = 20000
+
+RECORDED_USER = {
+    "data": {
+        "uid": "mfzgk3dfoi______",
+        "name": "Jane Doe",
+        "avatar": "https://storage.googleapis.com/fielder/avatar.png",
+        "metadata": {"@private": {"email": "jane@example.com"}},
+        "status": "offline",
+        "role": "worker",
+        "createdAt": 1666280000,
+        "updatedAt": 1666290000,
+        "tags": ["worker"],
+    }
+}
+RECORDED_ERROR = {
+    "error": {
+        "message": "The user with uid mfzgk3dfoi______ does not exist.",
+        "devMessage": "Please use correct uid.",
+        "source": "ERR_BAD_REQUEST",
+        "code": "ERR_BAD_REQUEST",
+    }
+}
+
+
+def make_response(status_code, body):
+    response = Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode()
+    return response
+
+
+def old_handle_bad_request(response):
+    code = response.json()["error"]["code"]
+    message = response.json()["error"]["message"]
+    for member in CometChatErrorCodes:
+        if code == member.name:
+            raise CometChatException(message)
+    raise CometChatException(response.text)
+
+
+def main():
+    helper = CometChatHelper("APP", "eu", "KEY")
+    user_response = make_response(200, RECORDED_USER)
+    error_response = make_response(400, RECORDED_ERROR)
+
+    def old_user():
+        if not user_response.ok:
+            old_handle_bad_request(user_response)
+        return CometChatUser(**user_response.json()["data"])
+
+    def new_user():
+        return CometChatUser.from_dict(helper._parse_response(user_response))
+
+    def old_error():
+        try:
+            old_handle_bad_request(error_response)
+        except CometChatException:
+            pass
+
+    def new_error():
+        try:
+            helper._parse_response(error_response)
+        except CometChatException:
+            pass
+
+    def old_headers():
+        headers = deepcopy(helper.default_headers)
+        headers.update({"onBehalfOf": "uid"})
+
+    def new_headers():
+        headers = {**helper.default_headers, "onBehalfOf": "uid"}
+
+    for label, old, new in [
+        ("user response", old_user, new_user),
+        ("error response", old_error, new_error),
+        ("message headers", old_headers, new_headers),
+    ]:
+        old_time = timeit.timeit(old, number=NUMBER) / NUMBER * 1e6
+        new_time = timeit.timeit(new, number=NUMBER) / NUMBER * 1e6
+        print(
+            f"{label:<16} old {old_time:6.2f}us  new {new_time:6.2f}us  "
+            f"x{old_time / new_time:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
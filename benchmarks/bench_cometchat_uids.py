@@ -0,0 +1,51 @@
+"""
+Encoding and decoding 1M Firestore ids to CometChat uids, one at a time with
+the previous implementation versus encode_uids/decode_uids and UIDMemo.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_cometchat_uids
+"""
+import random
+import string
+import time
+from base64 import b32decode, b32encode
+
+from fielder_backend_utils.cometchat.helpers import UIDMemo, decode_uids, encode_uids
+
+COUNT = 1_000_000
+
+
+def old_encode_uid(uid):
+    return b32encode(uid.encode()).decode().lower().replace("=", "_")
+
+
+def old_decode_uid(uid):
+    return b32decode(uid.upper().replace("_", "=")).decode()
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:<36} {time.perf_counter() - start:6.2f}s")
+    return result
+
+
+def main():
+    rng = random.Random(0)
+    alphabet = string.ascii_letters + string.digits
+    ids = ["".join(rng.choices(alphabet, k=20)) for _ in range(COUNT)]
+
+    encoded = timed("old encode_uid loop", lambda: [old_encode_uid(i) for i in ids])
+    assert timed("encode_uids", lambda: encode_uids(ids)) == encoded
+    timed("old decode_uid loop", lambda: [old_decode_uid(e) for e in encoded])
+    assert timed("decode_uids", lambda: decode_uids(encoded)) == ids
+
+    memo = UIDMemo()
+    timed("UIDMemo.encode_many, cold", lambda: memo.encode_many(ids))
+    timed("UIDMemo.encode_many, warm", lambda: memo.encode_many(ids))
+    assert timed("UIDMemo.decode_many, warm", lambda: memo.decode_many(encoded)) == ids
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Latency breakdown of task.create_http_task() against a local gRPC stand-in
+for Cloud Tasks.
+
+google.auth.default() is replaced by a stub sleeping METADATA_LATENCY
+seconds, the time a metadata server lookup takes on App Engine and Cloud
+Run. Client construction, channel setup and the CreateTask call are real,
+the stand-in answers after RPC_LATENCY seconds.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_create_http_task
+"""
+import time
+from concurrent import futures
+from unittest import mock
+
+import django
+import grpc
+from django.conf import settings
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import tasks_v2
+from google.cloud.tasks_v2.services.cloud_tasks.transports import (
+    CloudTasksGrpcTransport,
+)
+
+if not settings.configured:
+    settings.configure()
+    django.setup()
+
+from fielder_backend_utils import task
+
+METADATA_LATENCY = 0.005
+RPC_LATENCY = 0.01
+CALLS = 200
+
+
+class Credentials(AnonymousCredentials):
+    service_account_email = "tasks@example.com"
+
+
+def create_task(request, context):
+    time.sleep(RPC_LATENCY)
+    return tasks_v2.Task(name=f"{request.parent}/tasks/1")
+
+
+def serve():
+    handler = grpc.method_handlers_generic_handler(
+        "google.cloud.tasks.v2.CloudTasks",
+        {
+            "CreateTask": grpc.unary_unary_rpc_method_handler(
+                create_task,
+                request_deserializer=tasks_v2.CreateTaskRequest.deserialize,
+                response_serializer=tasks_v2.Task.serialize,
+            )
+        },
+    )
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, f"127.0.0.1:{port}"
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    server, address = serve()
+
+    def default():
+        time.sleep(METADATA_LATENCY)
+        return Credentials(), "project"
+
+    def make_client(credentials):
+        channel = grpc.insecure_channel(address)
+        return tasks_v2.CloudTasksClient(
+            transport=CloudTasksGrpcTransport(channel=channel)
+        )
+
+    def enqueue():
+        return task.create_http_task(
+            "https://example.com/run",
+            "queue",
+            "europe-west2",
+            "audience",
+            payload={"id": 1},
+        )
+
+    with mock.patch.object(task.google.auth, "default", default), mock.patch.object(
+        task, "_make_client", make_client
+    ):
+        # one cold call, broken down, is what every call used to cost
+        task.reset()
+        credentials_time, (credentials, _) = timed(default)
+        client_time, client = timed(lambda: make_client(credentials))
+        first_call_time, _ = timed(
+            lambda: client.create_task(
+                request={"parent": "p/l/q", "task": {"name": "p/l/q/tasks/1"}}
+            )
+        )
+        print("cold enqueue breakdown")
+        print(f"  {'credentials lookup':<28} {credentials_time * 1000:7.2f}ms")
+        print(f"  {'client construction':<28} {client_time * 1000:7.2f}ms")
+        print(f"  {'CreateTask, new channel':<28} {first_call_time * 1000:7.2f}ms")
+
+        def per_call_client():
+            for _ in range(CALLS):
+                task.reset()
+                enqueue()
+
+        def shared_client():
+            for _ in range(CALLS):
+                enqueue()
+
+        for label, func in (
+            ("new client per call (before)", per_call_client),
+            ("shared client (after)", shared_client),
+        ):
+            task.reset()
+            enqueue()  # warm up
+            elapsed, _ = timed(func)
+            print(f"{label:<30} {elapsed / CALLS * 1000:7.2f}ms per enqueue")
+
+        specs = [
+            task.HttpTaskSpec("https://example.com/run", payload={"id": i})
+            for i in range(CALLS)
+        ]
+        elapsed, _ = timed(
+            lambda: task.create_http_tasks(specs, "queue", "europe-west2", "audience")
+        )
+        label = "create_http_tasks, 10 workers"
+        print(f"{label:<30} {elapsed / CALLS * 1000:7.2f}ms per enqueue")
+
+    task.reset()
+    server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
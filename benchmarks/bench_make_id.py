@@ -0,0 +1,61 @@
+"""
+Generating 200k shift codes with the previous make_id versus make_id and
+make_ids.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_make_id
+"""
+import random
+import string
+import time
+from hashlib import sha256
+
+from fielder_backend_utils.misc import ALPHABET, baseNEncode, make_id, make_ids
+
+COUNT = 200_000
+LENGTH = 8
+
+
+def old_make_id(str_val, length, attempts_before_fallback=None):
+    attempts_before_fallback = attempts_before_fallback or length * 3
+    input_bytes = bytearray(str_val, "utf-8")
+    random.seed(str_val)
+    try_count = 0
+    while True:
+        if try_count < attempts_before_fallback:
+            try_count += 1
+        else:
+            yield "".join(random.choice(ALPHABET) for i in range(length))
+        h = sha256()
+        h.update(input_bytes)
+        hash_bytes_as_int = int.from_bytes(h.digest(), "big", signed=False)
+        yield baseNEncode(hash_bytes_as_int, base=36)[:length]
+        input_bytes = h.digest()
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:<36} {time.perf_counter() - start:6.2f}s")
+    return result
+
+
+def main():
+    rng = random.Random(0)
+    alphabet = string.ascii_letters + string.digits
+    values = ["".join(rng.choices(alphabet, k=20)) for _ in range(COUNT)]
+
+    expected = timed(
+        "old make_id, first id",
+        lambda: [next(old_make_id(v, LENGTH)) for v in values],
+    )
+    assert (
+        timed("make_id, first id", lambda: [next(make_id(v, LENGTH)) for v in values])
+        == expected
+    )
+    assert timed("make_ids", lambda: make_ids(values, LENGTH)) == expected
+
+
+if __name__ == "__main__":
+    main()
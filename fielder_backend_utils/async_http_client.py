@@ -0,0 +1,175 @@
+"""
+Shared asyncio HTTP client for third-party integrations.
+
+Async counterpart of http_client built on httpx. One pooled AsyncClient is
+kept per event loop, requests get a default timeout and responses with 429
+or 5xx statuses are retried with exponential backoff, honouring the
+Retry-After header sent by the server. Pass rate_limiter to throttle requests
+with a shared rate_limit.RateLimiter.
+"""
+import asyncio
+import weakref
+from typing import Any, Awaitable, Iterable, List, Optional
+
+import httpx
+
+from fielder_backend_utils.http_client import (
+    DEFAULT_BACKOFF_FACTOR,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    RETRY_STATUS_CODES,
+)
+from fielder_backend_utils.rate_limit import RateLimiter, retry_after_seconds
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_CONCURRENCY = 10
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS", "TRACE"])
+
+_settings = {
+    "timeout": DEFAULT_TIMEOUT,
+    "max_connections": DEFAULT_MAX_CONNECTIONS,
+    "max_keepalive_connections": DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    "retries": DEFAULT_RETRIES,
+    "backoff_factor": DEFAULT_BACKOFF_FACTOR,
+}
+# AsyncClient connections are bound to the loop that opened them
+_clients = weakref.WeakKeyDictionary()
+
+
+def configure(
+    *,
+    timeout=None,
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    retries: Optional[int] = None,
+    backoff_factor: Optional[float] = None,
+) -> None:
+    """
+    Change the defaults used for new clients
+
+    Args:
+        timeout: default timeout, seconds or (connect, read) tuple
+        max_connections: maximum number of concurrent connections
+        max_keepalive_connections: maximum number of idle connections kept alive
+        retries: maximum number of retries on 429/5xx responses
+        backoff_factor: exponential backoff factor between retries
+    """
+    updates = {
+        "timeout": timeout,
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "retries": retries,
+        "backoff_factor": backoff_factor,
+    }
+    _settings.update({k: v for k, v in updates.items() if v is not None})
+
+
+def _make_timeout(timeout) -> httpx.Timeout:
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Get the pooled client of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = httpx.AsyncClient(
+            timeout=_make_timeout(_settings["timeout"]),
+            limits=httpx.Limits(
+                max_connections=_settings["max_connections"],
+                max_keepalive_connections=_settings["max_keepalive_connections"],
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=_settings["retries"]),
+        )
+    return client
+
+
+async def aclose() -> None:
+    """
+    Close the pooled client of the running event loop
+    """
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _should_retry(method: str, status_code: int) -> bool:
+    if status_code == 429:
+        return True
+    return status_code in RETRY_STATUS_CODES and method.upper() in IDEMPOTENT_METHODS
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+    if retry_after is not None:
+        return retry_after
+    return _settings["backoff_factor"] * (2**attempt)
+
+
+async def request(
+    method: str, url: str, rate_limiter: RateLimiter = None, **kwargs
+) -> httpx.Response:
+    client = get_client()
+    attempt = 0
+    while True:
+        if rate_limiter is None:
+            response = await client.request(method, url, **kwargs)
+        else:
+            async with rate_limiter.limit_async():
+                response = await client.request(method, url, **kwargs)
+            rate_limiter.update(response.status_code, response.headers)
+        if attempt >= _settings["retries"] or not _should_retry(
+            method, response.status_code
+        ):
+            return response
+        await asyncio.sleep(_retry_delay(response, attempt))
+        attempt += 1
+
+
+async def get(url: str, params=None, **kwargs) -> httpx.Response:
+    return await request("GET", url, params=params, **kwargs)
+
+
+async def post(url: str, data=None, json=None, **kwargs) -> httpx.Response:
+    return await request("POST", url, data=data, json=json, **kwargs)
+
+
+async def put(url: str, data=None, json=None, **kwargs) -> httpx.Response:
+    return await request("PUT", url, data=data, json=json, **kwargs)
+
+
+async def delete(url: str, json=None, **kwargs) -> httpx.Response:
+    # httpx.AsyncClient.delete() doesn't take a body, go through request()
+    return await request("DELETE", url, json=json, **kwargs)
+
+
+async def gather(
+    aws: Iterable[Awaitable],
+    limit: int = DEFAULT_CONCURRENCY,
+    return_exceptions: bool = False,
+) -> List[Any]:
+    """
+    Like asyncio.gather, but runs at most limit awaitables at a time
+
+    Args:
+        aws: coroutines or awaitables to run
+        limit: maximum number of awaitables running concurrently
+        return_exceptions: return exceptions as results instead of raising
+    Returns:
+        results in the same order as aws
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(
+        *[run(aw) for aw in aws], return_exceptions=return_exceptions
+    )
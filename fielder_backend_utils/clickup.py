@@ -1,8 +1,13 @@
 from typing import List
 
-import requests
+import httpx
 from requests.models import Response
 
+from fielder_backend_utils import async_http_client, http_client
+from fielder_backend_utils.rate_limit import RateLimiter
+
+CLICKUP_API_URL = "https://api.clickup.com/api/v2"
+
 
 class ClickUpTask:
     allowed_fields = ["name", "description", "markdown_description", "custom_fields"]
@@ -29,15 +34,17 @@ class ClickUpTask:
 
 
 class ClickUpAPIHelper:
-    def __init__(self, *, access_token: str) -> None:
-        self.base_url = "https://api.clickup.com/api/v2"
+    def __init__(self, *, access_token: str, rate_limiter: RateLimiter = None) -> None:
+        self.base_url = CLICKUP_API_URL
         self.access_token = access_token
+        self.rate_limiter = rate_limiter
 
     def create_task(self, *, list_id: int, task: ClickUpTask) -> Response:
-        return requests.post(
+        return http_client.post(
             self.base_url + f"/list/{list_id}/task",
             json=task.to_dict(),
             headers={"Authorization": self.access_token},
+            rate_limiter=self.rate_limiter,
         )
 
     def get_task(
@@ -47,17 +54,19 @@ class ClickUpAPIHelper:
             raise Exception(
                 "If you want to reference a task by it's custom task id, team_id must be provided."
             )
-        return requests.get(
+        return http_client.get(
             self.base_url + f"/task/{task_id}",
             params={"custom_task_ids": custom_task_ids, "team_id": team_id},
             headers={"Authorization": self.access_token},
+            rate_limiter=self.rate_limiter,
         )
 
     def set_custom_field(self, task_id: str, field_id: str, value: str) -> Response:
-        return requests.post(
+        return http_client.post(
             self.base_url + f"/task/{task_id}/field/{field_id}",
             json={"value": value},
             headers={"Authorization": self.access_token},
+            rate_limiter=self.rate_limiter,
         )
 
     def update_task(
@@ -71,11 +80,12 @@ class ClickUpAPIHelper:
             raise Exception(
                 "If you want to reference a task by it's custom task id, team_id must be provided."
             )
-        return requests.put(
+        return http_client.put(
             self.base_url + f"/task/{task_id}",
             json=data,
             params={"custom_task_ids": custom_task_ids, "team_id": team_id},
             headers={"Authorization": self.access_token},
+            rate_limiter=self.rate_limiter,
         )
 
     def set_task_status(
@@ -86,3 +96,79 @@ class ClickUpAPIHelper:
         team_id: int = None,
     ) -> Response:
         return self.update_task(task_id, {"status": status}, custom_task_ids, team_id)
+
+
+def _task_params(custom_task_ids: bool, team_id: int) -> dict:
+    if custom_task_ids == True and team_id is None:
+        raise Exception(
+            "If you want to reference a task by it's custom task id, team_id must be provided."
+        )
+    # encode like requests does: None dropped, booleans as True/False
+    params = {"custom_task_ids": custom_task_ids, "team_id": team_id}
+    return {key: str(value) for key, value in params.items() if value is not None}
+
+
+class AsyncClickUpAPIHelper:
+    """
+    asyncio counterpart of ClickUpAPIHelper, sharing the async_http_client pool.
+    Methods return httpx.Response instead of requests.Response.
+    """
+
+    def __init__(self, *, access_token: str, rate_limiter: RateLimiter = None) -> None:
+        self.base_url = CLICKUP_API_URL
+        self.access_token = access_token
+        self.rate_limiter = rate_limiter
+
+    async def create_task(self, *, list_id: int, task: ClickUpTask) -> httpx.Response:
+        return await async_http_client.post(
+            self.base_url + f"/list/{list_id}/task",
+            json=task.to_dict(),
+            headers={"Authorization": self.access_token},
+            rate_limiter=self.rate_limiter,
+        )
+
+    async def get_task(
+        self, task_id: str, custom_task_ids: bool = False, team_id: int = None
+    ) -> httpx.Response:
+        return await async_http_client.get(
+            self.base_url + f"/task/{task_id}",
+            params=_task_params(custom_task_ids, team_id),
+            headers={"Authorization": self.access_token},
+            rate_limiter=self.rate_limiter,
+        )
+
+    async def set_custom_field(
+        self, task_id: str, field_id: str, value: str
+    ) -> httpx.Response:
+        return await async_http_client.post(
+            self.base_url + f"/task/{task_id}/field/{field_id}",
+            json={"value": value},
+            headers={"Authorization": self.access_token},
+            rate_limiter=self.rate_limiter,
+        )
+
+    async def update_task(
+        self,
+        task_id: str,
+        data: dict,
+        custom_task_ids: bool = False,
+        team_id: int = None,
+    ) -> httpx.Response:
+        return await async_http_client.put(
+            self.base_url + f"/task/{task_id}",
+            json=data,
+            params=_task_params(custom_task_ids, team_id),
+            headers={"Authorization": self.access_token},
+            rate_limiter=self.rate_limiter,
+        )
+
+    async def set_task_status(
+        self,
+        task_id: str,
+        status: str,
+        custom_task_ids: bool = False,
+        team_id: int = None,
+    ) -> httpx.Response:
+        return await self.update_task(
+            task_id, {"status": status}, custom_task_ids, team_id
+        )
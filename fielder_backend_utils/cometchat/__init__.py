@@ -1 +1,6 @@
-from .helpers import CometChatHelper
+from .helpers import (
+    AsyncCometChatHelper,
+    CometChatAuthTokenCache,
+    CometChatHelper,
+    FirestoreAuthTokenStore,
+)
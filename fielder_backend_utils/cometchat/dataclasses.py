@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from typing import Any, Dict, Optional
 
 
@@ -18,9 +18,27 @@ class CometChatUser:
     tags: Optional[list[str]] = None
     authToken: Optional[str] = None
 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CometChatUser":
+        # ignores fields the API adds later
+        if _USER_FIELDS.issuperset(data):
+            return cls(**data)
+        return cls(**{k: v for k, v in data.items() if k in _USER_FIELDS})
+
 
 @dataclass
 class CometChatAuthToken:
     uid: str
     authToken: str
     createdAt: int
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CometChatAuthToken":
+        # ignores fields the API adds later
+        if _AUTH_TOKEN_FIELDS.issuperset(data):
+            return cls(**data)
+        return cls(**{k: v for k, v in data.items() if k in _AUTH_TOKEN_FIELDS})
+
+
+_USER_FIELDS = frozenset(f.name for f in fields(CometChatUser))
+_AUTH_TOKEN_FIELDS = frozenset(f.name for f in fields(CometChatAuthToken))
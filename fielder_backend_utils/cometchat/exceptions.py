@@ -20,3 +20,7 @@ class CometChatOnBehalfOfUIDNotFoundException(CometChatException):
 
 class CometChatBadRequestException(CometChatException):
     pass
+
+
+class CometChatTooManyRequestsException(CometChatException):
+    pass
@@ -1,9 +1,15 @@
+import time
 from base64 import b32decode, b32encode
-from copy import deepcopy
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-import requests
-from requests import Response
+import httpx
+from requests import RequestException, Response
+
+from fielder_backend_utils import async_http_client, http_client, make_chunks
+from fielder_backend_utils.cache import TTLCache
+from fielder_backend_utils.rate_limit import RateLimiter
 
 from .dataclasses import CometChatAuthToken, CometChatUser
 from .enums import CometChatErrorCodes
@@ -12,13 +18,101 @@ from .exceptions import (
     CometChatBadRequestException,
     CometChatException,
     CometChatOnBehalfOfUIDNotFoundException,
+    CometChatTooManyRequestsException,
     CometChatUIDAlreadyExistsException,
     CometChatUIDNotFoundException,
 )
 
-
-class CometChatHelper:
-    def __init__(self, app_id: str, region: str, api_key: str) -> None:
+_ERROR_CODE_EXCEPTIONS = {
+    CometChatErrorCodes.ERR_UID_ALREADY_EXISTS.name: CometChatUIDAlreadyExistsException,
+    CometChatErrorCodes.ERR_UID_NOT_FOUND.name: CometChatUIDNotFoundException,
+    CometChatErrorCodes.ERR_AUTH_TOKEN_NOT_FOUND.name: CometChatAuthTokenNotFoundException,
+    CometChatErrorCodes.ERR_ON_BEHALF_OF_UID_NOT_FOUND.name: CometChatOnBehalfOfUIDNotFoundException,
+    CometChatErrorCodes.ERR_BAD_REQUEST.name: CometChatBadRequestException,
+}
+
+# maximum number of uids in a message multipleReceivers
+MULTIPLE_RECEIVERS_LIMIT = 25
+BULK_MAX_WORKERS = 8
+
+
+def _create_user_payload(
+    uid: str,
+    name: str,
+    avatar: Optional[str] = None,
+    link: Optional[str] = None,
+    role: Optional[str] = None,
+    metadata: Optional[str] = None,
+    with_auth_token: Optional[bool] = None,
+    tags: Optional[list[str]] = None,
+) -> dict:
+    payload = {}
+
+    payload["uid"] = uid
+    payload["name"] = name
+
+    if avatar:
+        payload["avatar"] = avatar
+    if link:
+        payload["link"] = link
+    if role:
+        payload["role"] = role
+    if metadata:
+        payload["metadata"] = metadata
+    if with_auth_token:
+        payload["withAuthToken"] = with_auth_token
+    if tags:
+        payload["tags"] = tags
+
+    return payload
+
+
+def _update_user_payload(
+    name: Optional[str] = None,
+    avatar: Optional[str] = None,
+    link: Optional[str] = None,
+    role: Optional[str] = None,
+    metadata: Optional[str] = None,
+    tags: Optional[list[str]] = None,
+) -> dict:
+    payload = {}
+
+    if name:
+        payload["name"] = name
+    if avatar:
+        payload["avatar"] = avatar
+    if link:
+        payload["link"] = link
+    if role:
+        payload["role"] = role
+    if metadata:
+        payload["metadata"] = metadata
+    if tags:
+        payload["tags"] = tags
+
+    return payload
+
+
+def _text_message_payload(
+    text: str, receiver_uids: list[str], metadata: Optional[dict]
+) -> dict:
+    return {
+        "receiverType": "user",
+        "category": "message",
+        "type": "text",
+        "data": {
+            "text": text,
+            "metadata": metadata,
+        },
+        "multipleReceivers": {"uids": receiver_uids},
+    }
+
+
+class _BaseCometChatHelper:
+    def __init__(
+        self, app_id: str, region: str, api_key: str, rate_limiter: RateLimiter = None
+    ) -> None:
+        self.rate_limiter = rate_limiter
         self.base_url = f"https://{app_id}.api-{region}.cometchat.io/v3"
         self.default_headers = {
             "apiKey": f"{api_key}",
@@ -26,6 +120,42 @@ class CometChatHelper:
             "Accept": "application/json",
         }
 
+    def _parse_response(
+        self, response: Union[Response, httpx.Response]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Parse the response body once and return its data,
+        raising the CometChatException matching the error code on failure
+        """
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+
+        if response.status_code >= 400:
+            if response.status_code == 429:
+                raise CometChatTooManyRequestsException(response.text)
+            error = body.get("error") if isinstance(body, dict) else None
+            if not isinstance(error, dict):
+                raise CometChatException(response.text)
+            exception = _ERROR_CODE_EXCEPTIONS.get(error.get("code"))
+            if exception is None:
+                raise CometChatException(response.text)
+            raise exception(error.get("message"))
+
+        return body.get("data") if isinstance(body, dict) else None
+
+    def _parse_data(self, response: Union[Response, httpx.Response]) -> Dict[str, Any]:
+        """
+        Like _parse_response(), for endpoints returning an object
+        """
+        data = self._parse_response(response)
+        if not isinstance(data, dict):
+            raise CometChatException(f"unexpected response: {response.text}")
+        return data
+
+
+class CometChatHelper(_BaseCometChatHelper):
     def create_user(
         self,
         uid: str,
@@ -37,42 +167,27 @@ class CometChatHelper:
         with_auth_token: Optional[bool] = None,
         tags: Optional[list[str]] = None,
     ) -> CometChatUser:
-        payload = {}
-
-        payload["uid"] = uid
-        payload["name"] = name
-
-        if avatar:
-            payload["avatar"] = avatar
-        if link:
-            payload["link"] = link
-        if role:
-            payload["role"] = role
-        if metadata:
-            payload["metadata"] = metadata
-        if with_auth_token:
-            payload["withAuthToken"] = with_auth_token
-        if tags:
-            payload["tags"] = tags
-
-        response = requests.post(
-            self.base_url + "/users", json=payload, headers=self.default_headers
+        payload = _create_user_payload(
+            uid, name, avatar, link, role, metadata, with_auth_token, tags
         )
 
-        if not response.ok:
-            self._handle_bad_request(response)
+        response = http_client.post(
+            self.base_url + "/users",
+            json=payload,
+            headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
+        )
 
-        return CometChatUser(**response.json()["data"])
+        return CometChatUser.from_dict(self._parse_data(response))
 
     def get_user(self, uid: str) -> CometChatUser:
-        response = requests.get(
-            self.base_url + f"/users/{uid}", headers=self.default_headers
+        response = http_client.get(
+            self.base_url + f"/users/{uid}",
+            headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
         )
 
-        if not response.ok:
-            self._handle_bad_request(response)
-
-        return CometChatUser(**response.json()["data"])
+        return CometChatUser.from_dict(self._parse_data(response))
 
     def update_user(
         self,
@@ -84,39 +199,26 @@ class CometChatHelper:
         metadata: Optional[str] = None,
         tags: Optional[list[str]] = None,
     ) -> CometChatUser:
-        payload = {}
-
-        if name:
-            payload["name"] = name
-        if avatar:
-            payload["avatar"] = avatar
-        if link:
-            payload["link"] = link
-        if role:
-            payload["role"] = role
-        if metadata:
-            payload["metadata"] = metadata
-        if tags:
-            payload["tags"] = tags
-
-        response = requests.put(
-            self.base_url + f"/users/{uid}", json=payload, headers=self.default_headers
-        )
+        payload = _update_user_payload(name, avatar, link, role, metadata, tags)
 
-        if not response.ok:
-            self._handle_bad_request(response)
+        response = http_client.put(
+            self.base_url + f"/users/{uid}",
+            json=payload,
+            headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
+        )
 
-        return CometChatUser(**response.json()["data"])
+        return CometChatUser.from_dict(self._parse_data(response))
 
     def delete_user(self, uid: str, permanent: bool = True) -> None:
-        response = requests.delete(
+        response = http_client.delete(
             self.base_url + f"/users/{uid}",
             json={"permanent": permanent},
             headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
         )
 
-        if not response.ok:
-            self._handle_bad_request(response)
+        self._parse_response(response)
 
     def send_text_message(
         self,
@@ -126,76 +228,423 @@ class CometChatHelper:
         metadata: Optional[dict] = dict(),
     ) -> None:
         if len(receiver_uids) > 0:
-            payload = {
-                "receiverType": "user",
-                "category": "message",
-                "type": "text",
-                "data": {
-                    "text": text,
-                    "metadata": metadata,
-                },
-                "multipleReceivers": {"uids": receiver_uids},
-            }
-
-            headers = deepcopy(self.default_headers)
-            headers.update({"onBehalfOf": sender_uid})
-
-            response = requests.post(
-                self.base_url + "/messages", json=payload, headers=headers
+            payload = _text_message_payload(text, receiver_uids, metadata)
+
+            headers = {**self.default_headers, "onBehalfOf": sender_uid}
+
+            response = http_client.post(
+                self.base_url + "/messages",
+                json=payload,
+                headers=headers,
+                rate_limiter=self.rate_limiter,
             )
 
-            if not response.ok:
-                self._handle_bad_request(response)
+            self._parse_response(response)
 
     def create_auth_token(self, uid: str, force: bool = False) -> CometChatAuthToken:
-        response = requests.post(
+        response = http_client.post(
             self.base_url + f"/users/{uid}/auth_tokens",
             json={"force": force},
             headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
         )
 
-        if not response.ok:
-            self._handle_bad_request(response)
-
-        return CometChatAuthToken(**response.json()["data"])
+        return CometChatAuthToken.from_dict(self._parse_data(response))
 
     def get_auth_token(self, uid: str, auth_token: str) -> CometChatAuthToken:
-        response = requests.get(
+        response = http_client.get(
+            self.base_url + f"/users/{uid}/auth_tokens/{auth_token}",
+            headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
+        )
+
+        return CometChatAuthToken.from_dict(self._parse_data(response))
+
+    def create_or_update_user(self, user: CometChatUser) -> CometChatUser:
+        """
+        Create the user, or update it if the uid already exists
+        """
+        try:
+            return self.create_user(
+                user.uid,
+                user.name,
+                avatar=user.avatar,
+                link=user.link,
+                role=user.role,
+                metadata=user.metadata,
+                tags=user.tags,
+            )
+        except CometChatUIDAlreadyExistsException:
+            return self.update_user(
+                user.uid,
+                name=user.name,
+                avatar=user.avatar,
+                link=user.link,
+                role=user.role,
+                metadata=user.metadata,
+                tags=user.tags,
+            )
+
+    def bulk_create_or_update_users(
+        self, users: List[CometChatUser], max_workers: int = BULK_MAX_WORKERS
+    ) -> List[Union[CometChatUser, CometChatException, RequestException]]:
+        """
+        Concurrently create or update many users
+
+        Args:
+            users: users to provision
+            max_workers: maximum number of concurrent requests
+        Returns:
+            results in the same order as users, the CometChatUser returned by
+            the API or the CometChatException or RequestException raised for
+            that user
+        """
+
+        def provision(user):
+            try:
+                return self.create_or_update_user(user)
+            except (CometChatException, RequestException) as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(provision, users))
+
+    def broadcast_text_message(
+        self,
+        text: str,
+        sender_uid: str,
+        receiver_uids: list[str],
+        metadata: Optional[dict] = dict(),
+        chunk_size: int = MULTIPLE_RECEIVERS_LIMIT,
+        max_workers: int = BULK_MAX_WORKERS,
+    ) -> List[Optional[Union[CometChatException, RequestException]]]:
+        """
+        send_text_message to any number of receivers, in chunks of
+        chunk_size receivers sent concurrently
+
+        Returns:
+            one result per chunk of receiver_uids, in order: None if the
+            chunk was sent, or the CometChatException or RequestException
+            raised for it
+        """
+
+        def send(chunk):
+            try:
+                self.send_text_message(text, sender_uid, chunk, metadata)
+            except (CometChatException, RequestException) as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(send, make_chunks(receiver_uids, chunk_size)))
+
+
+class AsyncCometChatHelper(_BaseCometChatHelper):
+    """
+    asyncio counterpart of CometChatHelper, sharing the async_http_client pool
+    """
+
+    async def create_user(
+        self,
+        uid: str,
+        name: str,
+        avatar: Optional[str] = None,
+        link: Optional[str] = None,
+        role: Optional[str] = None,
+        metadata: Optional[str] = None,
+        with_auth_token: Optional[bool] = None,
+        tags: Optional[list[str]] = None,
+    ) -> CometChatUser:
+        payload = _create_user_payload(
+            uid, name, avatar, link, role, metadata, with_auth_token, tags
+        )
+
+        response = await async_http_client.post(
+            self.base_url + "/users",
+            json=payload,
+            headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
+        )
+
+        return CometChatUser.from_dict(self._parse_data(response))
+
+    async def get_user(self, uid: str) -> CometChatUser:
+        response = await async_http_client.get(
+            self.base_url + f"/users/{uid}",
+            headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
+        )
+
+        return CometChatUser.from_dict(self._parse_data(response))
+
+    async def update_user(
+        self,
+        uid: str,
+        name: Optional[str] = None,
+        avatar: Optional[str] = None,
+        link: Optional[str] = None,
+        role: Optional[str] = None,
+        metadata: Optional[str] = None,
+        tags: Optional[list[str]] = None,
+    ) -> CometChatUser:
+        payload = _update_user_payload(name, avatar, link, role, metadata, tags)
+
+        response = await async_http_client.put(
+            self.base_url + f"/users/{uid}",
+            json=payload,
+            headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
+        )
+
+        return CometChatUser.from_dict(self._parse_data(response))
+
+    async def delete_user(self, uid: str, permanent: bool = True) -> None:
+        response = await async_http_client.delete(
+            self.base_url + f"/users/{uid}",
+            json={"permanent": permanent},
+            headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
+        )
+
+        self._parse_response(response)
+
+    async def send_text_message(
+        self,
+        text: str,
+        sender_uid: str,
+        receiver_uids: list[str],
+        metadata: Optional[dict] = dict(),
+    ) -> None:
+        if len(receiver_uids) > 0:
+            payload = _text_message_payload(text, receiver_uids, metadata)
+
+            headers = {**self.default_headers, "onBehalfOf": sender_uid}
+
+            response = await async_http_client.post(
+                self.base_url + "/messages",
+                json=payload,
+                headers=headers,
+                rate_limiter=self.rate_limiter,
+            )
+
+            self._parse_response(response)
+
+    async def create_auth_token(
+        self, uid: str, force: bool = False
+    ) -> CometChatAuthToken:
+        response = await async_http_client.post(
+            self.base_url + f"/users/{uid}/auth_tokens",
+            json={"force": force},
+            headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
+        )
+
+        return CometChatAuthToken.from_dict(self._parse_data(response))
+
+    async def get_auth_token(self, uid: str, auth_token: str) -> CometChatAuthToken:
+        response = await async_http_client.get(
             self.base_url + f"/users/{uid}/auth_tokens/{auth_token}",
             headers=self.default_headers,
+            rate_limiter=self.rate_limiter,
+        )
+
+        return CometChatAuthToken.from_dict(self._parse_data(response))
+
+
+class FirestoreAuthTokenStore:
+    """
+    Persists CometChat auth tokens in a Firestore collection, one document per uid
+    """
+
+    def __init__(self, db, collection: str = "cometchat_auth_tokens") -> None:
+        self.collection = db.collection(collection)
+
+    def get(self, uid: str) -> Optional[Tuple[CometChatAuthToken, float]]:
+        snapshot = self.collection.document(uid).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        validated_at = data.pop("validated_at", 0)
+        return CometChatAuthToken.from_dict(data), validated_at
+
+    def set(
+        self, uid: str, auth_token: CometChatAuthToken, validated_at: float
+    ) -> None:
+        self.collection.document(uid).set(
+            {**asdict(auth_token), "validated_at": validated_at}
         )
 
-        if not response.ok:
-            self._handle_bad_request(response)
+    def delete(self, uid: str) -> None:
+        self.collection.document(uid).delete()
 
-        return CometChatAuthToken(**response.json()["data"])
 
-    def _handle_bad_request(self, response: Response) -> None:
-        code = response.json()["error"]["code"]
-        message = response.json()["error"]["message"]
+class CometChatAuthTokenCache:
+    """
+    Caches auth tokens per uid so logins don't mint or fetch a token every time.
 
-        if code == CometChatErrorCodes.ERR_UID_ALREADY_EXISTS.name:
-            raise CometChatUIDAlreadyExistsException(message)
+    Tokens are kept in an in-process LRU, backed by an optional persistent
+    store (e.g. FirestoreAuthTokenStore) shared between instances. A cached
+    token is returned as is for ttl seconds after it was last validated, then
+    it is checked with get_auth_token. Tokens CometChat doesn't know anymore
+    are evicted and a new one is created.
 
-        elif code == CometChatErrorCodes.ERR_UID_NOT_FOUND.name:
-            raise CometChatUIDNotFoundException(message)
+    Args:
+        helper: CometChatHelper used to create and validate tokens
+        ttl: seconds a token is trusted without validating it
+        maxsize: maximum number of uids kept in memory
+        store: optional persistent store with get/set/delete
+    """
+
+    def __init__(
+        self,
+        helper: CometChatHelper,
+        ttl: float = 3600,
+        maxsize: int = 10000,
+        store: FirestoreAuthTokenStore = None,
+    ) -> None:
+        self.helper = helper
+        self.ttl = ttl
+        self.store = store
+        # uid -> (CometChatAuthToken, validated_at)
+        self._cache = TTLCache(maxsize=maxsize)
+
+    def _save(self, uid: str, auth_token: CometChatAuthToken) -> None:
+        validated_at = time.time()
+        self._cache.set(uid, (auth_token, validated_at))
+        if self.store is not None:
+            self.store.set(uid, auth_token, validated_at)
+
+    def invalidate(self, uid: str) -> None:
+        self._cache.pop(uid)
+        if self.store is not None:
+            self.store.delete(uid)
+
+    def get_auth_token(self, uid: str) -> CometChatAuthToken:
+        entry = self._cache.get(uid)
+        if entry is None and self.store is not None:
+            entry = self.store.get(uid)
+            if entry is not None:
+                self._cache.set(uid, entry)
+
+        if entry is not None:
+            auth_token, validated_at = entry
+            if time.time() - validated_at < self.ttl:
+                return auth_token
+            try:
+                self.helper.get_auth_token(uid, auth_token.authToken)
+                self._save(uid, auth_token)
+                return auth_token
+            except CometChatAuthTokenNotFoundException:
+                self.invalidate(uid)
+
+        auth_token = self.helper.create_auth_token(uid)
+        self._save(uid, auth_token)
+        return auth_token
+
+
+# CometChat uids are lower case base32 with "_" padding
+_BASE32_ALPHABET = "abcdefghijklmnopqrstuvwxyz234567"
+# every 10 bits of input map to 2 characters
+_BASE32_PAIRS = [a + b for a in _BASE32_ALPHABET for b in _BASE32_ALPHABET]
+_BASE32_SHIFTS = {}
+_ENCODE_TABLE = bytes.maketrans(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZ=", b"abcdefghijklmnopqrstuvwxyz_"
+)
+_DECODE_TABLE = bytes.maketrans(
+    b"abcdefghijklmnopqrstuvwxyz_", b"ABCDEFGHIJKLMNOPQRSTUVWXYZ="
+)
+# maps the base32 alphabet to the digits int(..., 32) expects,
+# and 0, 1, 8, 9 to a character int() rejects
+_INT_DIGITS_TABLE = str.maketrans(
+    _BASE32_ALPHABET + _BASE32_ALPHABET[:26].upper() + "0189",
+    "0123456789abcdefghijklmnopqrstuv" + "0123456789abcdefghijklmnop" + "!!!!",
+)
 
-        elif code == CometChatErrorCodes.ERR_AUTH_TOKEN_NOT_FOUND.name:
-            raise CometChatAuthTokenNotFoundException(message)
 
-        elif code == CometChatErrorCodes.ERR_ON_BEHALF_OF_UID_NOT_FOUND.name:
-            raise CometChatOnBehalfOfUIDNotFoundException(message)
+def _encode(raw: bytes) -> str:
+    if len(raw) % 5:
+        # padded, rare for Firestore ids which are 20 characters long
+        return b32encode(raw).translate(_ENCODE_TABLE).decode()
+    shifts = _BASE32_SHIFTS.get(len(raw))
+    if shifts is None:
+        shifts = _BASE32_SHIFTS[len(raw)] = range(len(raw) * 8 - 10, -1, -10)
+    n = int.from_bytes(raw, "big")
+    return "".join([_BASE32_PAIRS[(n >> shift) & 1023] for shift in shifts])
 
-        elif code == CometChatErrorCodes.ERR_BAD_REQUEST.name:
-            raise CometChatBadRequestException(message)
 
-        else:
-            raise CometChatException(response.text)
+def _decode(uid: str) -> bytes:
+    # isalnum() rules out padding, signs and whitespace int() would accept
+    if len(uid) % 8 == 0 and uid.isalnum():
+        try:
+            return int(uid.translate(_INT_DIGITS_TABLE), 32).to_bytes(
+                len(uid) // 8 * 5, "big"
+            )
+        except ValueError:
+            pass
+    return b32decode(uid.encode().translate(_DECODE_TABLE))
 
 
 def encode_uid(uid: str) -> str:
-    return b32encode(uid.encode()).decode().lower().replace("=", "_")
+    return _encode(uid.encode())
 
 
 def decode_uid(uid: str) -> str:
-    return b32decode(uid.upper().replace("_", "=")).decode()
+    return _decode(uid).decode()
+
+
+def encode_uids(uids: List[str]) -> List[str]:
+    """
+    encode_uid for many uids
+    """
+    return [_encode(uid.encode()) for uid in uids]
+
+
+def decode_uids(uids: List[str]) -> List[str]:
+    """
+    decode_uid for many uids
+    """
+    return [_decode(uid).decode() for uid in uids]
+
+
+class UIDMemo:
+    """
+    Bidirectional memo of uid <-> CometChat uid, for jobs that map the same
+    ids back and forth many times
+    """
+
+    def __init__(self) -> None:
+        self.encoded = {}  # uid -> CometChat uid
+        self.decoded = {}  # CometChat uid -> uid
+
+    def _add(self, uids: List[str], encoded_uids: List[str]) -> None:
+        self.encoded.update(zip(uids, encoded_uids))
+        self.decoded.update(zip(encoded_uids, uids))
+
+    def encode(self, uid: str) -> str:
+        encoded = self.encoded.get(uid)
+        if encoded is None:
+            encoded = encode_uid(uid)
+            self._add([uid], [encoded])
+        return encoded
+
+    def decode(self, uid: str) -> str:
+        decoded = self.decoded.get(uid)
+        if decoded is None:
+            decoded = decode_uid(uid)
+            self._add([decoded], [uid])
+        return decoded
+
+    def encode_many(self, uids: List[str]) -> List[str]:
+        missing = [uid for uid in dict.fromkeys(uids) if uid not in self.encoded]
+        if missing:
+            self._add(missing, encode_uids(missing))
+        return [self.encoded[uid] for uid in uids]
+
+    def decode_many(self, uids: List[str]) -> List[str]:
+        missing = [uid for uid in dict.fromkeys(uids) if uid not in self.decoded]
+        if missing:
+            self._add(decode_uids(missing), missing)
+        return [self.decoded[uid] for uid in uids]
+
+    def clear(self) -> None:
+        self.encoded.clear()
+        self.decoded.clear()
@@ -1,8 +1,23 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from datetime import datetime
+from itertools import islice
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
 
-import requests
 from google.cloud.firestore_v1.client import Client
 
+from fielder_backend_utils import async_http_client, http_client
+from fielder_backend_utils.cache import TTLCache
+from fielder_backend_utils.multi_batch import BATCH_MAX_WRITES, MultiBatch
+from fielder_backend_utils.rate_limit import RateLimiter
+
+
+COMPANY_HOUSE_API_URL = "https://autocomplete-dev.fielder.one/company_house"
+
 
 def get_sic_code_description(db, code):
     sic_code_snapshot = db.collection("sic_codes").document(code).get()
@@ -12,38 +27,302 @@ def get_sic_code_description(db, code):
     return None
 
 
-def get_directors(api_key, company_number):
-    officers_response = requests.get(
-        f"https://autocomplete-dev.fielder.one/company_house/company/{company_number}/officers",
+def get_sic_code_descriptions(db, codes: List[str]) -> Dict[str, Optional[str]]:
+    """
+    get_sic_code_description for many codes in one db.get_all() call
+
+    Args:
+        db: Firestore client
+        codes: SIC codes
+    Returns:
+        dict mapping every code to its description, None if unknown
+    """
+    descriptions = dict.fromkeys(codes)
+    if descriptions:
+        collection = db.collection("sic_codes")
+        refs = [collection.document(code) for code in descriptions]
+        for snapshot in db.get_all(refs):
+            if snapshot.exists:
+                descriptions[snapshot.id] = snapshot.to_dict().get("description", None)
+    return descriptions
+
+
+def normalize_company_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+class CompaniesHouseCache:
+    """
+    LRU cache of Companies House responses: company searches, profiles,
+    officers and filing histories.
+
+    Responses are fresh for ttl seconds. After that, responses that came
+    with an ETag are revalidated with If-None-Match and kept if the proxy
+    answers 304 Not Modified, others are fetched again. Searches are keyed
+    by the normalized company name.
+
+    Args:
+        ttl: seconds a response is used without revalidating it
+        maxsize: maximum number of responses kept
+        timer: clock used for expiry
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300,
+        maxsize: int = 1024,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.timer = timer
+        self.revalidated = 0  # stale responses confirmed by a 304
+        # key -> (expires_at, etag, data), kept after expiry for revalidation
+        self._cache = TTLCache(maxsize=maxsize)
+
+    @staticmethod
+    def key(path: str, params: Optional[Dict[str, str]] = None) -> Tuple:
+        params = dict(params or {})
+        if "q" in params:
+            params["q"] = normalize_company_name(params["q"])
+        return (path, *sorted(params.items()))
+
+    def get(self, key: Tuple) -> Optional[Tuple[float, Optional[str], Any]]:
+        return self._cache.get(key)
+
+    def set(self, key: Tuple, etag: Optional[str], data: Any) -> None:
+        self._cache.set(key, (self.timer() + self.ttl, etag, data))
+
+    def is_fresh(self, entry: Tuple[float, Optional[str], Any]) -> bool:
+        return self.timer() < entry[0]
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        return self._cache.hit_rate
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+def _get_json(
+    api_key,
+    path: str,
+    rate_limiter: RateLimiter = None,
+    cache: CompaniesHouseCache = None,
+    params: Optional[Dict[str, str]] = None,
+) -> Tuple[int, Any]:
+    """
+    GET a Companies House path, through cache if given
+
+    Returns:
+        (status_code, data): data is the decoded JSON of 200 responses,
+        None otherwise
+    """
+    entry = None
+    headers = {}
+    if cache is not None:
+        key = cache.key(path, params)
+        entry = cache.get(key)
+        if entry is not None:
+            if cache.is_fresh(entry):
+                return 200, entry[2]
+            if entry[1]:
+                headers["If-None-Match"] = entry[1]
+
+    response = http_client.get(
+        f"{COMPANY_HOUSE_API_URL}{path}",
+        params=params,
         auth=(api_key, ""),
+        headers=headers,
+        rate_limiter=rate_limiter,
     )
+    if response.status_code == 304 and entry is not None:
+        cache.revalidated += 1
+        cache.set(key, response.headers.get("ETag", entry[1]), entry[2])
+        return 200, entry[2]
+    if response.status_code != 200:
+        return response.status_code, None
+    data = response.json()
+    if cache is not None:
+        cache.set(key, response.headers.get("ETag"), data)
+    return 200, data
 
-    if officers_response.status_code == 200:
 
-        directors = [
+class SICCodeRegistry:
+    """
+    In-memory copy of the sic_codes collection, code -> description.
+
+    The collection is read in full on first use and kept as an immutable
+    mapping. It is reloaded once ttl seconds have passed, or kept up to date
+    by a snapshot listener with listen=True, call close() to stop it.
+
+    Args:
+        db: Firestore client
+        ttl: seconds before the codes are reloaded, None to never reload
+        listen: keep the codes up to date with a snapshot listener
+        collection: SIC codes collection
+    """
+
+    def __init__(
+        self,
+        db,
+        ttl: Optional[float] = 24 * 3600,
+        listen: bool = False,
+        collection: str = "sic_codes",
+    ) -> None:
+        self.collection = db.collection(collection)
+        self.ttl = ttl
+        self.listen = listen
+        self._codes: Optional[Mapping[str, Optional[str]]] = None
+        self._loaded_at = 0.0
+        self._watch = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _to_mapping(snapshots) -> Mapping[str, Optional[str]]:
+        return MappingProxyType(
             {
-                "name": item["name"],
-                "appointment_date": datetime.strptime(item["appointed_on"], "%Y-%m-%d"),
+                snapshot.id: snapshot.to_dict().get("description", None)
+                for snapshot in snapshots
             }
-            for item in officers_response.json()["items"]
-            if "resigned_on" not in item
-        ]
+        )
 
-        return directors
+    def _on_snapshot(self, snapshots, changes, read_time) -> None:
+        self._codes = self._to_mapping(snapshots)
+        self._loaded_at = time.monotonic()
 
+    def _expired(self) -> bool:
+        if self._codes is None:
+            return True
+        if self._watch is not None or self.ttl is None:
+            return False
+        return time.monotonic() - self._loaded_at >= self.ttl
 
-def get_last_filing_date(api_key, company_number):
-    filing_history_response = requests.get(
-        f"https://autocomplete-dev.fielder.one/company_house/company/{company_number}/filing-history",
-        auth=(api_key, ""),
+    @property
+    def codes(self) -> Mapping[str, Optional[str]]:
+        """
+        Immutable mapping of every SIC code to its description
+        """
+        if self._expired():
+            with self._lock:
+                if self._expired():
+                    self._codes = self._to_mapping(self.collection.stream())
+                    self._loaded_at = time.monotonic()
+                    if self.listen and self._watch is None:
+                        self._watch = self.collection.on_snapshot(self._on_snapshot)
+        return self._codes
+
+    def get(self, code: str) -> Optional[str]:
+        return self.codes.get(code)
+
+    def get_many(self, codes: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Same as get_sic_code_descriptions, without any database access
+        """
+        mapping = self.codes
+        return {code: mapping.get(code) for code in codes}
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._codes = None
+
+    def close(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+
+def _parse_directors(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": item["name"],
+            "appointment_date": datetime.strptime(item["appointed_on"], "%Y-%m-%d"),
+        }
+        for item in data["items"]
+        if "resigned_on" not in item
+    ]
+
+
+def _parse_last_filing_date(data: Dict[str, Any]) -> Optional[datetime]:
+    items = data["items"]
+    if items:
+        date = items[0].get("date")
+        if date:
+            return datetime(*[int(_) for _ in date.split("-")])
+
+
+def get_directors(
+    api_key,
+    company_number,
+    rate_limiter: RateLimiter = None,
+    cache: CompaniesHouseCache = None,
+):
+    status_code, data = _get_json(
+        api_key, f"/company/{company_number}/officers", rate_limiter, cache
+    )
+    if status_code == 200:
+        return _parse_directors(data)
+
+
+def get_last_filing_date(
+    api_key,
+    company_number,
+    rate_limiter: RateLimiter = None,
+    cache: CompaniesHouseCache = None,
+):
+    status_code, data = _get_json(
+        api_key, f"/company/{company_number}/filing-history", rate_limiter, cache
+    )
+    if status_code == 200:
+        return _parse_last_filing_date(data)
+
+
+def _parse_company_data(response_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    company data from a company profile, without the SIC code
+    descriptions, directors and last filing date
+    """
+    company_data = {}
+    company_data["company_name"] = response_data.get("company_name")
+    company_data["last_updated"] = datetime.now()
+    company_data["incorporation_date"] = datetime.strptime(
+        response_data["date_of_creation"], "%Y-%m-%d"
     )
+    company_data["registration_number"] = response_data.get("company_number")
+    company_data["directors"] = []
+    company_data["sic_codes"] = []
+    company_data["last_filing_date"] = None
+
+    # Address
+    address = response_data.get("registered_office_address", None)
+    if address:
+        company_data["address"] = {
+            "name": address.get("address_line_1", None),
+            "street": address.get("address_line_2", None),
+            "town": address.get("locality", None),
+            "county": address.get("region", None),
+            "country": address.get("country", None),
+            "postcode": address.get("postal_code", None),
+            "po_box": None,
+        }
+    return company_data
+
 
-    if filing_history_response.status_code == 200:
-        items = filing_history_response.json()["items"]
-        if items:
-            date = items[0].get("date")
-            if date:
-                return datetime(*[int(_) for _ in date.split("-")])
+def _sic_codes(
+    db, response_data: Dict[str, Any], sic_code_registry: SICCodeRegistry = None
+) -> List[Dict[str, Any]]:
+    if sic_code_registry is None:
+        assert isinstance(db, Client), "Access to database is required to get SIC Codes"
+    codes = response_data.get("sic_codes", None)
+    if not codes:
+        return []
+    if sic_code_registry is not None:
+        descriptions = sic_code_registry.get_many(codes)
+    else:
+        descriptions = get_sic_code_descriptions(db, codes)
+    return [{"code": code, "description": descriptions[code]} for code in codes]
 
 
 def get_company_data(
@@ -53,88 +332,237 @@ def get_company_data(
     sic_codes=True,
     directors=True,
     filing_history=True,
+    sic_code_registry: SICCodeRegistry = None,
+    rate_limiter: RateLimiter = None,
+    cache: CompaniesHouseCache = None,
 ):
-    company_data = {}
-    response = requests.get(
-        f"https://autocomplete-dev.fielder.one/company_house/company/{company_number}",
-        auth=(api_key, ""),
-    )
-    if response.status_code == 200:
-        response_data = response.json()
-        company_data["company_name"] = response_data.get("company_name")
-        company_data["last_updated"] = datetime.now()
-        company_data["incorporation_date"] = datetime.strptime(
-            response_data["date_of_creation"], "%Y-%m-%d"
+    """
+    Company profile from Companies House, with its directors, last filing
+    date and SIC code descriptions. Officers and filing history are fetched
+    concurrently with the profile, SIC codes are resolved in one
+    db.get_all() call.
+
+    Args:
+        api_key: Companies House API key
+        company_number: company registration number
+        db: Firestore client, required for sic_codes
+        sic_codes: resolve SIC code descriptions
+        directors: fetch the current directors
+        filing_history: fetch the last filing date
+        sic_code_registry: resolve SIC codes from this registry instead of db
+        rate_limiter: optional RateLimiter for Companies House requests
+        cache: optional CompaniesHouseCache for Companies House responses
+    Returns:
+        company_data (dict), empty if the company profile wasn't found
+    """
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        profile = executor.submit(
+            _get_json, api_key, f"/company/{company_number}", rate_limiter, cache
         )
-        company_data["registration_number"] = response_data.get("company_number")
-        company_data["directors"] = []
-        company_data["sic_codes"] = []
-        company_data["last_filing_date"] = None
+        directors_future = (
+            executor.submit(get_directors, api_key, company_number, rate_limiter, cache)
+            if directors
+            else None
+        )
+        filing_date_future = (
+            executor.submit(
+                get_last_filing_date, api_key, company_number, rate_limiter, cache
+            )
+            if filing_history
+            else None
+        )
+
+        status_code, response_data = profile.result()
+        if status_code != 200:
+            return {}
 
-        # SIC Codes
+        company_data = _parse_company_data(response_data)
         if sic_codes:
-            assert isinstance(
-                db, Client
-            ), "Access to database is required to get SIC Codes"
-            company_data["sic_codes"] = (
-                [
-                    {
-                        "code": code,
-                        "description": get_sic_code_description(db, code),
-                    }
-                    for code in response_data["sic_codes"]
-                ]
-                if response_data.get("sic_codes", None)
-                else []
-            )
+            company_data["sic_codes"] = _sic_codes(db, response_data, sic_code_registry)
+        if directors_future is not None:
+            company_data["directors"] = directors_future.result()
+        if filing_date_future is not None:
+            company_data["last_filing_date"] = filing_date_future.result()
+    return company_data
 
-        # Address
-        if response_data.get("registered_office_address", None):
-            company_data["address"] = {
-                "name": response_data["registered_office_address"].get(
-                    "address_line_1", None
-                ),
-                "street": response_data["registered_office_address"].get(
-                    "address_line_2", None
-                ),
-                "town": response_data["registered_office_address"].get(
-                    "locality", None
-                ),
-                "county": response_data["registered_office_address"].get(
-                    "region", None
-                ),
-                "country": response_data["registered_office_address"].get(
-                    "country", None
-                ),
-                "postcode": response_data["registered_office_address"].get(
-                    "postal_code", None
-                ),
-                "po_box": None,
-            }
 
-        # Directors
-        if directors:
-            company_data.update({"directors": get_directors(api_key, company_number)})
+async def get_company_data_async(
+    api_key,
+    company_number,
+    db=None,
+    sic_codes=True,
+    directors=True,
+    filing_history=True,
+    sic_code_registry: SICCodeRegistry = None,
+):
+    """
+    asyncio variant of get_company_data, sharing the async_http_client pool.
+    SIC codes are resolved in a worker thread.
+    """
+    auth = (api_key, "")
+    url = f"{COMPANY_HOUSE_API_URL}/company/{company_number}"
+    calls = [async_http_client.get(url, auth=auth)]
+    if directors:
+        calls.append(async_http_client.get(f"{url}/officers", auth=auth))
+    if filing_history:
+        calls.append(async_http_client.get(f"{url}/filing-history", auth=auth))
+    responses = iter(await asyncio.gather(*calls))
 
-        # Filing History
-        if filing_history:
-            company_data["last_filing_date"] = get_last_filing_date(
-                api_key, company_number
-            )
+    response = next(responses)
+    if response.status_code != 200:
+        return {}
 
+    response_data = response.json()
+    company_data = _parse_company_data(response_data)
+    if sic_codes:
+        # Firestore client is blocking, asyncio.to_thread needs Python 3.9
+        company_data["sic_codes"] = await asyncio.get_event_loop().run_in_executor(
+            None, _sic_codes, db, response_data, sic_code_registry
+        )
+    if directors:
+        officers_response = next(responses)
+        company_data["directors"] = (
+            _parse_directors(officers_response.json())
+            if officers_response.status_code == 200
+            else None
+        )
+    if filing_history:
+        filing_history_response = next(responses)
+        company_data["last_filing_date"] = (
+            _parse_last_filing_date(filing_history_response.json())
+            if filing_history_response.status_code == 200
+            else None
+        )
     return company_data
 
 
-def get_company_number(api_key: str, name: str) -> str:
-    url = "https://autocomplete-dev.fielder.one/company_house/search/companies"
-    response = requests.get(
-        url,
-        params={"q": name},
-        auth=(api_key, ""),
-    )
-    data = response.json()
+@dataclass
+class CompanyEnrichmentReport:
+    # counts of documents
+    updated: int = 0
+    skipped: int = 0  # no company number, or company not found
+    failed: int = 0
+    # company number -> exception raised while fetching or writing its data
+    errors: Dict[str, Exception] = field(default_factory=dict)
+
+
+def enrich_companies(
+    api_key,
+    organisations: Iterable[Tuple[Any, Optional[str]]],
+    db,
+    field_path: Optional[str] = None,
+    max_workers: int = 6,
+    rate_limiter: RateLimiter = None,
+    sic_code_registry: SICCodeRegistry = None,
+    batch_size: int = 500,
+    cache: CompaniesHouseCache = None,
+) -> CompanyEnrichmentReport:
+    """
+    Refresh the Companies House data of many documents.
+
+    Company numbers are deduplicated and fetched with get_company_data() on
+    max_workers threads over the pooled HTTP session. Results are written as
+    they arrive into a MultiBatch, committed every batch_size writes, so
+    they are never all held in memory: at most 2 * max_workers companies
+    are fetched ahead of the writes. Each commit is a single atomic
+    WriteBatch, a failed commit only fails the documents it contained.
+
+    Args:
+        api_key: Companies House API key
+        organisations: (document reference, company number) pairs
+        db: Firestore client
+        field_path: field to store the company data in, None to merge it
+            into the document
+        max_workers: maximum number of companies fetched concurrently
+        rate_limiter: optional RateLimiter shared by every request
+        sic_code_registry: SIC codes source, loaded from db by default
+        batch_size: number of writes per commit, at most BATCH_MAX_WRITES
+        cache: optional CompaniesHouseCache for Companies House responses
+    Returns:
+        report (CompanyEnrichmentReport)
+    """
+    report = CompanyEnrichmentReport()
+    refs_by_number: Dict[str, List] = {}
+    for ref, company_number in organisations:
+        company_number = (company_number or "").strip().upper()
+        if company_number:
+            refs_by_number.setdefault(company_number, []).append(ref)
+        else:
+            report.skipped += 1
+    if sic_code_registry is None:
+        sic_code_registry = SICCodeRegistry(db)
+
+    batch_size = min(batch_size, BATCH_MAX_WRITES)
+    batch = MultiBatch(db)
+    # company number of every write since the last commit
+    pending: List[str] = []
+
+    def commit():
+        nonlocal batch
+        try:
+            batch.commit()
+        except Exception as e:
+            report.failed += len(pending)
+            for company_number in pending:
+                report.errors[company_number] = e
+            # a failed MultiBatch keeps its writes, start over
+            batch = MultiBatch(db)
+        else:
+            report.updated += len(pending)
+        pending.clear()
+
+    def write(company_number, future):
+        refs = refs_by_number[company_number]
+        try:
+            company_data = future.result()
+        except Exception as e:
+            report.failed += len(refs)
+            report.errors[company_number] = e
+            return
+        if not company_data:
+            report.skipped += len(refs)
+            return
+        data = company_data if field_path is None else {field_path: company_data}
+        for ref in refs:
+            batch.set(ref, data, merge=True)
+            pending.append(company_number)
+            if len(pending) >= batch_size:
+                commit()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        company_numbers = iter(refs_by_number)
+        # a bounded window of fetches, handled futures are dropped with their data
+        in_flight = {}
+        while True:
+            for company_number in islice(
+                company_numbers, 2 * max_workers - len(in_flight)
+            ):
+                future = executor.submit(
+                    get_company_data,
+                    api_key,
+                    company_number,
+                    db=db,
+                    sic_code_registry=sic_code_registry,
+                    rate_limiter=rate_limiter,
+                    cache=cache,
+                )
+                in_flight[future] = company_number
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                write(in_flight.pop(future), future)
+    if pending:
+        commit()
+    return report
+
+
+def get_company_number(
+    api_key: str, name: str, cache: CompaniesHouseCache = None
+) -> str:
+    data = _get_json(api_key, "/search/companies", cache=cache, params={"q": name})[1]
     company_number = None
-    items = data.get("items", [])
+    items = (data or {}).get("items", [])
     if len(items) > 1:
         company = items[0]
         company_number = (
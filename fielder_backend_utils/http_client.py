@@ -0,0 +1,197 @@
+"""
+Shared HTTP client for third-party integrations.
+
+Module level get/post/put/delete/request mirror the requests API, but go
+through one pooled requests.Session per host so keep-alive connections are
+reused across calls. Every request gets a default timeout, and responses with
+429 or 5xx statuses are retried with exponential backoff, honouring the
+Retry-After header sent by the server. Pass rate_limiter to throttle requests
+with a shared rate_limit.RateLimiter, 429 responses are then retried through
+the limiter so every caller slows down.
+"""
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from fielder_backend_utils.rate_limit import RateLimiter
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) seconds
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 20
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+_settings = {
+    "timeout": DEFAULT_TIMEOUT,
+    "pool_connections": DEFAULT_POOL_CONNECTIONS,
+    "pool_maxsize": DEFAULT_POOL_MAXSIZE,
+    "retries": DEFAULT_RETRIES,
+    "backoff_factor": DEFAULT_BACKOFF_FACTOR,
+}
+_sessions: Dict[Tuple[str, str, bool], requests.Session] = {}
+_lock = threading.Lock()
+
+
+class _Retry(Retry):
+    """
+    urllib3 only retries idempotent methods on bad statuses. A 429 means the
+    request was rejected before being processed, so it is safe to retry
+    POSTs as well.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class _RateLimitedRetry(Retry):
+    """
+    Retry of requests going through a RateLimiter, which must see every 429
+    and its Retry-After header, so request() retries them instead
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def _make_session(rate_limited: bool = False) -> requests.Session:
+    session = requests.Session()
+    # sessions are shared by every caller of a host, don't leak cookies between them
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = _TimeoutHTTPAdapter(
+        timeout=_settings["timeout"],
+        pool_connections=_settings["pool_connections"],
+        pool_maxsize=_settings["pool_maxsize"],
+        max_retries=(_RateLimitedRetry if rate_limited else _Retry)(
+            total=_settings["retries"],
+            backoff_factor=_settings["backoff_factor"],
+            status_forcelist=RETRY_STATUS_CODES,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def configure(
+    *,
+    timeout=None,
+    pool_connections: Optional[int] = None,
+    pool_maxsize: Optional[int] = None,
+    retries: Optional[int] = None,
+    backoff_factor: Optional[float] = None,
+) -> None:
+    """
+    Change the defaults used for new sessions, existing sessions are closed
+
+    Args:
+        timeout: default timeout, seconds or (connect, read) tuple
+        pool_connections: number of connection pools to cache per session
+        pool_maxsize: maximum number of connections kept alive per host
+        retries: maximum number of retries on errors and 429/5xx responses
+        backoff_factor: exponential backoff factor between retries
+    """
+    updates = {
+        "timeout": timeout,
+        "pool_connections": pool_connections,
+        "pool_maxsize": pool_maxsize,
+        "retries": retries,
+        "backoff_factor": backoff_factor,
+    }
+    with _lock:
+        _settings.update({k: v for k, v in updates.items() if v is not None})
+        _close_sessions()
+
+
+def _close_sessions() -> None:
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+
+
+def get_session(url: str, rate_limited: bool = False) -> requests.Session:
+    """
+    Get the pooled session for the host of url
+
+    Args:
+        url: request url
+        rate_limited: session for requests going through a RateLimiter,
+            429 responses are not retried by the session
+    """
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc, rate_limited)
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = _make_session(rate_limited)
+    return session
+
+
+def request(
+    method: str, url: str, rate_limiter: RateLimiter = None, **kwargs
+) -> requests.Response:
+    if rate_limiter is None:
+        return get_session(url).request(method, url, **kwargs)
+    session = get_session(url, rate_limited=True)
+    attempt = 0
+    while True:
+        with rate_limiter.limit():
+            response = session.request(method, url, **kwargs)
+        # pauses the next acquire() of every caller on 429
+        rate_limiter.update(response.status_code, response.headers)
+        if response.status_code != 429 or attempt >= _settings["retries"]:
+            return response
+        response.close()
+        attempt += 1
+
+
+def get(url: str, params=None, **kwargs) -> requests.Response:
+    return request("GET", url, params=params, **kwargs)
+
+
+def post(url: str, data=None, json=None, **kwargs) -> requests.Response:
+    return request("POST", url, data=data, json=json, **kwargs)
+
+
+def put(url: str, data=None, **kwargs) -> requests.Response:
+    return request("PUT", url, data=data, **kwargs)
+
+
+def delete(url: str, **kwargs) -> requests.Response:
+    return request("DELETE", url, **kwargs)
+
+
+def _reset_after_fork() -> None:
+    # pooled sockets must not be shared with a forked child process
+    global _lock
+    _lock = threading.Lock()
+    _sessions.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
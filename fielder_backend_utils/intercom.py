@@ -1,29 +1,130 @@
-from typing import Dict, List
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
-import requests
+import httpx
+from requests.exceptions import RequestException
 from requests.models import HTTPError
 
+from fielder_backend_utils import async_http_client, http_client, make_chunks
+from fielder_backend_utils.rate_limit import RateLimiter
+
+INTERCOM_API_URL = "https://api.intercom.io"
+# Intercom allows at most 15 filters in a search query group
+SEARCH_MAX_FILTERS = 15
+SEARCH_PAGE_SIZE = 150
+
+
+def _external_id_query(external_user_id: str) -> Dict:
+    return {
+        "query": {
+            "field": "external_id",
+            "operator": "=",
+            "value": external_user_id,
+        }
+    }
+
+
+def _external_ids_query(external_user_ids: List[str]) -> Dict:
+    return {
+        "query": {
+            "operator": "OR",
+            "value": [
+                _external_id_query(external_user_id)["query"]
+                for external_user_id in external_user_ids
+            ],
+        },
+        "pagination": {"per_page": SEARCH_PAGE_SIZE},
+    }
+
+
+def _contact_payload(external_user_id: str, **kwargs) -> Dict:
+    payload = {
+        "role": "user",
+        "external_id": external_user_id,
+    }
+    if kwargs:
+        payload.update(kwargs)
+    return payload
+
+
+def _company_payload(organisation_id: str, **kwargs) -> Dict:
+    payload = {
+        "name": organisation_id,
+    }
+    if kwargs:
+        payload.update(kwargs)
+    return payload
+
+
+def _conversation_payload(intercom_user_id: str, body: str) -> Dict:
+    return {
+        "from": {"type": "user", "id": intercom_user_id},
+        "body": body,
+    }
+
+
+def _message_payload(
+    intercom_sender_id: str,
+    intercom_recipient_id: str,
+    body: str,
+    intercom_sender_type: str,
+) -> Dict:
+    return {
+        "from": {"type": intercom_sender_type, "id": intercom_sender_id},
+        "to": {"type": "user", "id": intercom_recipient_id},
+        "message_type": "inapp",
+        "body": body,
+    }
+
+
+@dataclass
+class IntercomSyncResult:
+    external_user_id: str
+    intercom_user_id: Optional[str] = None
+    created: bool = False
+    updated: bool = False
+    added_to_company: bool = False
+    error: Optional[Exception] = None
+
+
+@dataclass
+class IntercomSyncReport:
+    results: Dict[str, IntercomSyncResult] = field(default_factory=dict)
+    api_calls: int = 0
+    # calls that get_or_create_user + update_user + add_user_to_company would make
+    sequential_api_calls: int = 0
+
+    @property
+    def api_calls_saved(self) -> int:
+        return self.sequential_api_calls - self.api_calls
+
+    @property
+    def failed(self) -> List[IntercomSyncResult]:
+        return [r for r in self.results.values() if r.error is not None]
+
 
 class IntercomClient:
     """
     API DOCS: https://developers.intercom.com/intercom-api-reference/reference
+
+    Pass a shared rate_limit.RateLimiter to stay under Intercom's rate limit
+    when calling the API from several threads.
     """
 
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, rate_limiter: RateLimiter = None):
+        self.base_url = INTERCOM_API_URL
         self.headers = {"Authorization": "Bearer " + access_token}
+        self.rate_limiter = rate_limiter
 
     def get_user(self, external_user_id: str) -> List[Dict]:
         # Try to search a user by external_id i.e. Firestore document ID
-        response = requests.post(
-            "https://api.intercom.io/contacts/search",
-            json={
-                "query": {
-                    "field": "external_id",
-                    "operator": "=",
-                    "value": external_user_id,
-                }
-            },
+        response = http_client.post(
+            self.base_url + "/contacts/search",
+            json=_external_id_query(external_user_id),
             headers=self.headers,
+            rate_limiter=self.rate_limiter,
         )
         if response.status_code == 200:
             return response.json()["data"]
@@ -31,17 +132,11 @@ class IntercomClient:
         return response.raise_for_status()
 
     def create_user(self, external_user_id: str, **kwargs) -> Dict:
-        payload = {
-            "role": "user",
-            "external_id": external_user_id,
-        }
-        if kwargs:
-            payload.update(kwargs)
-
-        response = requests.post(
-            "https://api.intercom.io/contacts",
-            json=payload,
+        response = http_client.post(
+            self.base_url + "/contacts",
+            json=_contact_payload(external_user_id, **kwargs),
             headers=self.headers,
+            rate_limiter=self.rate_limiter,
         )
         if response.status_code == 200:
             return response.json()
@@ -66,19 +161,21 @@ class IntercomClient:
         if kwargs:
             payload.update(kwargs)
 
-        response = requests.put(
-            "https://api.intercom.io/contacts/{}".format(intercom_user_id),
+        response = http_client.put(
+            self.base_url + f"/contacts/{intercom_user_id}",
             json=payload,
             headers=self.headers,
+            rate_limiter=self.rate_limiter,
         )
         if response.status_code == 200:
             return response.json()
         return response.raise_for_status()
 
     def get_company(self, organisation_id: str) -> Dict:
-        response = requests.get(
-            f"https://api.intercom.io/companies/{organisation_id}",
+        response = http_client.get(
+            self.base_url + f"/companies/{organisation_id}",
             headers=self.headers,
+            rate_limiter=self.rate_limiter,
         )
         if response.status_code == 200:
             return response.json()
@@ -86,16 +183,11 @@ class IntercomClient:
         return response.raise_for_status()
 
     def create_update_company(self, organisation_id: str, **kwargs) -> Dict:
-        payload = {
-            "name": organisation_id,
-        }
-        if kwargs:
-            payload.update(kwargs)
-
-        response = requests.post(
-            "https://api.intercom.io/companies",
-            json=payload,
+        response = http_client.post(
+            self.base_url + "/companies",
+            json=_company_payload(organisation_id, **kwargs),
             headers=self.headers,
+            rate_limiter=self.rate_limiter,
         )
         if response.status_code == 200:
             return response.json()
@@ -105,23 +197,22 @@ class IntercomClient:
     def add_user_to_company(
         self, intercom_user_id: str, intercom_company_id: str
     ) -> Dict:
-        response = requests.post(
-            f"https://api.intercom.io/contacts/{intercom_user_id}/companies",
+        response = http_client.post(
+            self.base_url + f"/contacts/{intercom_user_id}/companies",
             json={"id": intercom_company_id},
             headers=self.headers,
+            rate_limiter=self.rate_limiter,
         )
         if response.status_code == 200:
             return response.json()
         return response.raise_for_status()
 
     def create_conversation(self, intercom_user_id: str, body: str) -> Dict:
-        response = requests.post(
-            "https://api.intercom.io/conversations",
-            json={
-                "from": {"type": "user", "id": intercom_user_id},
-                "body": body,
-            },
+        response = http_client.post(
+            self.base_url + "/conversations",
+            json=_conversation_payload(intercom_user_id, body),
             headers=self.headers,
+            rate_limiter=self.rate_limiter,
         )
         if response.status_code == 200:
             return response.json()
@@ -135,17 +226,268 @@ class IntercomClient:
         body: str,
         intercom_sender_type="admin",
     ) -> Dict:
-        response = requests.post(
-            "https://api.intercom.io/messages",
-            json={
-                "from": {"type": intercom_sender_type, "id": intercom_sender_id},
-                "to": {"type": "user", "id": intercom_recipient_id},
-                "message_type": "inapp",
-                "body": body,
-            },
+        response = http_client.post(
+            self.base_url + "/messages",
+            json=_message_payload(
+                intercom_sender_id, intercom_recipient_id, body, intercom_sender_type
+            ),
             headers=self.headers,
+            rate_limiter=self.rate_limiter,
         )
         if response.status_code == 200:
             return response.json()
 
         return response.raise_for_status()
+
+    def search_users(self, external_user_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Search many users by external_id, SEARCH_MAX_FILTERS ids per request
+
+        Args:
+            external_user_ids: Firestore document IDs
+        Returns:
+            contacts (dict): external_id -> contact, for the users that exist
+        """
+        contacts = {}
+        for chunk in make_chunks(
+            list(dict.fromkeys(external_user_ids)), SEARCH_MAX_FILTERS
+        ):
+            contacts.update(self._search_users_chunk(chunk)[0])
+        return contacts
+
+    def _search_users_chunk(self, external_user_ids: List[str]):
+        contacts = {}
+        calls = 0
+        payload = _external_ids_query(external_user_ids)
+        while True:
+            response = http_client.post(
+                self.base_url + "/contacts/search",
+                json=payload,
+                headers=self.headers,
+                rate_limiter=self.rate_limiter,
+            )
+            calls += 1
+            response.raise_for_status()
+            if response.status_code != 200:
+                # e.g. 202 without results, treating it as "no contacts"
+                # would create duplicates
+                raise HTTPError(
+                    f"Unexpected {response.status_code} response to contact search",
+                    response=response,
+                )
+            data = response.json()
+            for contact in data["data"]:
+                contacts.setdefault(contact["external_id"], contact)
+            next_page = (data.get("pages") or {}).get("next")
+            if not next_page or not next_page.get("starting_after"):
+                break
+            payload["pagination"] = {
+                "per_page": SEARCH_PAGE_SIZE,
+                "starting_after": next_page["starting_after"],
+            }
+        return contacts, calls
+
+    def sync_users(
+        self,
+        users: Dict[str, Dict],
+        intercom_company_id: str = None,
+        max_workers: int = 8,
+    ) -> IntercomSyncReport:
+        """
+        Bulk equivalent of calling get_or_create_user, update_user and
+        add_user_to_company for each user.
+
+        Existing users are resolved with one search request per
+        SEARCH_MAX_FILTERS users, missing users are created with their
+        attributes (no separate update), and updates and company attachments
+        run concurrently, starting as soon as the search of their chunk
+        returns. A failure only affects the user it happened to.
+
+        Args:
+            users: external_id -> contact attributes to set
+            intercom_company_id: if set, attach every user to this company
+            max_workers: maximum number of concurrent requests
+        Returns:
+            report (IntercomSyncReport): per-user outcomes and API call counts
+        """
+        report = IntercomSyncReport(
+            results={
+                external_user_id: IntercomSyncResult(external_user_id)
+                for external_user_id in users
+            }
+        )
+        report.sequential_api_calls = sum(
+            1 + bool(attributes) + bool(intercom_company_id)
+            for attributes in users.values()
+        )
+        lock = threading.Lock()
+
+        def count_call():
+            with lock:
+                report.api_calls += 1
+
+        def search(chunk):
+            try:
+                contacts, calls = self._search_users_chunk(chunk)
+            except RequestException as e:
+                with lock:
+                    report.api_calls += 1
+                for external_user_id in chunk:
+                    report.results[external_user_id].error = e
+                return {}
+            with lock:
+                report.api_calls += calls
+            return contacts
+
+        def upsert(external_user_id, contact):
+            result = report.results[external_user_id]
+            attributes = users[external_user_id]
+            try:
+                if contact is None:
+                    count_call()
+                    with lock:
+                        report.sequential_api_calls += 1
+                    contact = self.create_user(external_user_id, **attributes)
+                    result.created = True
+                elif attributes:
+                    count_call()
+                    contact = self.update_user(contact["id"], **attributes)
+                    result.updated = True
+                result.intercom_user_id = contact["id"]
+                if intercom_company_id:
+                    count_call()
+                    self.add_user_to_company(contact["id"], intercom_company_id)
+                    result.added_to_company = True
+            except Exception as e:
+                # report the failure, don't abort the other users
+                result.error = e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            searches = {
+                executor.submit(search, chunk): chunk
+                for chunk in make_chunks(list(users), SEARCH_MAX_FILTERS)
+            }
+            # upsert the users of a chunk as soon as its search returns
+            for future in as_completed(searches):
+                contacts = future.result()
+                for external_user_id in searches[future]:
+                    if report.results[external_user_id].error is None:
+                        executor.submit(
+                            upsert, external_user_id, contacts.get(external_user_id)
+                        )
+
+        return report
+
+
+class AsyncIntercomClient:
+    """
+    asyncio counterpart of IntercomClient, sharing the async_http_client pool.
+    Errors are raised as httpx.HTTPStatusError.
+    """
+
+    def __init__(self, access_token: str, rate_limiter: RateLimiter = None):
+        self.base_url = INTERCOM_API_URL
+        self.headers = {"Authorization": "Bearer " + access_token}
+        self.rate_limiter = rate_limiter
+
+    @staticmethod
+    def _handle_response(response: httpx.Response):
+        if response.status_code == 200:
+            return response.json()
+        response.raise_for_status()
+
+    async def get_user(self, external_user_id: str) -> List[Dict]:
+        response = await async_http_client.post(
+            self.base_url + "/contacts/search",
+            json=_external_id_query(external_user_id),
+            headers=self.headers,
+            rate_limiter=self.rate_limiter,
+        )
+        data = self._handle_response(response)
+        return data["data"] if data is not None else None
+
+    async def create_user(self, external_user_id: str, **kwargs) -> Dict:
+        response = await async_http_client.post(
+            self.base_url + "/contacts",
+            json=_contact_payload(external_user_id, **kwargs),
+            headers=self.headers,
+            rate_limiter=self.rate_limiter,
+        )
+        return self._handle_response(response)
+
+    async def get_or_create_user(self, external_user_id: str, **kwargs) -> Dict:
+        try:
+            users = await self.get_user(external_user_id)
+            if users:
+                user = users[0]
+            else:
+                user = await self.create_user(external_user_id, **kwargs)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                user = await self.create_user(external_user_id, **kwargs)
+            else:
+                raise e
+        return user
+
+    async def update_user(self, intercom_user_id: str, **kwargs) -> Dict:
+        response = await async_http_client.put(
+            self.base_url + f"/contacts/{intercom_user_id}",
+            json=dict(kwargs),
+            headers=self.headers,
+            rate_limiter=self.rate_limiter,
+        )
+        return self._handle_response(response)
+
+    async def get_company(self, organisation_id: str) -> Dict:
+        response = await async_http_client.get(
+            self.base_url + f"/companies/{organisation_id}",
+            headers=self.headers,
+            rate_limiter=self.rate_limiter,
+        )
+        return self._handle_response(response)
+
+    async def create_update_company(self, organisation_id: str, **kwargs) -> Dict:
+        response = await async_http_client.post(
+            self.base_url + "/companies",
+            json=_company_payload(organisation_id, **kwargs),
+            headers=self.headers,
+            rate_limiter=self.rate_limiter,
+        )
+        return self._handle_response(response)
+
+    async def add_user_to_company(
+        self, intercom_user_id: str, intercom_company_id: str
+    ) -> Dict:
+        response = await async_http_client.post(
+            self.base_url + f"/contacts/{intercom_user_id}/companies",
+            json={"id": intercom_company_id},
+            headers=self.headers,
+            rate_limiter=self.rate_limiter,
+        )
+        return self._handle_response(response)
+
+    async def create_conversation(self, intercom_user_id: str, body: str) -> Dict:
+        response = await async_http_client.post(
+            self.base_url + "/conversations",
+            json=_conversation_payload(intercom_user_id, body),
+            headers=self.headers,
+            rate_limiter=self.rate_limiter,
+        )
+        return self._handle_response(response)
+
+    async def send_message_to_user(
+        self,
+        intercom_sender_id: str,
+        intercom_recipient_id: str,
+        body: str,
+        intercom_sender_type="admin",
+    ) -> Dict:
+        response = await async_http_client.post(
+            self.base_url + "/messages",
+            json=_message_payload(
+                intercom_sender_id, intercom_recipient_id, body, intercom_sender_type
+            ),
+            headers=self.headers,
+            rate_limiter=self.rate_limiter,
+        )
+        return self._handle_response(response)
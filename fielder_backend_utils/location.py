@@ -1,19 +1,104 @@
 import logging
-from typing import Any, Dict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from operator import itemgetter
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
-import requests
 from google.cloud.firestore import DocumentReference, GeoPoint
+from requests.exceptions import RequestException
 
-from fielder_backend_utils import get_with_default
+from fielder_backend_utils import http_client
+from fielder_backend_utils.geo import GEOHASH_FIELD, encode_geohash, lat_lng
+from fielder_backend_utils.location_cache import (
+    LocationCache,
+    geocode_key,
+    normalize_address,
+    place_details_key,
+)
+from fielder_backend_utils.rate_limit import RateLimiter
 from fielder_backend_utils.rest_utils import log_response
 
 logger = logging.getLogger(__name__)
 
 
+GEOCODE_BOUNDS = (
+    "49.383639452689664,-17.39866406249996|59.53530451232491,8.968523437500039"
+)
+
+
+ADDRESS_FIELDS = ["building", "street", "city", "county", "country", "postal_code"]
+# Google address component type -> address field, first match wins
+_COMPONENT_FIELDS = {
+    "street_number": "building",
+    "premise": "building",
+    "route": "street",
+    "postal_town": "city",
+    "country": "country",
+    "postal_code": "postal_code",
+}
+# joined into county, every level 2 area then every level 1 area
+_COUNTY_TYPES = {"administrative_area_level_2": 0, "administrative_area_level_1": 1}
+
+
+def parse_address_components(components: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Map the address_components of a place details or geocoding result to
+    our address fields, in one pass
+
+    Args:
+        components: address_components of a Google API result
+    Returns:
+        address: dict with every field of ADDRESS_FIELDS, None when missing
+    """
+    address = dict.fromkeys(ADDRESS_FIELDS)
+    counties = ([], [])
+    for component in components:
+        for component_type in component["types"]:
+            field = _COMPONENT_FIELDS.get(component_type)
+            if field is not None:
+                if address[field] is None:
+                    address[field] = component["long_name"]
+            else:
+                level = _COUNTY_TYPES.get(component_type)
+                if level is not None:
+                    counties[level].append(component["long_name"])
+    if counties[0] or counties[1]:
+        address["county"] = ", ".join(counties[0] + counties[1])
+    return address
+
+
+def parse_address_components_many(
+    results: Iterable[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    parse_address_components for many place details or geocoding results
+
+    Args:
+        results: Google API results, each with address_components
+    Returns:
+        addresses in the same order as results
+    """
+    return [parse_address_components(r["address_components"]) for r in results]
+
+
 def google_place_details(
-    place_id: str, googel_places_api_secret: str
+    place_id: str, googel_places_api_secret: str, cache: LocationCache = None
 ) -> Dict[str, Any]:
-    response = requests.get(
+    if cache is not None:
+        return cache.get_or_fetch(
+            place_details_key(place_id),
+            lambda: google_place_details(place_id, googel_places_api_secret),
+        )
+
+    response = http_client.get(
         "https://maps.googleapis.com/maps/api/place/details/json",
         params={
             "place_id": place_id,
@@ -22,47 +107,66 @@ def google_place_details(
     )
     log_response(logger, response)
 
-    if not response.ok or response.json()["status"] != "OK":
+    if not response.ok:
         return None
-
     response = response.json()
-    name = response["result"]["name"]
-    info = response["result"]["address_components"]
-    building = [
-        _["long_name"]
-        for _ in info
-        if "street_number" in _["types"] or "premise" in _["types"]
-    ]
-    street = [_["long_name"] for _ in info if "route" in _["types"]]
-    city = [_["long_name"] for _ in info if "postal_town" in _["types"]]
-    administrative_areas_names = [
-        _["long_name"] for _ in info if "administrative_area_level_2" in _["types"]
-    ] + [_["long_name"] for _ in info if "administrative_area_level_1" in _["types"]]
-    country = [_["long_name"] for _ in info if "country" in _["types"]]
-    postal_code = [_["long_name"] for _ in info if "postal_code" in _["types"]]
+    if response["status"] != "OK":
+        return None
 
     return {
-        "name": name,
-        "address": {
-            "building": building[0] if building else None,
-            "street": street[0] if street else None,
-            "city": city[0] if city else None,
-            "county": ", ".join(administrative_areas_names)
-            if administrative_areas_names
-            else None,
-            "country": country[0] if country else None,
-            "postal_code": postal_code[0] if postal_code else None,
-        },
+        "name": response["result"]["name"],
+        "address": parse_address_components(response["result"]["address_components"]),
         "coords": response["result"]["geometry"]["location"],
         "formatted_address": response["result"]["formatted_address"],
     }
 
 
+# address keys in the order they appear in formatted_address
+FORMATTED_ADDRESS_KEYS = (
+    "building",
+    "street",
+    "city",
+    "county",
+    "postal_code",
+    "country",
+)
+_get_address_values = itemgetter(*FORMATTED_ADDRESS_KEYS)
+
+
+def _location_fields(
+    loc_data: Dict[str, Any], organisation_ref: DocumentReference
+) -> Dict[str, Any]:
+    """
+    Fields generate_location sets, without modifying loc_data
+    """
+    c = loc_data["coords"]
+    address = loc_data["address"]
+    values = _get_address_values(address)
+    name = loc_data.get("name")
+    if name is None:
+        building, street = values[0], values[1]
+        building = "" if building is None else building
+        street = "" if street is None else street
+        name = f"{building} {street}".strip()
+    formatted_address = ", ".join([v for v in values if v])
+    return {
+        "coords": c if isinstance(c, GeoPoint) else GeoPoint(c["lat"], c["lng"]),
+        GEOHASH_FIELD: encode_geohash(*lat_lng(c)),
+        "organisation_ref": organisation_ref,
+        "archived": False,
+        "is_live": True,
+        "short_name": name,
+        "icon_url": None,  # TODO
+        "address": dict(zip(FORMATTED_ADDRESS_KEYS, values)),
+        "formatted_address": formatted_address or loc_data["formatted_address"],
+    }
+
+
 def generate_location(
     loc_data: Dict[str, Any], organisation_ref: DocumentReference
 ) -> Dict[str, Any]:
     """
-    Generate location data
+    Generate location data, loc_data is updated in place
 
     Args:
         loc_data: initial location data
@@ -70,46 +174,161 @@ def generate_location(
     Returns:
         loc_data: location data
     """
-    c = loc_data["coords"]
-    loc_data["coords"] = GeoPoint(c["lat"], c["lng"])
-    loc_data["organisation_ref"] = organisation_ref
-    loc_data["archived"] = False
-    loc_data["is_live"] = True
-    short_name = (
-        loc_data.get("name")
-        if get_with_default(loc_data, "name", None) is not None
-        else f"{get_with_default(loc_data['address'], 'building', '')} {get_with_default(loc_data['address'], 'street', '')}".strip()
-    )
-    loc_data["short_name"] = short_name
-    loc_data["icon_url"] = None  # TODO
+    loc_data.update(_location_fields(loc_data, organisation_ref))
+    return loc_data
 
-    # Order the keys to create formatted_address
-    order_of_keys = ["building", "street", "city", "county", "postal_code", "country"]
-    loc_data["address"] = OrderedDict(
-        [(key, loc_data["address"][key]) for key in order_of_keys]
-    )
-    formatted_address = ", ".join([v for k, v in loc_data["address"].items() if v])
-    loc_data["formatted_address"] = (
-        formatted_address if formatted_address else loc_data["formatted_address"]
-    )
 
-    return loc_data
+def generate_locations(
+    records: Iterable[Dict[str, Any]], organisation_ref: DocumentReference
+) -> Iterator[Dict[str, Any]]:
+    """
+    Bulk generate_location returning new records, the input records are
+    left untouched. Records are generated lazily so they can be streamed
+    into a MultiBatch:
 
+        for location in generate_locations(records, organisation_ref):
+            batch.set(locations.document(), location)
+        batch.commit()
 
-def geocode(formatted_address: str, googel_places_api_secret: str):
-    response = requests.get(
+    Args:
+        records: initial location data
+        organisation_ref: organisation document reference
+    Returns:
+        iterator of location data, in the same order as records
+    """
+    for loc_data in records:
+        yield {**loc_data, **_location_fields(loc_data, organisation_ref)}
+
+
+def _geocode_request(
+    formatted_address: str,
+    googel_places_api_secret: str,
+    rate_limiter: RateLimiter = None,
+) -> Tuple[str, Optional[Dict[str, float]]]:
+    """
+    Returns:
+        (status, coords): Google status, or HTTP_<code> when the request
+        failed, and the coords of the first result
+    """
+    response = http_client.get(
         "https://maps.googleapis.com/maps/api/geocode/json",
         params={
             "address": formatted_address,
-            "bounds": "49.383639452689664,-17.39866406249996|59.53530451232491,8.968523437500039",
+            "bounds": GEOCODE_BOUNDS,
             "key": googel_places_api_secret,
         },
+        rate_limiter=rate_limiter,
     )
     log_response(logger, response)
 
-    if not response.ok or response.json()["status"] != "OK":
-        return None
+    if not response.ok:
+        return f"HTTP_{response.status_code}", None
+    data = response.json()
+    if data["status"] != "OK" or not data["results"]:
+        return data["status"], None
+    return data["status"], data["results"][0]["geometry"]["location"]
+
+
+def geocode(
+    formatted_address: str, googel_places_api_secret: str, cache: LocationCache = None
+):
+    if cache is not None:
+        return cache.get_or_fetch(
+            geocode_key(formatted_address, GEOCODE_BOUNDS),
+            lambda: geocode(formatted_address, googel_places_api_secret),
+        )
+    return _geocode_request(formatted_address, googel_places_api_secret)[1]
+
+
+@dataclass
+class GeocodeResult:
+    address: str
+    status: Optional[str] = None
+    coords: Optional[Dict[str, float]] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.coords is not None
+
+
+def _geocode_result(
+    address: str,
+    googel_places_api_secret: str,
+    cache: Optional[LocationCache],
+    rate_limiter: Optional[RateLimiter],
+) -> GeocodeResult:
+    result = GeocodeResult(address)
+    try:
+        if cache is None:
+            result.status, result.coords = _geocode_request(
+                address, googel_places_api_secret, rate_limiter
+            )
+            return result
+
+        def fetch():
+            result.status, coords = _geocode_request(
+                address, googel_places_api_secret, rate_limiter
+            )
+            return coords
+
+        result.coords = cache.get_or_fetch(geocode_key(address, GEOCODE_BOUNDS), fetch)
+        if result.status is None:
+            # answered by the cache, or by another caller's failed lookup
+            result.status = "OK" if result.coords is not None else "NO_RESULT"
+    except RequestException as e:
+        result.status = "ERROR"
+        result.error = e
+    except (ValueError, LookupError, TypeError) as e:
+        # malformed response body
+        result.status = "INVALID_RESPONSE"
+        result.error = e
+    return result
+
+
+def geocode_many(
+    addresses: Iterable[str],
+    googel_places_api_secret: str,
+    max_workers: int = 10,
+    cache: LocationCache = None,
+    rate_limiter: RateLimiter = None,
+) -> Iterator[GeocodeResult]:
+    """
+    Geocode many addresses concurrently, yielding results as they complete.
+
+    Repeated addresses are reported once. Addresses that only differ by
+    case, whitespace or empty parts are geocoded once, but each of them
+    still gets its own result. A failed request or malformed response only
+    affects the addresses it was made for.
+
+    Args:
+        addresses: formatted addresses
+        googel_places_api_secret: Google API key
+        max_workers: maximum number of concurrent requests
+        cache: optional LocationCache shared with geocode()
+        rate_limiter: optional RateLimiter for the Geocoding API
+    Returns:
+        iterator of GeocodeResult, one per distinct input string, in
+        completion order
+    """
+    groups = {}
+    for address in dict.fromkeys(addresses):
+        groups.setdefault(normalize_address(address), []).append(address)
+    if not groups:
+        return
 
-    results = response.json()["results"]
-    if response.json()["results"]:
-        return response.json()["results"][0]["geometry"]["location"]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _geocode_result,
+                group[0],
+                googel_places_api_secret,
+                cache,
+                rate_limiter,
+            ): group
+            for group in groups.values()
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            for address in futures[future]:
+                yield replace(result, address=address)
@@ -0,0 +1,227 @@
+"""
+Cache for Google place details and geocoding results.
+
+A LocationCache keeps results in an in-process LRU with a TTL, backed by an
+optional persistent store shared between processes (SQLiteLocationStore or
+FirestoreLocationStore). Concurrent misses for the same key wait for a single
+upstream call. Pass the cache to location.google_place_details() and
+location.geocode():
+
+    cache = LocationCache(store=FirestoreLocationStore(db))
+    details = google_place_details(place_id, api_secret, cache=cache)
+"""
+import json
+import sqlite3
+import threading
+import time
+from copy import deepcopy
+from hashlib import sha256
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fielder_backend_utils.cache import TTLCache
+
+DEFAULT_TTL = 30 * 24 * 3600  # seconds
+
+
+def normalize_address(address: str) -> str:
+    """
+    Canonical form of an address, ignoring case, whitespace and empty parts
+    """
+    parts = (" ".join(part.split()) for part in address.casefold().split(","))
+    return ", ".join(part for part in parts if part)
+
+
+def place_details_key(place_id: str) -> str:
+    return f"place:{place_id}"
+
+
+def geocode_key(address: str, bounds: Optional[str] = None) -> str:
+    return f"geocode:{bounds or ''}:{normalize_address(address)}"
+
+
+class SQLiteLocationStore:
+    """
+    Persists cached results in a local SQLite database
+    """
+
+    def __init__(self, path: str = "location_cache.sqlite3") -> None:
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS location_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, stored_at FROM location_cache WHERE key = ?", (key,)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set(self, key: str, value: Any, stored_at: float) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO location_cache VALUES (?, ?, ?)",
+                (key, json.dumps(value), stored_at),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM location_cache WHERE key = ?", (key,))
+
+
+class FirestoreLocationStore:
+    """
+    Persists cached results in a Firestore collection, one document per key
+    """
+
+    def __init__(self, db, collection: str = "location_cache") -> None:
+        self.collection = db.collection(collection)
+
+    def _document(self, key: str):
+        # keys contain "/" and can be longer than a document id
+        return self.collection.document(sha256(key.encode()).hexdigest())
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        snapshot = self._document(key).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        return data["value"], data["stored_at"]
+
+    def set(self, key: str, value: Any, stored_at: float) -> None:
+        self._document(key).set({"key": key, "value": value, "stored_at": stored_at})
+
+    def delete(self, key: str) -> None:
+        self._document(key).delete()
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class LocationCache:
+    """
+    LRU + TTL cache with an optional persistent tier and single-flight misses.
+
+    Only results other than None are cached, a failed lookup is retried the
+    next time it is requested. Callers get their own copy of cached results,
+    so they can be modified, e.g. by location.generate_location().
+
+    Args:
+        ttl: seconds a result is kept, in memory and in the store
+        maxsize: maximum number of results kept in memory
+        store: optional persistent store with get/set/delete
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL,
+        maxsize: int = 10000,
+        store: SQLiteLocationStore = None,
+    ) -> None:
+        self.ttl = ttl
+        self.store = store
+        self.store_hits = 0
+        self.upstream_calls = 0
+        self.coalesced = 0  # misses that waited for another caller's fetch
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def hits(self) -> int:
+        return self._cache.hits
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Fraction of lookups answered without an upstream call
+        """
+        lookups = self._cache.hits + self._cache.misses
+        if not lookups:
+            return 0.0
+        return 1 - self.upstream_calls / lookups
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self._cache.hits,
+            "store_hits": self.store_hits,
+            "coalesced": self.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "hit_rate": self.hit_rate,
+        }
+
+    def invalidate(self, key: str) -> None:
+        self._cache.pop(key)
+        if self.store is not None:
+            self.store.delete(key)
+
+    def _get_stored(self, key: str) -> Any:
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        ttl = stored_at + self.ttl - time.time()
+        if ttl <= 0:
+            return None
+        self._cache.set(key, deepcopy(value), ttl=ttl)
+        with self._lock:
+            self.store_hits += 1
+        return value
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """
+        Get the cached value of key, calling fetch() on a miss
+
+        Args:
+            key: normalized key, see place_details_key() and geocode_key()
+            fetch: function returning the value, None is not cached
+        Returns:
+            value
+        """
+        value = self._cache.get(key)
+        if value is not None:
+            return deepcopy(value)
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return deepcopy(call.result)
+
+        try:
+            # another leader may have finished between the lookup and the lock
+            value = deepcopy(self._cache.get(key)) if key in self._cache else None
+            if value is None and self.store is not None:
+                value = self._get_stored(key)
+            if value is None:
+                with self._lock:
+                    self.upstream_calls += 1
+                value = fetch()
+                if value is not None:
+                    self._cache.set(key, deepcopy(value))
+                    if self.store is not None:
+                        self.store.set(key, value, time.time())
+            call.result = deepcopy(value)
+            return value
+        except Exception as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
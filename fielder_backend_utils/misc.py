@@ -1,15 +1,20 @@
 import random
 import string
+from bisect import bisect_right
 from hashlib import sha256
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Tuple
 from urllib.parse import quote_plus
 
-import requests
+from google.api_core.exceptions import Conflict
 
+from fielder_backend_utils import http_client, make_chunks
 from fielder_backend_utils.intercom import IntercomClient
+from fielder_backend_utils.multi_batch import MultiBatch
 
 
 def create_clickup_task(task_title, list_id, token, task_description="n/a"):
-    response = requests.post(
+    response = http_client.post(
         f"https://api.clickup.com/api/v2/list/{list_id}/task/",
         json={
             "name": task_title,
@@ -22,29 +27,114 @@ def create_clickup_task(task_title, list_id, token, task_description="n/a"):
 ALPHABET = string.digits + string.ascii_uppercase
 
 
+# bases Python can format natively, same digits as ALPHABET
+_BASEN_FORMATS = {2: "b", 8: "o", 10: "d", 16: "X"}
+# numbers above this are first split in chunks of base**digits < 2**62,
+# dividing small chunks is cheaper than dividing the whole number each time
+_BASEN_CHUNKED_MIN = 2**512
+_BASEN_CHUNK_MAX = 2**62
+# base -> (digits per chunk, base**digits, all two digit strings)
+_BASEN_TABLES = {}
+
+
+def _baseN_table(base: int) -> Tuple[int, int, List[str]]:
+    table = _BASEN_TABLES.get(base)
+    if table is None:
+        if not 2 <= base <= len(ALPHABET):
+            raise ValueError(f"base must be between 2 and {len(ALPHABET)}")
+        letters = ALPHABET[:base]
+        digits = 2
+        while base ** (digits + 2) <= _BASEN_CHUNK_MAX:
+            digits += 2
+        pairs = [a + b for a in letters for b in letters]
+        table = _BASEN_TABLES[base] = (digits, base**digits, pairs)
+    return table
+
+
+def _baseN_encode(number: int, base: int) -> str:
+    fmt = _BASEN_FORMATS.get(base)
+    if fmt is not None:
+        return format(number, fmt)
+    digits, chunk, pairs = _baseN_table(base)
+    pair_base = base * base
+    if number < pair_base:
+        return pairs[number][1] if number < base else pairs[number]
+    # two digits per divmod, least significant first
+    parts = []
+    while number >= _BASEN_CHUNKED_MIN:
+        number, low = divmod(number, chunk)
+        for _ in range(digits // 2):
+            low, pair = divmod(low, pair_base)
+            parts.append(pairs[pair])
+    while number:
+        number, pair = divmod(number, pair_base)
+        parts.append(pairs[pair])
+    parts.reverse()
+    result = "".join(parts)
+    return result[1:] if result[0] == "0" else result
+
+
 def baseNEncode(number, *, base=36):
     """Converts an integer to a base36 string."""
-    letters = ALPHABET[0:base]
     if not isinstance(number, int):
         raise TypeError("number must be an integer")
-
-    base36 = ""
-
     if number < 0:
         raise ValueError("number cannot be less than 0")
+    return _baseN_encode(number, base)
 
-    if 0 <= number < base:
-        return letters[number]
 
-    while number != 0:
-        number, i = divmod(number, len(letters))
-        base36 = letters[i] + base36
+def baseNDecode(number, *, base=36):
+    return int(number, base)
 
-    return base36
 
+def baseNEncodeMany(numbers: Iterable[int], *, base=36) -> List[str]:
+    """
+    baseNEncode for many numbers
 
-def baseNDecode(number, *, base=36):
-    return int(number, base)
+    Args:
+        numbers: non negative integers
+        base: base between 2 and 36
+    Returns:
+        encoded numbers in the same order
+    """
+    numbers = list(numbers)
+    for number in numbers:
+        if not isinstance(number, int):
+            raise TypeError("number must be an integer")
+        if number < 0:
+            raise ValueError("number cannot be less than 0")
+    return [_baseN_encode(number, base) for number in numbers]
+
+
+def baseNDecodeMany(values: Iterable[str], *, base=36) -> List[int]:
+    """
+    baseNDecode for many values
+    """
+    return [int(value, base) for value in values]
+
+
+# 36**k for every k needed to cover a 256 bit hash
+_BASE36_POWERS = [36**k for k in range(51)]
+
+
+def _leading_base36(number: int, length: int) -> str:
+    """
+    baseNEncode(number)[:length] without converting the whole number
+    """
+    digits = max(1, bisect_right(_BASE36_POWERS, number))
+    if digits > length:
+        number //= _BASE36_POWERS[digits - length]
+        digits = length
+    result = [""] * digits
+    for i in range(digits - 1, -1, -1):
+        number, result[i] = divmod(number, 36)
+        result[i] = ALPHABET[result[i]]
+    return "".join(result)
+
+
+def _hash_id(input_bytes: bytes, length: int) -> Tuple[str, bytes]:
+    digest = sha256(input_bytes).digest()
+    return _leading_base36(int.from_bytes(digest, "big"), length), digest
 
 
 def make_id(str_val, length, attempts_before_fallback=None):
@@ -59,21 +149,132 @@ def make_id(str_val, length, attempts_before_fallback=None):
     * After 10 attempts, a pseudo random generator is used, seeded with the input string.
     """
     attempts_before_fallback = attempts_before_fallback or length * 3
-    input_bytes = bytearray(str_val, "utf-8")
-    random.seed(str_val)
+    input_bytes = str_val.encode("utf-8")
+    # private generator, seeding the random module is not thread-safe
+    rng = None
     try_count = 0
     while True:
         if try_count < attempts_before_fallback:
             try_count += 1
         else:
-            yield "".join(random.choice(ALPHABET) for i in range(length))
-        h = sha256()
-        h.update(input_bytes)
-        hash_bytes = h.digest()
-        hash_bytes_as_int = int.from_bytes(hash_bytes, "big", signed=False)
-        result = baseNEncode(hash_bytes_as_int, base=36)
-        yield result[:length]
-        input_bytes = h.digest()
+            if rng is None:
+                rng = random.Random(str_val)
+            yield "".join([rng.choice(ALPHABET) for i in range(length)])
+        result, input_bytes = _hash_id(input_bytes, length)
+        yield result
+
+
+def make_ids(values: Iterable[str], length: int) -> List[str]:
+    """
+    First ID make_id() yields for each value
+
+    Args:
+        values: input strings
+        length: ID length
+    Returns:
+        ids in the same order as values
+    """
+    return [_hash_id(value.encode("utf-8"), length)[0] for value in values]
+
+
+ALLOCATE_CANDIDATES = 3
+GET_ALL_CHUNK_SIZE = 1000
+
+
+def _get_owners(db, collection, ids: List[str], value_field: str) -> Dict[str, Any]:
+    """
+    Map each existing id to the value it was allocated to
+    """
+    owners = {}
+    for chunk in make_chunks(ids, GET_ALL_CHUNK_SIZE):
+        refs = [collection.document(doc_id) for doc_id in chunk]
+        for snapshot in db.get_all(refs, field_paths=[value_field]):
+            if snapshot.exists:
+                owners[snapshot.id] = (snapshot.to_dict() or {}).get(value_field)
+    return owners
+
+
+def allocate_ids(
+    db,
+    collection: str,
+    values: Iterable[str],
+    length: int,
+    candidates: int = ALLOCATE_CANDIDATES,
+    value_field: str = "value",
+    max_rounds: int = 10,
+) -> Dict[str, str]:
+    """
+    Allocate a unique make_id() ID to every value, reserved by creating the
+    document collection/ID with {value_field: value}.
+
+    The first candidates IDs of every value are checked with db.get_all(),
+    collisions within values are resolved in memory and the winners are
+    created in one MultiBatch commit. Values whose candidates are all taken
+    get more candidates in the next round. IDs already reserved for a value
+    are reused, so allocating the same values again is idempotent.
+
+    Args:
+        db: Firestore client
+        collection: collection holding the reserved IDs
+        values: make_id() inputs
+        length: ID length
+        candidates: number of make_id() candidates checked per round
+        value_field: field storing the value in reserved documents
+        max_rounds: maximum number of get_all/commit rounds
+    Returns:
+        dict mapping every value to its ID
+    """
+    col = db.collection(collection)
+    generators = {value: make_id(value, length) for value in values}
+    candidates_of = {value: [] for value in generators}
+    allocated = {}
+    pending = list(generators)
+    exhausted = set(pending)
+
+    for _ in range(max_rounds):
+        for value in exhausted:
+            candidates_of[value].extend(islice(generators[value], candidates))
+        owners = _get_owners(
+            db,
+            col,
+            list({c for value in pending for c in candidates_of[value]}),
+            value_field,
+        )
+        taken = set(allocated.values())
+        created = []
+        exhausted = set()
+        batch = MultiBatch(db)
+        for value in pending:
+            value_candidates = candidates_of[value]
+            doc_id = next((c for c in value_candidates if owners.get(c) == value), None)
+            if doc_id is None:
+                doc_id = next(
+                    (c for c in value_candidates if c not in owners and c not in taken),
+                    None,
+                )
+                if doc_id is None:
+                    exhausted.add(value)
+                    continue
+                batch.create(col.document(doc_id), {value_field: value})
+                created.append(value)
+            taken.add(doc_id)
+            allocated[value] = doc_id
+
+        try:
+            if created:
+                batch.commit()
+        except Conflict:
+            # another writer took one of the IDs, batches committed before
+            # the failing one are found as already reserved in the next round
+            for value in created:
+                del allocated[value]
+            pending = created + list(exhausted)
+            continue
+        pending = list(exhausted)
+        if not pending:
+            return {value: allocated[value] for value in generators}
+
+    raise RuntimeError(f"could not allocate IDs for {len(pending)} values")
 
 
 def get_retool_environment(server_mode: str) -> str:
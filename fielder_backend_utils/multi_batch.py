@@ -1,6 +1,9 @@
 from google.cloud.firestore_v1.batch import WriteBatch
 import inspect
 
+# maximum number of writes in one Firestore batch
+BATCH_MAX_WRITES = 500
+
 
 class MultiBatch:
     def __init__(self, db):
@@ -19,7 +22,7 @@ class MultiBatch:
         self.batches = [self.db.batch()]
 
     def _get_batch(self):
-        if len(self.batches[-1]._write_pbs) == 500:
+        if len(self.batches[-1]._write_pbs) == BATCH_MAX_WRITES:
             self.batches.append(self.db.batch())
         return self.batches[-1]
 
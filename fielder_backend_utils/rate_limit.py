@@ -0,0 +1,217 @@
+"""
+Client side rate limiting for third-party APIs.
+
+A RateLimiter is a thread-safe token bucket, optionally combined with a cap
+on the number of requests in flight. It reads the rate limit headers sent by
+Intercom, ClickUp and CometChat to slow down before the provider starts
+rejecting requests, and pauses every caller when a 429 is received.
+
+Limiters are meant to be shared by every client talking to the same account
+and host, use get_rate_limiter() to get a process-wide instance by name:
+
+    limiter = get_rate_limiter("intercom", rate=16, max_concurrency=8)
+    client = IntercomClient(access_token, rate_limiter=limiter)
+"""
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+REMAINING_HEADERS = ("X-RateLimit-Remaining", "X-Rate-Limit-Remaining")
+RESET_HEADERS = ("X-RateLimit-Reset", "X-Rate-Limit-Reset")
+
+# reset headers above this value are epoch timestamps, below it a delay
+_EPOCH_THRESHOLD = 10**9
+
+
+def _get_header(headers: Mapping[str, str], names) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header, either a delay in seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket with an optional concurrency cap
+
+    Args:
+        rate: tokens added per second, i.e. sustained requests per second
+        capacity: maximum burst size, defaults to rate
+        max_concurrency: maximum number of requests in flight, None for no cap
+        min_rate: lower bound when the rate is adapted from response headers,
+            the configured rate is the upper bound
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        min_rate: float = 0.1,
+    ) -> None:
+        assert rate > 0, "rate must be > 0"
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self.throttled = 0  # number of 429 responses seen
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._semaphore = (
+            threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        )
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self._updated_at = now
+
+    def _reserve(self) -> float:
+        """
+        Take a token and return how long the caller must wait before using it
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self) -> float:
+        """
+        Block until a request is allowed, returns the time spent waiting
+        """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """
+        Like acquire(), without blocking the event loop.
+        The concurrency cap does not apply, see limit_async().
+        """
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    @contextmanager
+    def limit(self):
+        """
+        Context manager that waits for a token and holds a concurrency slot
+        """
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        try:
+            self.acquire()
+            yield self
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    @asynccontextmanager
+    async def limit_async(self):
+        """
+        Like limit(), without blocking the event loop. The concurrency cap is
+        shared with threads using limit().
+        """
+        if self._semaphore is not None:
+            delay = 0.001
+            while not self._semaphore.acquire(blocking=False):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        try:
+            await self.acquire_async()
+            yield self
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def update(self, status_code: int, headers: Mapping[str, str]) -> None:
+        """
+        Adapt the rate to the provider's rate limit headers
+
+        Args:
+            status_code: response status code
+            headers: case insensitive response headers
+        """
+        remaining = _get_header(headers, REMAINING_HEADERS)
+        reset = _get_header(headers, RESET_HEADERS)
+        retry_after = retry_after_seconds(headers.get("Retry-After"))
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            if reset is not None:
+                reset_in = reset - time.time() if reset > _EPOCH_THRESHOLD else reset
+                reset_in = max(reset_in, 1.0)
+            else:
+                reset_in = None
+
+            if remaining is not None:
+                # never burst past what the provider still allows
+                self.tokens = min(self.tokens, remaining)
+                if reset_in is not None:
+                    # spread the remaining budget over the rest of the window
+                    self.rate = min(
+                        self.max_rate, max(self.min_rate, remaining / reset_in)
+                    )
+
+            if status_code == 429:
+                self.throttled += 1
+                pause = retry_after if retry_after is not None else reset_in
+                if pause is None:
+                    pause = 1 / self.rate
+                self.blocked_until = max(self.blocked_until, now + pause)
+                self.tokens = min(self.tokens, 0)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, rate: float, **kwargs) -> RateLimiter:
+    """
+    Get the process-wide RateLimiter registered under name, creating it
+    with the given settings on first use.
+
+    Args:
+        name: limiter name, e.g. the client and host "cometchat:APP_ID"
+        rate: requests per second, see RateLimiter
+    Returns:
+        limiter (RateLimiter)
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = _limiters[name] = RateLimiter(rate, **kwargs)
+    return limiter
@@ -7,19 +7,41 @@ from google.cloud.firestore import DocumentReference, GeoPoint
 from lxml.html.clean import Cleaner
 from lxml.html.defs import safe_attrs
 from rest_framework import status
-from rest_framework.exceptions import APIException
-from rest_framework.fields import CharField, ChoiceField, EmailField, Field
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.fields import (
+    CharField,
+    ChoiceField,
+    EmailField,
+    Field,
+    ListField,
+    get_attribute,
+)
 from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import LIST_SERIALIZER_KWARGS, ListSerializer
 from rest_framework.utils.encoders import JSONEncoder
 
 from .firebase import FirebaseHelper
 
 
 class DocumentReferenceField(Field):
+    """
+    A field that converts document paths to Firestore DocumentReferences.
+
+    With prefetch=True, and when used in a serializer that inherits
+    PrefetchDocumentReferencesMixin, the referenced document must exist.
+    Existence of every prefetched reference in the serializer is checked
+    with a single db.get_all() call.
+    """
+
     default_error_messages = {
         "invalid": "Must be a valid firestore DocumentReference.",
+        "does_not_exist": "Document {value} does not exist.",
     }
 
+    def __init__(self, prefetch: bool = False, **kwargs):
+        self.prefetch = prefetch
+        super().__init__(**kwargs)
+
     def to_internal_value(self, data):
         if not isinstance(data, DocumentReference):
             try:
@@ -35,6 +57,153 @@ class DocumentReferenceField(Field):
         return value.path
 
 
+class DocumentReferenceListField(ListField):
+    """
+    A list of DocumentReferenceField, see DocumentReferenceField for prefetch
+    """
+
+    default_error_messages = {
+        "does_not_exist": DocumentReferenceField.default_error_messages[
+            "does_not_exist"
+        ],
+    }
+
+    def __init__(self, prefetch: bool = False, **kwargs):
+        self.prefetch = prefetch
+        kwargs.setdefault("child", DocumentReferenceField(prefetch=prefetch))
+        super().__init__(**kwargs)
+
+
+def _prefetch_references(serializer, value):
+    refs_by_field = {}
+    for field in serializer._writable_fields:
+        if not getattr(field, "prefetch", False) or field.source == "*":
+            continue
+        try:
+            refs = get_attribute(value, field.source_attrs)
+        except (KeyError, AttributeError):
+            continue
+        if refs is None:
+            continue
+        if not isinstance(refs, (list, tuple)):
+            refs = [refs]
+        refs_by_field[field] = refs
+    return refs_by_field
+
+
+def _get_snapshots(refs_by_field_list):
+    unique_refs = {
+        ref.path: ref
+        for refs_by_field in refs_by_field_list
+        for refs in refs_by_field.values()
+        for ref in refs
+    }
+    if not unique_refs:
+        return {}
+    db = FirebaseHelper.getInstance().db
+    return {
+        snapshot.reference.path: snapshot
+        for snapshot in db.get_all(list(unique_refs.values()))
+        if snapshot.exists
+    }
+
+
+def _missing_reference_errors(refs_by_field, snapshots):
+    errors = {}
+    for field, refs in refs_by_field.items():
+        missing = [ref.path for ref in refs if ref.path not in snapshots]
+        if missing:
+            errors[field.field_name] = [
+                field.error_messages["does_not_exist"].format(value=path)
+                for path in missing
+            ]
+    return errors
+
+
+class PrefetchDocumentReferencesMixin:
+    """
+    Serializer mixin that resolves every DocumentReferenceField and
+    DocumentReferenceListField declared with prefetch=True in one
+    db.get_all() round-trip.
+
+    Missing documents fail validation on the field that referenced them.
+    The fetched snapshots are kept on the serializer, not in validated_data,
+    as a dict keyed by document path, so views can reuse them without
+    reading the documents again:
+
+        snapshot = serializer.prefetched_snapshots[ref.path]
+
+    With many=True the list serializer is a
+    PrefetchDocumentReferencesListSerializer, unless Meta sets another
+    list_serializer_class, and the references of every item are fetched
+    together once each item has otherwise validated.
+    """
+
+    @property
+    def prefetched_snapshots(self):
+        return self.__dict__.setdefault("_prefetched_snapshots", {})
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        meta = getattr(cls, "Meta", None)
+        if hasattr(meta, "list_serializer_class"):
+            return super().many_init(*args, **kwargs)
+        # BaseSerializer.many_init with a different default list serializer
+        allow_empty = kwargs.pop("allow_empty", None)
+        list_kwargs = {"child": cls(*args, **kwargs)}
+        if allow_empty is not None:
+            list_kwargs["allow_empty"] = allow_empty
+        list_kwargs.update(
+            {
+                key: value
+                for key, value in kwargs.items()
+                if key in LIST_SERIALIZER_KWARGS
+            }
+        )
+        return PrefetchDocumentReferencesListSerializer(*args, **list_kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if isinstance(self.parent, PrefetchDocumentReferencesListSerializer):
+            # the list serializer fetches the references of all items at once
+            return value
+
+        refs_by_field = _prefetch_references(self, value)
+        snapshots = _get_snapshots([refs_by_field])
+        errors = _missing_reference_errors(refs_by_field, snapshots)
+        if errors:
+            raise ValidationError(errors)
+
+        self.prefetched_snapshots.update(snapshots)
+        return value
+
+
+class PrefetchDocumentReferencesListSerializer(ListSerializer):
+    """
+    List serializer for PrefetchDocumentReferencesMixin serializers, fetching
+    the prefetched references of every item with a single db.get_all()
+    """
+
+    @property
+    def prefetched_snapshots(self):
+        return self.child.prefetched_snapshots
+
+    def to_internal_value(self, data):
+        values = super().to_internal_value(data)
+
+        refs_by_item = [_prefetch_references(self.child, value) for value in values]
+        snapshots = _get_snapshots(refs_by_item)
+        errors = [
+            _missing_reference_errors(refs_by_field, snapshots)
+            for refs_by_field in refs_by_item
+        ]
+        if any(errors):
+            raise ValidationError(errors)
+
+        self.prefetched_snapshots.update(snapshots)
+        return values
+
+
 class EnumChoiceField(ChoiceField):
     error_messages = {
         "invalid_enum_class": "enum must be a subclass of builtin Enum class",
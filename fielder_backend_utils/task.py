@@ -1,56 +1,173 @@
+"""
+Cloud Tasks helpers.
+
+One CloudTasksClient, with its gRPC channel, and the default credentials,
+project and service account email are resolved on first use and shared by
+every call in the process. They are dropped in forked child processes, which
+must not reuse the parent's channel, and can be dropped with reset().
+
+create_http_tasks() creates many tasks concurrently, CoalescingScheduler
+collapses near-duplicate tasks enqueued within a time window.
+"""
 import json
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict
+from hashlib import sha256
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 import google.auth
 from django.conf import settings
+from google.api_core.exceptions import AlreadyExists
 from google.cloud import tasks
 from google.protobuf import timestamp_pb2
 
 logger = logging.getLogger(__name__)
 
+# longest wait between background flushes of CoalescingScheduler after failures
+FLUSH_MAX_BACKOFF = 300  # seconds
 
-def create_http_task(
+
+class _Context(NamedTuple):
+    client: tasks.CloudTasksClient
+    project: str
+    service_account_email: str
+
+
+_context: Optional[_Context] = None
+_lock = threading.Lock()
+
+
+def _make_client(credentials) -> tasks.CloudTasksClient:
+    # reuse the resolved credentials, the client would look them up again
+    return tasks.CloudTasksClient(credentials=credentials)
+
+
+def _get_context() -> _Context:
+    global _context
+    context = _context
+    if context is None:
+        with _lock:
+            context = _context
+            if context is None:
+                # get default credentials
+                # for some unknown reason, in app engine standard
+                # credentials.service_account_email == 'default'
+                # so we don't have choice but to set correct email in
+                # secret manager variable
+                credentials, project = google.auth.default()
+                service_account_email = credentials.service_account_email
+                if service_account_email == "default":
+                    service_account_email = settings.SERVICE_ACCOUNT_EMAIL
+                context = _context = _Context(
+                    _make_client(credentials), project, service_account_email
+                )
+    return context
+
+
+def get_client() -> tasks.CloudTasksClient:
+    """
+    Get the process-wide CloudTasksClient
+    """
+    return _get_context().client
+
+
+def reset() -> None:
+    """
+    Drop the shared client and credentials, they are resolved again on next use
+    """
+    global _context
+    with _lock:
+        _context = None
+
+
+@dataclass
+class HttpTaskSpec:
+    """
+    One task of create_http_tasks()
+
+    Args:
+        http_url: url triggered by the task
+        payload: JSON body
+        scheduled_at: when the task runs, None for now
+        name: task id, unique in the queue, see task_name()
+    """
+
+    http_url: str
+    payload: Dict = None
+    scheduled_at: datetime = None
+    name: Optional[str] = None
+
+
+@dataclass
+class HttpTaskResult:
+    spec: HttpTaskSpec
+    task: Optional[tasks.Task] = None
+    # a task with the same name was created before, e.g. by a retried batch
+    already_exists: bool = False
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def task_name(
     http_url: str,
-    queue: str,
-    queue_location: str,
-    audience: str,
     payload: Dict = None,
-    http_method: str = "POST",
     scheduled_at: datetime = None,
-):
+    http_method: str = "POST",
+) -> str:
     """
-    Create a cloud task job that triggers HTTP url
+    Deterministic task id of a request, Cloud Tasks rejects a second task
+    with the same id so retried requests are not run twice
     """
+    key = json.dumps(
+        [
+            http_method,
+            http_url,
+            payload,
+            scheduled_at.isoformat() if scheduled_at is not None else None,
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return sha256(key.encode()).hexdigest()
 
-    # get default credentials
-    # for some unknown reason, in app engine standard
-    # credentials.service_account_email == 'default'
-    # so we don't have choice but to set correct email in
-    # secret manager variable
-    credentials, project = google.auth.default()
-    service_account_email = credentials.service_account_email
-    if service_account_email == "default":
-        service_account_email = settings.SERVICE_ACCOUNT_EMAIL
 
+def _http_request_template(
+    context: _Context, audience: str, http_method: str
+) -> Dict[str, Any]:
     # oidc_token is required to authenticate
     # cloud run async invocation
     # reference https://cloud.google.com/run/docs/triggering/using-tasks
-    task = {
-        "http_request": {
-            "http_method": http_method,
-            "url": http_url,
-            "headers": {
-                "Content-Type": "application/json",
-            },
-            "oidc_token": {
-                "service_account_email": service_account_email,
-                "audience": audience,
-            },
-        }
+    return {
+        "http_method": http_method,
+        "headers": {
+            "Content-Type": "application/json",
+        },
+        "oidc_token": {
+            "service_account_email": context.service_account_email,
+            "audience": audience,
+        },
     }
 
+
+def _build_task(
+    template: Dict[str, Any],
+    parent: str,
+    http_url: str,
+    payload: Dict = None,
+    scheduled_at: datetime = None,
+    name: str = None,
+) -> Dict[str, Any]:
+    # headers and oidc_token are shared, they are only read when serialized
+    task = {"http_request": {**template, "url": http_url}}
+
     if payload is not None:
         task["http_request"]["body"] = json.dumps(payload).encode()
 
@@ -59,12 +176,381 @@ def create_http_task(
         schedule_time.FromDatetime(scheduled_at)
         task["schedule_time"] = schedule_time
 
-    client = tasks.CloudTasksClient()
-    parent = client.queue_path(project, queue_location, queue)
-    req = {"parent": parent, "task": task}
+    if name is not None:
+        task["name"] = f"{parent}/tasks/{name}"
+    return task
+
+
+def _create_task(client: tasks.CloudTasksClient, req: Dict[str, Any]):
     try:
-        response = client.create_task(request=req)
+        return client.create_task(request=req)
     except Exception as e:
         logger.error(str(req))
         raise e
-    return response
+
+
+def create_http_task(
+    http_url: str,
+    queue: str,
+    queue_location: str,
+    audience: str,
+    payload: Dict = None,
+    http_method: str = "POST",
+    scheduled_at: datetime = None,
+    name: str = None,
+):
+    """
+    Create a cloud task job that triggers HTTP url
+
+    Args:
+        name: optional task id, unique in the queue, see task_name()
+    """
+    context = _get_context()
+    parent = context.client.queue_path(context.project, queue_location, queue)
+    template = _http_request_template(context, audience, http_method)
+    task = _build_task(template, parent, http_url, payload, scheduled_at, name)
+    return _create_task(context.client, {"parent": parent, "task": task})
+
+
+def create_http_tasks(
+    specs: Iterable[HttpTaskSpec],
+    queue: str,
+    queue_location: str,
+    audience: str,
+    http_method: str = "POST",
+    max_workers: int = 10,
+    deterministic_names: bool = False,
+) -> List[HttpTaskResult]:
+    """
+    Create many cloud task jobs concurrently, e.g. one reminder per shift
+    occurrence. A failed task does not stop the others.
+
+    With deterministic_names, specs without a name are named by task_name(),
+    so the batch can be retried safely: tasks created by a previous attempt
+    are reported with already_exists instead of being created twice.
+
+    Args:
+        specs: tasks to create
+        queue: queue name
+        queue_location: queue region
+        audience: OIDC token audience
+        http_method: HTTP method of every task
+        max_workers: maximum number of requests in flight
+        deterministic_names: name specs without a name after their content
+    Returns:
+        results (List[HttpTaskResult]): in the order of specs
+    """
+    context = _get_context()
+    parent = context.client.queue_path(context.project, queue_location, queue)
+    template = _http_request_template(context, audience, http_method)
+
+    def create(spec: HttpTaskSpec) -> HttpTaskResult:
+        result = HttpTaskResult(spec)
+        name = spec.name
+        if name is None and deterministic_names:
+            name = task_name(
+                spec.http_url, spec.payload, spec.scheduled_at, http_method
+            )
+        req = None
+        try:
+            task = _build_task(
+                template, parent, spec.http_url, spec.payload, spec.scheduled_at, name
+            )
+            req = {"parent": parent, "task": task}
+            result.task = context.client.create_task(request=req)
+        except AlreadyExists:
+            result.already_exists = True
+        except Exception as e:
+            logger.error(str(req or spec))
+            result.error = e
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(create, specs))
+
+
+def merge_payloads(old: Optional[Dict], new: Optional[Dict]) -> Optional[Dict]:
+    """
+    Default payload merge of CoalescingScheduler, later keys win
+    """
+    if old is None or new is None:
+        return new if old is None else old
+    return {**old, **new}
+
+
+@dataclass
+class _PendingTask:
+    http_url: str
+    queue: str
+    dedupe_key: Any
+    payload: Optional[Dict]
+    window: int  # index of the window the task is flushed in
+    enqueued: int = 1
+    attempts: int = 0  # failed flushes
+
+
+class CoalescingScheduler:
+    """
+    Collapses near-duplicate cloud tasks, e.g. notifications sent on every
+    edit of the same interview, into one task per window seconds.
+
+    Tasks are keyed by (http_url, queue, dedupe_key). Payloads enqueued with
+    the same key in the same window are merged with merge(old, new) and
+    created as a single task when the window ends. Tasks are named after
+    their key and window, so when several processes coalesce the same key,
+    Cloud Tasks keeps the first task and rejects the others. The payloads
+    of rejected tasks are dropped, handlers should read the current state
+    rather than rely on the payload being the latest.
+
+    Pending tasks are flushed by a background timer, unless auto_flush is
+    False, and by flush() and close(). Call close() before the process
+    exits or use the scheduler as a context manager. Tasks that can't be
+    created are kept pending and retried up to max_attempts times, the
+    background timer backs off while flushes keep failing.
+
+    Args:
+        queue_location: queue region
+        audience: OIDC token audience
+        window: seconds during which tasks with the same key are collapsed
+        merge: function merging two payloads, merge_payloads() by default
+        http_method: HTTP method of every task
+        max_workers: maximum number of tasks created concurrently
+        auto_flush: flush pending tasks from a background timer
+        timer: wall clock, windows are aligned across processes
+        max_attempts: number of flushes a task is tried in before it is dropped
+    """
+
+    def __init__(
+        self,
+        queue_location: str,
+        audience: str,
+        window: float = 10,
+        merge: Callable[[Optional[Dict], Optional[Dict]], Optional[Dict]] = None,
+        http_method: str = "POST",
+        max_workers: int = 10,
+        auto_flush: bool = True,
+        timer: Callable[[], float] = time.time,
+        max_attempts: int = 5,
+    ) -> None:
+        assert window > 0, "window must be > 0"
+        self.queue_location = queue_location
+        self.audience = audience
+        self.window = window
+        self.merge = merge or merge_payloads
+        self.http_method = http_method
+        self.max_workers = max_workers
+        self.auto_flush = auto_flush
+        self.timer = timer
+        self.max_attempts = max_attempts
+        self.enqueued = 0
+        self.collapsed = 0  # enqueues merged into a pending task
+        self.created = 0
+        self.deduplicated = 0  # tasks already created by another process
+        self.retried = 0  # failed tasks kept pending for the next flush
+        self.failed = 0  # tasks dropped after max_attempts
+        self._flush_failures = 0  # consecutive flushes with failed tasks
+        self._pending: Dict[Tuple, _PendingTask] = {}
+        # key -> last window flushed, later enqueues go to the next window
+        self._flushed: Dict[Tuple, int] = {}
+        self._flush_timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "enqueued": self.enqueued,
+            "collapsed": self.collapsed,
+            "created": self.created,
+            "deduplicated": self.deduplicated,
+            "retried": self.retried,
+            "failed": self.failed,
+            "pending": len(self._pending),
+        }
+
+    def enqueue(
+        self,
+        http_url: str,
+        queue: str,
+        payload: Dict = None,
+        dedupe_key: Any = None,
+    ) -> None:
+        """
+        Schedule a task, collapsed with pending tasks of the same key
+
+        Args:
+            http_url: url triggered by the task
+            queue: queue name
+            payload: JSON body, merged with the pending payload
+            dedupe_key: JSON serializable key, e.g. the interview id
+        """
+        key = (http_url, queue, dedupe_key)
+        with self._lock:
+            self.enqueued += 1
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.collapsed += 1
+                pending.enqueued += 1
+                pending.payload = self.merge(pending.payload, payload)
+                return
+            window = int(self.timer() // self.window)
+            flushed = self._flushed.get(key)
+            if flushed is not None and window <= flushed:
+                window = flushed + 1
+            self._pending[key] = _PendingTask(
+                http_url, queue, dedupe_key, payload, window
+            )
+            if self.auto_flush:
+                self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_timer is not None or not self._pending:
+            return
+        due = min(pending.window for pending in self._pending.values()) + 1
+        delay = max(0.0, due * self.window - self.timer())
+        if self._flush_failures:
+            # failed tasks are due again at once, don't retry them in a loop
+            backoff = self.window * 2 ** (self._flush_failures - 1)
+            delay = max(delay, min(backoff, FLUSH_MAX_BACKOFF))
+        self._flush_timer = threading.Timer(delay, self._on_flush_timer)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def _on_flush_timer(self) -> None:
+        with self._lock:
+            self._flush_timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("failed to flush coalesced tasks")
+        with self._lock:
+            if self.auto_flush:
+                self._schedule_flush()
+
+    def _task_name(self, pending: _PendingTask) -> str:
+        return task_name(
+            pending.http_url,
+            {"dedupe_key": pending.dedupe_key, "window": pending.window},
+            http_method=self.http_method,
+        )
+
+    def _requeue(self, key: Tuple, pending: _PendingTask) -> None:
+        # called with the lock held
+        pending.attempts += 1
+        if pending.attempts >= self.max_attempts:
+            self.failed += 1
+            return
+        self.retried += 1
+        newer = self._pending.get(key)
+        if newer is None:
+            # same window, so the same name if it was created after all
+            self._pending[key] = pending
+        else:
+            newer.payload = self.merge(pending.payload, newer.payload)
+            newer.enqueued += pending.enqueued
+            newer.attempts = max(newer.attempts, pending.attempts)
+
+    def flush(self, force: bool = False) -> List[HttpTaskResult]:
+        """
+        Create the pending tasks whose window has ended
+
+        Args:
+            force: create every pending task, e.g. before shutting down
+        Returns:
+            results (List[HttpTaskResult])
+        """
+        with self._lock:
+            now_window = int(self.timer() // self.window)
+            due = {
+                key: pending
+                for key, pending in self._pending.items()
+                if force or pending.window < now_window
+            }
+            for key, pending in due.items():
+                del self._pending[key]
+                self._flushed[key] = pending.window
+            # windows before the previous one can't be reused by enqueue()
+            self._flushed = {
+                key: window
+                for key, window in self._flushed.items()
+                if window >= now_window - 1 or key in self._pending
+            }
+
+        if not due:
+            return []
+
+        by_queue: Dict[str, List[Tuple[Tuple, _PendingTask]]] = {}
+        for key, pending in due.items():
+            by_queue.setdefault(pending.queue, []).append((key, pending))
+        results = []
+        try:
+            for queue, items in by_queue.items():
+                specs = [
+                    HttpTaskSpec(
+                        pending.http_url, pending.payload, name=self._task_name(pending)
+                    )
+                    for key, pending in items
+                ]
+                results.extend(
+                    zip(
+                        items,
+                        create_http_tasks(
+                            specs,
+                            queue,
+                            self.queue_location,
+                            self.audience,
+                            http_method=self.http_method,
+                            max_workers=self.max_workers,
+                        ),
+                    )
+                )
+        except Exception:
+            # put the tasks back, those already created have the same name
+            # and will be deduplicated on the next flush
+            with self._lock:
+                for key, pending in due.items():
+                    self._requeue(key, pending)
+                self._flush_failures += 1
+            raise
+
+        with self._lock:
+            failures = False
+            for (key, pending), result in results:
+                if result.already_exists:
+                    self.deduplicated += 1
+                elif result.ok:
+                    self.created += 1
+                else:
+                    failures = True
+                    self._requeue(key, pending)
+            self._flush_failures = self._flush_failures + 1 if failures else 0
+        return [result for item, result in results]
+
+    def close(self) -> List[HttpTaskResult]:
+        """
+        Stop the background timer and create every pending task
+        """
+        self._stop_timer()
+        return self.flush(force=True)
+
+    def _stop_timer(self) -> None:
+        with self._lock:
+            self.auto_flush = False
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+    def __enter__(self) -> "CoalescingScheduler":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _reset_after_fork() -> None:
+    # gRPC channels must not be shared with a forked child process
+    global _context, _lock
+    _lock = threading.Lock()
+    _context = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
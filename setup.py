@@ -15,7 +15,9 @@ install_requires = [
     "google-cloud-pubsub~=2.13.10",
     "google-auth~=2.13.0",
     "gunicorn~=20.1.0",
+    "httpx~=0.24.1",
     "lxml~=4.9.0",
+    "numpy~=1.21.6",
     "pyjwt~=2.6.0",
     "pyparsing~=3.0.9",
     "python-i18n~=0.3.9",
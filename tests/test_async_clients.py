@@ -0,0 +1,128 @@
+import asyncio
+from unittest import TestCase
+
+from fielder_backend_utils import async_http_client
+from fielder_backend_utils.clickup import AsyncClickUpAPIHelper
+from fielder_backend_utils.cometchat import AsyncCometChatHelper
+from fielder_backend_utils.cometchat.exceptions import (
+    CometChatUIDAlreadyExistsException,
+)
+from fielder_backend_utils.intercom import AsyncIntercomClient
+
+from .mock_server import MockServer
+
+
+def api_handler(method, path, headers, body):
+    # Intercom
+    if path == "/contacts/search":
+        return 200, {}, {"data": []}
+    if path == "/contacts":
+        return 200, {}, {"id": "contact_" + body["external_id"], **body}
+    # CometChat
+    if path == "/users" and body["uid"] == "existing":
+        return (
+            400,
+            {},
+            {"error": {"code": "ERR_UID_ALREADY_EXISTS", "message": "exists"}},
+        )
+    if path == "/users":
+        return 200, {}, {"data": {**body, "createdAt": 1}}
+    # ClickUp
+    if path.startswith("/task/"):
+        return 200, {}, {"id": path.split("/")[2], "path": path}
+    return 404, {}, {}
+
+
+class TestAsyncClients(TestCase):
+    def setUp(self):
+        self.server = MockServer(api_handler).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def run_async(self, coro):
+        async def run():
+            try:
+                return await coro
+            finally:
+                await async_http_client.aclose()
+
+        return asyncio.run(run())
+
+    def test_intercom(self):
+        self.run_async(self._test_intercom())
+
+    async def _test_intercom(self):
+        client = AsyncIntercomClient("TOKEN")
+        client.base_url = self.server.url
+        user = await client.get_or_create_user("worker_1", name="Jane")
+        self.assertEqual(
+            user,
+            {
+                "id": "contact_worker_1",
+                "role": "user",
+                "external_id": "worker_1",
+                "name": "Jane",
+            },
+        )
+        self.assertEqual(
+            [(m, p) for m, p, *_ in self.server.requests],
+            [("POST", "/contacts/search"), ("POST", "/contacts")],
+        )
+        self.assertEqual(self.server.requests[0][2]["Authorization"], "Bearer TOKEN")
+
+    def test_cometchat(self):
+        self.run_async(self._test_cometchat())
+
+    async def _test_cometchat(self):
+        helper = AsyncCometChatHelper("APP", "eu", "KEY")
+        helper.base_url = self.server.url
+        user = await helper.create_user("uid_1", "Jane", tags=["worker"])
+        self.assertEqual(user.uid, "uid_1")
+        self.assertEqual(user.tags, ["worker"])
+        self.assertEqual(user.createdAt, 1)
+        with self.assertRaises(CometChatUIDAlreadyExistsException):
+            await helper.create_user("existing", "Jane")
+
+    def test_clickup(self):
+        self.run_async(self._test_clickup())
+
+    async def _test_clickup(self):
+        helper = AsyncClickUpAPIHelper(access_token="TOKEN")
+        helper.base_url = self.server.url
+        response = await helper.get_task("abc", custom_task_ids=True, team_id=1)
+        self.assertEqual(
+            response.json()["path"], "/task/abc?custom_task_ids=True&team_id=1"
+        )
+        response = await helper.get_task("abc")
+        self.assertEqual(response.json()["path"], "/task/abc?custom_task_ids=False")
+        with self.assertRaises(Exception):
+            await helper.get_task("abc", custom_task_ids=True)
+
+    def test_gather(self):
+        self.run_async(self._test_gather())
+
+    async def _test_gather(self):
+        running = 0
+        max_running = 0
+
+        async def job(i):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01 * (i % 3))
+            running -= 1
+            return i
+
+        results = await async_http_client.gather([job(i) for i in range(20)], limit=4)
+        self.assertEqual(results, list(range(20)))
+        self.assertEqual(max_running, 4)
+
+        client = AsyncIntercomClient("TOKEN")
+        client.base_url = self.server.url
+        users = await async_http_client.gather(
+            [client.create_user(f"worker_{i}") for i in range(50)], limit=10
+        )
+        self.assertEqual(
+            [u["id"] for u in users], [f"contact_worker_{i}" for i in range(50)]
+        )
@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+from fielder_backend_utils.cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        # b is the least recently used
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_expiry(self):
+        timer = FakeTimer()
+        cache = TTLCache(ttl=10, timer=timer)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=100)
+        timer.now = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("a", "default"), "default")
+        self.assertEqual(cache.get("b"), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertAlmostEqual(cache.hit_rate, 1 / 3)
+        self.assertEqual(cache.pop("b"), 2)
+        self.assertNotIn("b", cache)
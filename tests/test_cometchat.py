@@ -0,0 +1,270 @@
+import json
+import random
+import string
+from base64 import b32decode, b32encode
+from unittest import TestCase, mock
+
+import requests
+from requests import Response
+
+from fielder_backend_utils.cometchat import CometChatAuthTokenCache, CometChatHelper
+from fielder_backend_utils.cometchat.dataclasses import (
+    CometChatAuthToken,
+    CometChatUser,
+)
+from fielder_backend_utils.cometchat.helpers import (
+    UIDMemo,
+    decode_uid,
+    decode_uids,
+    encode_uid,
+    encode_uids,
+)
+from fielder_backend_utils.cometchat.exceptions import (
+    CometChatAuthTokenNotFoundException,
+    CometChatBadRequestException,
+    CometChatException,
+    CometChatOnBehalfOfUIDNotFoundException,
+    CometChatTooManyRequestsException,
+    CometChatUIDAlreadyExistsException,
+    CometChatUIDNotFoundException,
+)
+
+from .mock_server import MockServer
+
+
+class CometChatStandIn:
+    def __init__(self, existing=()):
+        self.users = {uid: {"uid": uid, "name": "old"} for uid in existing}
+        self.messages = []
+
+    def error(self, code):
+        return 400, {}, {"error": {"code": code, "message": code}}
+
+    def __call__(self, method, path, headers, body):
+        if path == "/users" and method == "POST":
+            if body["uid"] in self.users:
+                return self.error("ERR_UID_ALREADY_EXISTS")
+            self.users[body["uid"]] = body
+            return 200, {}, {"data": body}
+        if path.startswith("/users/") and method == "PUT":
+            uid = path.split("/")[2]
+            self.users[uid].update(body)
+            return 200, {}, {"data": self.users[uid]}
+        if path == "/messages":
+            if headers["onBehalfOf"] == "unknown":
+                return self.error("ERR_ON_BEHALF_OF_UID_NOT_FOUND")
+            self.messages.append(body)
+            return 200, {}, {"data": {"id": str(len(self.messages))}}
+        return 404, {}, {}
+
+
+class TestCometChat(TestCase):
+    def test_bulk_create_or_update_users(self):
+        stand_in = CometChatStandIn(existing=["u1", "u3"])
+        with MockServer(stand_in) as server:
+            helper = CometChatHelper("APP", "eu", "KEY")
+            helper.base_url = server.url
+            users = [CometChatUser(uid=f"u{i}", name=f"User {i}") for i in range(6)]
+            results = helper.bulk_create_or_update_users(users, max_workers=3)
+
+        self.assertEqual([r.uid for r in results], [u.uid for u in users])
+        self.assertEqual([r.name for r in results], [u.name for u in users])
+        self.assertEqual(stand_in.users["u3"]["name"], "User 3")
+        methods = sorted(m for m, *_ in server.requests)
+        # 6 creates, 2 of which are retried as updates
+        self.assertEqual(methods, ["POST"] * 6 + ["PUT"] * 2)
+
+    def test_broadcast_text_message(self):
+        stand_in = CometChatStandIn()
+        receivers = [f"u{i}" for i in range(60)]
+        with MockServer(stand_in) as server:
+            helper = CometChatHelper("APP", "eu", "KEY")
+            helper.base_url = server.url
+            results = helper.broadcast_text_message("hi", "admin", receivers)
+            self.assertEqual(results, [None, None, None])
+            sent = sorted(
+                (m["multipleReceivers"]["uids"] for m in stand_in.messages),
+                key=len,
+                reverse=True,
+            )
+            self.assertEqual([len(uids) for uids in sent], [25, 25, 10])
+            self.assertEqual(sorted(sum(sent, [])), sorted(receivers))
+
+            results = helper.broadcast_text_message(
+                "hi", "unknown", receivers, chunk_size=50
+            )
+            self.assertEqual(len(results), 2)
+            for result in results:
+                self.assertIsInstance(result, CometChatOnBehalfOfUIDNotFoundException)
+
+    def test_bulk_network_errors(self):
+        helper = CometChatHelper("APP", "eu", "KEY")
+
+        def create_or_update_user(user):
+            if user.uid == "u1":
+                raise requests.ConnectionError("connection reset")
+            return user
+
+        users = [CometChatUser(uid=f"u{i}", name=f"User {i}") for i in range(3)]
+        with mock.patch.object(
+            helper, "create_or_update_user", side_effect=create_or_update_user
+        ):
+            results = helper.bulk_create_or_update_users(users)
+        self.assertEqual(results[0], users[0])
+        self.assertIsInstance(results[1], requests.ConnectionError)
+        self.assertEqual(results[2], users[2])
+
+        def send_text_message(text, sender_uid, chunk, metadata):
+            if "u0" in chunk:
+                raise requests.Timeout("read timeout")
+
+        with mock.patch.object(
+            helper, "send_text_message", side_effect=send_text_message
+        ):
+            results = helper.broadcast_text_message(
+                "hi", "admin", [f"u{i}" for i in range(50)]
+            )
+        self.assertIsInstance(results[0], requests.Timeout)
+        self.assertEqual(results[1], None)
+
+
+class DictAuthTokenStore:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, uid):
+        return self.data.get(uid)
+
+    def set(self, uid, auth_token, validated_at):
+        self.data[uid] = (auth_token, validated_at)
+
+    def delete(self, uid):
+        self.data.pop(uid, None)
+
+
+class TestCometChatAuthTokenCache(TestCase):
+    def setUp(self):
+        self.helper = mock.Mock()
+        self.tokens = iter(range(100))
+        self.helper.create_auth_token.side_effect = lambda uid: CometChatAuthToken(
+            uid=uid, authToken=f"token_{next(self.tokens)}", createdAt=1
+        )
+
+    @mock.patch("fielder_backend_utils.cometchat.helpers.time")
+    def test_get_auth_token(self, time_mock):
+        time_mock.time.return_value = 1000
+        store = DictAuthTokenStore()
+        cache = CometChatAuthTokenCache(self.helper, ttl=60, store=store)
+
+        token = cache.get_auth_token("u1")
+        self.assertEqual(token.authToken, "token_0")
+        self.assertEqual(cache.get_auth_token("u1"), token)
+        self.helper.create_auth_token.assert_called_once_with("u1")
+        self.helper.get_auth_token.assert_not_called()
+
+        # after ttl the token is validated once, then trusted again
+        time_mock.time.return_value = 1060
+        self.assertEqual(cache.get_auth_token("u1"), token)
+        self.assertEqual(cache.get_auth_token("u1"), token)
+        self.helper.get_auth_token.assert_called_once_with("u1", "token_0")
+        self.assertEqual(store.data["u1"][1], 1060)
+
+        # revoked tokens are evicted and replaced
+        time_mock.time.return_value = 2000
+        self.helper.get_auth_token.side_effect = CometChatAuthTokenNotFoundException
+        self.assertEqual(cache.get_auth_token("u1").authToken, "token_1")
+        self.assertEqual(store.data["u1"][0].authToken, "token_1")
+
+        # another process reads the persistent store
+        other = CometChatAuthTokenCache(self.helper, ttl=60, store=store)
+        self.assertEqual(other.get_auth_token("u1").authToken, "token_1")
+        self.assertEqual(self.helper.create_auth_token.call_count, 2)
+
+    def test_lru(self):
+        cache = CometChatAuthTokenCache(self.helper, maxsize=1)
+        cache.get_auth_token("u1")
+        cache.get_auth_token("u2")
+        self.assertEqual(cache.get_auth_token("u1").authToken, "token_2")
+
+
+class TestCometChatParsing(TestCase):
+    def make_response(self, status_code, body):
+        response = Response()
+        response.status_code = status_code
+        response._content = (
+            body if isinstance(body, bytes) else json.dumps(body).encode()
+        )
+        return response
+
+    def test_parse_response(self):
+        helper = CometChatHelper("APP", "eu", "KEY")
+        data = {"uid": "u1", "name": "Jane", "deactivatedAt": 0, "conversationId": "c"}
+        user = CometChatUser.from_dict(
+            helper._parse_data(self.make_response(200, {"data": data}))
+        )
+        self.assertEqual((user.uid, user.name), ("u1", "Jane"))
+
+        for body in ({"data": None}, {}, [], b"OK"):
+            with self.assertRaises(CometChatException):
+                helper._parse_data(self.make_response(200, body))
+
+        for code, exception in [
+            ("ERR_UID_ALREADY_EXISTS", CometChatUIDAlreadyExistsException),
+            ("ERR_UID_NOT_FOUND", CometChatUIDNotFoundException),
+            ("ERR_AUTH_TOKEN_NOT_FOUND", CometChatAuthTokenNotFoundException),
+            ("ERR_BAD_REQUEST", CometChatBadRequestException),
+            ("ERR_SOMETHING_NEW", CometChatException),
+        ]:
+            response = self.make_response(
+                400, {"error": {"code": code, "message": "message"}}
+            )
+            with self.assertRaises(exception) as cm:
+                helper._parse_response(response)
+            self.assertIs(type(cm.exception), exception)
+
+        with self.assertRaises(CometChatException):
+            helper._parse_response(self.make_response(502, b"<html>Bad Gateway"))
+        with self.assertRaises(CometChatTooManyRequestsException):
+            helper._parse_response(self.make_response(429, b"slow down"))
+
+
+class TestUIDEncoding(TestCase):
+    @staticmethod
+    def old_encode_uid(uid):
+        return b32encode(uid.encode()).decode().lower().replace("=", "_")
+
+    @staticmethod
+    def old_decode_uid(uid):
+        return b32decode(uid.upper().replace("_", "=")).decode()
+
+    def random_uids(self, rng, n):
+        alphabet = string.ascii_letters + string.digits + "-_é€"
+        return ["".join(rng.choices(alphabet, k=rng.randint(1, 30))) for _ in range(n)]
+
+    def test_matches_previous_implementation(self):
+        rng = random.Random(0)
+        # Firestore ids (unpadded, batched path) and arbitrary strings
+        firestore_ids = [
+            "".join(rng.choices(string.ascii_letters + string.digits, k=20))
+            for _ in range(200)
+        ]
+        for uids in (firestore_ids, self.random_uids(rng, 500)):
+            expected = [self.old_encode_uid(uid) for uid in uids]
+            self.assertEqual([encode_uid(uid) for uid in uids], expected)
+            self.assertEqual(encode_uids(uids), expected)
+            self.assertEqual([decode_uid(e) for e in expected], uids)
+            self.assertEqual(decode_uids(expected), uids)
+            self.assertEqual([self.old_decode_uid(e) for e in expected], uids)
+        self.assertEqual(encode_uids([]), [])
+        self.assertEqual(decode_uids([]), [])
+
+    def test_uid_memo(self):
+        memo = UIDMemo()
+        uids = ["a" * 20, "b" * 20, "a" * 20, "c"]
+        encoded = memo.encode_many(uids)
+        self.assertEqual(encoded, [encode_uid(uid) for uid in uids])
+        self.assertEqual(len(memo.encoded), 3)
+        self.assertEqual(memo.decode_many(encoded), uids)
+        self.assertEqual(memo.decode(encode_uid("d")), "d")
+        self.assertEqual(memo.encoded["d"], encode_uid("d"))
+        self.assertEqual(memo.encode("c"), encode_uid("c"))
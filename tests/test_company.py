@@ -0,0 +1,444 @@
+import asyncio
+import time
+from datetime import datetime
+from unittest import TestCase, mock
+
+from google.cloud.firestore_v1.client import Client
+
+from fielder_backend_utils import async_http_client, company
+from fielder_backend_utils.company import (
+    CompaniesHouseCache,
+    SICCodeRegistry,
+    enrich_companies,
+    get_company_data,
+    get_company_data_async,
+    get_company_number,
+    get_sic_code_descriptions,
+    normalize_company_name,
+)
+
+from .mock_server import MockServer
+
+PROFILE = {
+    "company_name": "FIELDER LTD",
+    "company_number": "01234567",
+    "date_of_creation": "2019-05-01",
+    "sic_codes": ["62012", "99999", "62012"],
+    "registered_office_address": {
+        "address_line_1": "50 Kensington Court",
+        "locality": "London",
+        "country": "England",
+        "postal_code": "W8 5DB",
+    },
+}
+OFFICERS = {
+    "items": [
+        {"name": "DOE, Jane", "appointed_on": "2019-05-01"},
+        {
+            "name": "DOE, John",
+            "appointed_on": "2019-05-01",
+            "resigned_on": "2020-01-01",
+        },
+    ]
+}
+FILING_HISTORY = {"items": [{"date": "2022-06-30"}, {"date": "2021-06-30"}]}
+SIC_CODES = {"62012": "Business and domestic software development"}
+
+EXPECTED = {
+    "company_name": "FIELDER LTD",
+    "incorporation_date": datetime(2019, 5, 1),
+    "registration_number": "01234567",
+    "directors": [{"name": "DOE, Jane", "appointment_date": datetime(2019, 5, 1)}],
+    "sic_codes": [
+        {"code": "62012", "description": SIC_CODES["62012"]},
+        {"code": "99999", "description": None},
+        {"code": "62012", "description": SIC_CODES["62012"]},
+    ],
+    "last_filing_date": datetime(2022, 6, 30),
+    "address": {
+        "name": "50 Kensington Court",
+        "street": None,
+        "town": "London",
+        "county": None,
+        "country": "England",
+        "postcode": "W8 5DB",
+        "po_box": None,
+    },
+}
+
+DELAY = 0.2
+
+
+def companies_house_handler(method, path, headers, body):
+    time.sleep(DELAY)
+    if path == "/company/01234567":
+        return 200, {}, PROFILE
+    if path == "/company/01234567/officers":
+        return 200, {}, OFFICERS
+    if path == "/company/01234567/filing-history":
+        return 200, {}, FILING_HISTORY
+    return 404, {}, {}
+
+
+def sic_code_snapshots(codes):
+    return [
+        mock.Mock(id=code, to_dict=lambda d=description: {"description": d})
+        for code, description in codes.items()
+    ]
+
+
+def fake_db():
+    db = mock.Mock(spec=Client)
+
+    def document(code):
+        return mock.Mock(id=code)
+
+    def get_all(refs):
+        return [
+            mock.Mock(
+                id=ref.id,
+                exists=ref.id in SIC_CODES,
+                to_dict=lambda ref=ref: {"description": SIC_CODES[ref.id]},
+            )
+            for ref in refs
+        ]
+
+    db.collection.return_value.document.side_effect = document
+    db.collection.return_value.stream.side_effect = lambda: sic_code_snapshots(
+        SIC_CODES
+    )
+    db.get_all.side_effect = get_all
+    return db
+
+
+class CompaniesHouseTestMixin:
+    def setUp(self):
+        self.server = MockServer(companies_house_handler).__enter__()
+        patcher = mock.patch.object(company, "COMPANY_HOUSE_API_URL", self.server.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.server.__exit__)
+        self.db = fake_db()
+
+    def assertCompanyData(self, company_data):
+        self.assertIsInstance(company_data.pop("last_updated"), datetime)
+        self.assertEqual(company_data, EXPECTED)
+        self.assertEqual(list(company_data), list(EXPECTED))
+        self.db.get_all.assert_called_once()
+
+
+class TestCompany(CompaniesHouseTestMixin, TestCase):
+    def test_get_company_data(self):
+        start = time.perf_counter()
+        company_data = get_company_data("API_KEY", "01234567", db=self.db)
+        # the three requests run concurrently
+        self.assertLess(time.perf_counter() - start, 2 * DELAY)
+        self.assertCompanyData(company_data)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_not_found(self):
+        self.assertEqual(get_company_data("API_KEY", "404", db=self.db), {})
+        self.db.get_all.assert_not_called()
+
+    def test_optional_parts(self):
+        company_data = get_company_data(
+            "API_KEY",
+            "01234567",
+            sic_codes=False,
+            directors=False,
+            filing_history=False,
+        )
+        self.assertEqual(company_data["sic_codes"], [])
+        self.assertEqual(company_data["directors"], [])
+        self.assertIsNone(company_data["last_filing_date"])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_get_sic_code_descriptions(self):
+        self.assertEqual(
+            get_sic_code_descriptions(self.db, ["62012", "99999"]),
+            {"62012": SIC_CODES["62012"], "99999": None},
+        )
+        self.assertEqual(get_sic_code_descriptions(self.db, []), {})
+        self.db.get_all.assert_called_once()
+
+
+class TestCompanyAsync(CompaniesHouseTestMixin, TestCase):
+    def get_company_data(self, *args, **kwargs):
+        async def run():
+            try:
+                return await get_company_data_async(*args, **kwargs)
+            finally:
+                await async_http_client.aclose()
+
+        return asyncio.run(run())
+
+    def test_get_company_data_async(self):
+        start = time.perf_counter()
+        company_data = self.get_company_data("API_KEY", "01234567", db=self.db)
+        self.assertLess(time.perf_counter() - start, 2 * DELAY)
+        self.assertCompanyData(company_data)
+
+    def test_not_found(self):
+        self.assertEqual(self.get_company_data("API_KEY", "404", db=self.db), {})
+
+
+class TestSICCodeRegistry(CompaniesHouseTestMixin, TestCase):
+    def test_lazy_load(self):
+        registry = SICCodeRegistry(self.db)
+        stream = self.db.collection.return_value.stream
+        stream.assert_not_called()
+        self.assertEqual(registry.get("62012"), SIC_CODES["62012"])
+        self.assertIsNone(registry.get("99999"))
+        self.assertEqual(
+            registry.get_many(["99999", "62012"]),
+            {"99999": None, "62012": SIC_CODES["62012"]},
+        )
+        stream.assert_called_once()
+        with self.assertRaises(TypeError):
+            registry.codes["99999"] = "changed"
+
+    def test_ttl(self):
+        registry = SICCodeRegistry(self.db, ttl=60)
+        stream = self.db.collection.return_value.stream
+        with mock.patch("fielder_backend_utils.company.time.monotonic") as monotonic:
+            monotonic.return_value = 1000
+            registry.get("62012")
+            monotonic.return_value = 1059
+            registry.get("62012")
+            self.assertEqual(stream.call_count, 1)
+            monotonic.return_value = 1060
+            registry.get("62012")
+            self.assertEqual(stream.call_count, 2)
+        registry.refresh()
+        registry.get("62012")
+        self.assertEqual(stream.call_count, 3)
+
+    def test_snapshot_listener(self):
+        registry = SICCodeRegistry(self.db, ttl=0, listen=True)
+        collection = self.db.collection.return_value
+        self.assertEqual(registry.get("62012"), SIC_CODES["62012"])
+        callback = collection.on_snapshot.call_args[0][0]
+        callback(sic_code_snapshots({"99999": "Dormant company"}), [], None)
+        self.assertEqual(registry.get("99999"), "Dormant company")
+        self.assertIsNone(registry.get("62012"))
+        collection.stream.assert_called_once()
+        collection.on_snapshot.assert_called_once()
+        registry.close()
+        collection.on_snapshot.return_value.unsubscribe.assert_called_once()
+
+    def test_get_company_data(self):
+        registry = SICCodeRegistry(self.db)
+        company_data = get_company_data(
+            "API_KEY", "01234567", sic_code_registry=registry
+        )
+        self.assertEqual(company_data["sic_codes"], EXPECTED["sic_codes"])
+        self.db.get_all.assert_not_called()
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self._write_pbs = []
+
+    def set(self, ref, data, merge=False):
+        self._write_pbs.append((ref, data, merge))
+
+    def commit(self):
+        attempt = self.db.commit_attempts
+        self.db.commit_attempts += 1
+        if self.db.fail_commits is True or attempt in (self.db.fail_commits or ()):
+            raise RuntimeError("commit failed")
+        self.db.commits.append(self._write_pbs)
+
+
+def enrichment_handler(method, path, headers, body):
+    number = path.split("/")[2]
+    if number.startswith("BROKEN"):
+        return 200, {}, {"company_number": number}
+    if number.startswith("MISSING"):
+        return 404, {}, {}
+    if path.endswith("/officers"):
+        return 200, {}, OFFICERS
+    if path.endswith("/filing-history"):
+        return 200, {}, FILING_HISTORY
+    return 200, {}, {**PROFILE, "company_number": number}
+
+
+class TestEnrichCompanies(TestCase):
+    def setUp(self):
+        self.server = MockServer(enrichment_handler).__enter__()
+        patcher = mock.patch.object(company, "COMPANY_HOUSE_API_URL", self.server.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.server.__exit__)
+        self.db = fake_db()
+        self.db.commits = []
+        self.db.fail_commits = False  # True, or indices of commits to fail
+        self.db.commit_attempts = 0
+        self.db.batch.side_effect = lambda: FakeBatch(self.db)
+
+    def writes(self):
+        return [write for commit in self.db.commits for write in commit]
+
+    def test_enrich_companies(self):
+        organisations = [(f"organisations/{i}", f"SC{i:06d}") for i in range(20)] + [
+            ("organisations/duplicate", " sc000001 "),
+            ("organisations/no_number", None),
+            ("organisations/missing", "MISSING1"),
+            ("organisations/broken", "BROKEN1"),
+        ]
+        report = enrich_companies(
+            "API_KEY", organisations, self.db, max_workers=4, batch_size=5
+        )
+        self.assertEqual(report.updated, 21)
+        self.assertEqual(report.skipped, 2)
+        self.assertEqual(report.failed, 1)
+        self.assertEqual(list(report.errors), ["BROKEN1"])
+        self.assertIsInstance(report.errors["BROKEN1"], KeyError)
+
+        # one profile request per distinct company number
+        profiles = [r for r in self.server.requests if r[1].count("/") == 2]
+        self.assertEqual(len(profiles), 22)
+        self.assertGreater(len(self.db.commits), 1)
+        writes = {ref: data for ref, data, merge in self.writes()}
+        self.assertEqual(len(writes), 21)
+        self.assertEqual(writes["organisations/duplicate"], writes["organisations/1"])
+        self.assertEqual(writes["organisations/3"]["registration_number"], "SC000003")
+        self.assertEqual(writes["organisations/3"]["sic_codes"], EXPECTED["sic_codes"])
+        self.db.get_all.assert_not_called()
+
+    def test_field_path(self):
+        enrich_companies(
+            "API_KEY", [("organisations/1", "SC000001")], self.db, field_path="company"
+        )
+        [(ref, data, merge)] = self.writes()
+        self.assertEqual(list(data), ["company"])
+        self.assertEqual(data["company"]["registration_number"], "SC000001")
+        self.assertTrue(merge)
+
+    def test_commit_failure(self):
+        self.db.fail_commits = True
+        report = enrich_companies(
+            "API_KEY",
+            [("organisations/1", "SC000001"), ("organisations/2", "SC000002")],
+            self.db,
+        )
+        self.assertEqual(report.updated, 0)
+        self.assertEqual(report.failed, 2)
+        self.assertEqual(set(report.errors), {"SC000001", "SC000002"})
+
+    def test_partial_commit_failure(self):
+        self.db.fail_commits = {1}
+        organisations = [(f"organisations/a{i}", "SC000001") for i in range(3)]
+        organisations.append(("organisations/b", "SC000002"))
+        report = enrich_companies(
+            "API_KEY", organisations, self.db, max_workers=1, batch_size=2
+        )
+        # the first commit was written, only the second one failed
+        self.assertEqual([len(commit) for commit in self.db.commits], [2])
+        self.assertEqual(report.updated, 2)
+        self.assertEqual(report.failed, 2)
+
+    def test_commits_are_single_batches(self):
+        organisations = [(f"organisations/{i}", "SC000001") for i in range(600)]
+        report = enrich_companies("API_KEY", organisations, self.db, batch_size=1000)
+        self.assertEqual([len(commit) for commit in self.db.commits], [500, 100])
+        self.assertEqual(report.updated, 600)
+
+    def test_bounded_fetch_window(self):
+        ahead = []
+
+        def fake_get_company_data(api_key, company_number, **kwargs):
+            ahead.append(len(ahead) + 1 - len(self.db.commits))
+            return {"registration_number": company_number}
+
+        organisations = [(f"organisations/{i}", f"SC{i:06d}") for i in range(50)]
+        with mock.patch.object(company, "get_company_data", fake_get_company_data):
+            report = enrich_companies(
+                "API_KEY", organisations, self.db, max_workers=2, batch_size=1
+            )
+        self.assertEqual(report.updated, 50)
+        # fetches never run more than 2 * max_workers companies ahead of writes
+        self.assertLessEqual(max(ahead), 4)
+
+
+SEARCH = {
+    "items": [
+        {"company_number": "01234567", "company_status": "active"},
+        {"company_number": "07654321", "company_status": "dissolved"},
+    ]
+}
+
+
+def etag_handler(method, path, headers, body):
+    if path.startswith("/search/companies"):
+        return 200, {}, SEARCH
+    status, _, data = companies_house_handler(method, path, headers, body)
+    etag = f'"{path}"'
+    if status == 200 and headers.get("If-None-Match") == etag:
+        return 304, {"ETag": etag}, b""
+    return status, {"ETag": etag}, data
+
+
+class TestCompaniesHouseCache(CompaniesHouseTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.handler = etag_handler
+        self.now = 0.0
+        self.cache = CompaniesHouseCache(ttl=60, maxsize=10, timer=lambda: self.now)
+
+    def test_normalize_company_name(self):
+        self.assertEqual(normalize_company_name("  Fielder \tLtd "), "fielder ltd")
+
+    def test_get_company_data(self):
+        for _ in range(2):
+            company_data = get_company_data(
+                "API_KEY", "01234567", db=self.db, cache=self.cache
+            )
+            self.assertEqual(company_data["company_name"], EXPECTED["company_name"])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.cache.hit_rate, 0.5)
+
+    def test_revalidate(self):
+        get_company_data("API_KEY", "01234567", db=self.db, cache=self.cache)
+        self.now = 61
+        company_data = get_company_data(
+            "API_KEY", "01234567", db=self.db, cache=self.cache
+        )
+        self.assertEqual(company_data["directors"], EXPECTED["directors"])
+        revalidations = self.server.requests[3:]
+        self.assertEqual(len(revalidations), 3)
+        for method, path, headers, body in revalidations:
+            self.assertEqual(headers["If-None-Match"], f'"{path}"')
+        self.assertEqual(self.cache.revalidated, 3)
+        # fresh again after the 304s
+        get_company_data("API_KEY", "01234567", db=self.db, cache=self.cache)
+        self.assertEqual(len(self.server.requests), 6)
+
+    def test_not_found_not_cached(self):
+        for _ in range(2):
+            get_company_data("API_KEY", "404", db=self.db, cache=self.cache)
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_search(self):
+        for name in ("Fielder Ltd", "  FIELDER   ltd"):
+            self.assertEqual(
+                get_company_number("API_KEY", name, cache=self.cache), "01234567"
+            )
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_maxsize(self):
+        for number in range(12):
+            get_company_data(
+                "API_KEY",
+                "01234567",
+                sic_codes=False,
+                directors=False,
+                filing_history=False,
+                cache=self.cache,
+            )
+            get_company_number("API_KEY", f"company {number}", cache=self.cache)
+        self.assertEqual(len(self.cache), 10)
+        # the profile was used recently, it is not evicted
+        self.assertEqual(len(self.server.requests), 13)
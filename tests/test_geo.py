@@ -0,0 +1,267 @@
+import random
+from unittest import TestCase, mock
+
+import numpy as np
+from google.cloud.firestore import GeoPoint
+
+from fielder_backend_utils.geo import (
+    GEOHASH_ALPHABET,
+    GeoIndex,
+    decode_geohash,
+    distance_matrix,
+    encode_geohash,
+    geohash_query_bounds,
+    haversine,
+    haversine_distances,
+    nearest_neighbours,
+    query_within_radius,
+)
+
+LONDON = GeoPoint(51.5074, -0.1278)
+PARIS = {"lat": 48.8566, "lng": 2.3522}
+
+
+def random_points(rng, count):
+    # roughly the UK
+    return [(rng.uniform(49.9, 58.7), rng.uniform(-8.2, 1.8)) for _ in range(count)]
+
+
+class FakeSnapshot:
+    def __init__(self, path, data):
+        self.reference = mock.Mock(path=path)
+        self._data = data
+
+    def get(self, field):
+        return self._data.get(field)
+
+
+class FakeQuery:
+    def __init__(self, snapshots):
+        self.snapshots = snapshots
+        self.ranges = []
+
+    def order_by(self, field):
+        self.field = field
+        return self
+
+    def start_at(self, values):
+        self.start = values[0]
+        return self
+
+    def end_at(self, values):
+        self.ranges.append((self.start, values[0]))
+        return self
+
+    def stream(self):
+        start, end = self.ranges[-1]
+        return [s for s in self.snapshots if start <= s.get(self.field) <= end]
+
+
+class TestGeohash(TestCase):
+    def test_encode(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(encode_geohash(51.5074, -0.1278, 5), "gcpvj")
+
+    def test_encode_matches_bisection(self):
+        def bisection(lat, lng, precision):
+            ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+            bits = []
+            for i in range(5 * precision):
+                value = (lng, lat)[i % 2]
+                interval = ranges[i % 2]
+                mid = (interval[0] + interval[1]) / 2
+                bits.append(int(value >= mid))
+                interval[1 - bits[-1]] = mid
+            return "".join(
+                GEOHASH_ALPHABET[int("".join(map(str, bits[i : i + 5])), 2)]
+                for i in range(0, len(bits), 5)
+            )
+
+        rng = random.Random(6)
+        points = [(90, 180), (-90, -180), (0, 0), (45, 90)] + [
+            (rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(200)
+        ]
+        for precision in range(1, 13):
+            for lat, lng in points:
+                self.assertEqual(
+                    encode_geohash(lat, lng, precision), bisection(lat, lng, precision)
+                )
+
+    def test_decode(self):
+        rng = random.Random(0)
+        for _ in range(100):
+            lat, lng = rng.uniform(-90, 90), rng.uniform(-180, 180)
+            center_lat, center_lng, lat_error, lng_error = decode_geohash(
+                encode_geohash(lat, lng, 8)
+            )
+            self.assertLessEqual(abs(center_lat - lat), lat_error)
+            self.assertLessEqual(abs(center_lng - lng), lng_error)
+
+    def test_query_bounds_cover_circle(self):
+        rng = random.Random(1)
+        for radius in (50, 1000, 5000, 50000):
+            for center in random_points(rng, 20):
+                bounds = geohash_query_bounds(center, radius)
+                self.assertLessEqual(len(bounds), 9)
+                for point in random_points(rng, 200):
+                    # move the point within radius of center
+                    lat = center[0] + (point[0] - 54.3) * radius / 1e6
+                    lng = center[1] + (point[1] + 3.2) * radius / 1e6
+                    if haversine(center, (lat, lng)) > radius:
+                        continue
+                    geohash = encode_geohash(lat, lng)
+                    self.assertTrue(
+                        any(start <= geohash <= end for start, end in bounds)
+                    )
+
+    def test_query_within_radius(self):
+        rng = random.Random(2)
+        points = random_points(rng, 2000)
+        snapshots = [
+            FakeSnapshot(
+                f"locations/{i}",
+                {"coords": GeoPoint(*point), "geohash": encode_geohash(*point)},
+            )
+            for i, point in enumerate(points)
+        ]
+        query = FakeQuery(snapshots)
+        results = query_within_radius(query, LONDON, 50000)
+        expected = sorted(
+            (haversine(LONDON, point), f"locations/{i}")
+            for i, point in enumerate(points)
+            if haversine(LONDON, point) <= 50000
+        )
+        self.assertTrue(expected)
+        self.assertEqual(
+            [(distance, s.reference.path) for s, distance in results], expected
+        )
+        self.assertEqual(query.field, "geohash")
+
+
+class TestHaversine(TestCase):
+    def test_haversine(self):
+        self.assertAlmostEqual(haversine(LONDON, PARIS) / 1000, 343.56, places=1)
+        self.assertEqual(haversine(LONDON, LONDON), 0)
+
+    def test_vectorised(self):
+        points = random_points(random.Random(3), 100)
+        lats, lngs = zip(*points)
+        np.testing.assert_allclose(
+            haversine_distances(PARIS, lats, lngs),
+            [haversine(PARIS, point) for point in points],
+        )
+
+
+class TestGeoIndex(TestCase):
+    def setUp(self):
+        rng = random.Random(4)
+        self.points = random_points(rng, 5000)
+        self.keys = [f"location-{i}" for i in range(len(self.points))]
+        self.index = GeoIndex(self.points, self.keys, leaf_size=16)
+        lats, lngs = zip(*self.points)
+        self.lats, self.lngs = np.array(lats), np.array(lngs)
+        self.queries = random_points(rng, 50)
+
+    def test_within(self):
+        for query in self.queries:
+            distances = haversine_distances(query, self.lats, self.lngs)
+            (expected,) = np.nonzero(distances <= 20000)
+            results = self.index.within(query, 20000)
+            self.assertEqual(
+                sorted(key for key, _ in results),
+                sorted(self.keys[i] for i in expected),
+            )
+            result_distances = [distance for _, distance in results]
+            self.assertEqual(result_distances, sorted(result_distances))
+            for key, distance in results:
+                self.assertAlmostEqual(
+                    distance, distances[self.keys.index(key)], delta=1e-3
+                )
+
+    def test_nearest(self):
+        for query in self.queries:
+            distances = haversine_distances(query, self.lats, self.lngs)
+            expected = np.argsort(distances)[:7]
+            results = self.index.nearest(query, k=7)
+            self.assertEqual(
+                [key for key, _ in results], [self.keys[i] for i in expected]
+            )
+            np.testing.assert_allclose(
+                [distance for _, distance in results], distances[expected], atol=1e-3
+            )
+
+    def test_point_types_and_default_keys(self):
+        index = GeoIndex([LONDON, PARIS, (40.7128, -74.006)])
+        self.assertEqual(len(index), 3)
+        self.assertEqual([key for key, _ in index.nearest(PARIS, k=2)], [1, 0])
+        self.assertEqual(index.within((51.5, -0.12), 1000)[0][0], 0)
+        self.assertEqual(index.nearest(LONDON, k=10)[-1][0], 2)
+
+    def test_empty(self):
+        index = GeoIndex([])
+        self.assertEqual(index.within(LONDON, 1000), [])
+        self.assertEqual(index.nearest(LONDON), [])
+
+    def test_from_snapshots(self):
+        snapshots = [
+            FakeSnapshot("locations/a", {"coords": LONDON}),
+            FakeSnapshot("locations/b", {"coords": None}),
+            FakeSnapshot("locations/c", {"coords": GeoPoint(48.8566, 2.3522)}),
+        ]
+        index = GeoIndex.from_snapshots(snapshots)
+        self.assertEqual(len(index), 2)
+        self.assertIs(index.nearest(PARIS)[0][0], snapshots[2].reference)
+
+
+class TestDistanceMatrix(TestCase):
+    def setUp(self):
+        rng = random.Random(5)
+        self.workers = random_points(rng, 300)
+        self.locations = [GeoPoint(*point) for point in random_points(rng, 40)]
+        lats, lngs = zip(*[(p.latitude, p.longitude) for p in self.locations])
+        self.expected = np.array(
+            [haversine_distances(worker, lats, lngs) for worker in self.workers]
+        )
+
+    def test_distance_matrix(self):
+        matrix = distance_matrix(self.workers, self.locations)
+        self.assertEqual(matrix.shape, (300, 40))
+        self.assertEqual(matrix.dtype, np.float64)
+        np.testing.assert_allclose(matrix, self.expected, atol=0.01)
+        np.testing.assert_array_equal(
+            distance_matrix(np.array(self.workers), self.locations, chunk_size=7),
+            matrix,
+        )
+
+    def test_near_identical_points(self):
+        rng = np.random.default_rng(1)
+        points = np.column_stack(
+            [rng.uniform(-60, 60, 200), rng.uniform(-180, 180, 200)]
+        )
+        nearby = points + rng.normal(0, 1e-6, points.shape)
+        expected = [haversine(p, q) for p, q in zip(points, nearby)]
+        matrix = distance_matrix(points, nearby)
+        np.testing.assert_allclose(np.diagonal(matrix), expected, atol=0.2)
+
+    def test_float32(self):
+        matrix = distance_matrix(self.workers, self.locations, dtype=np.float32)
+        self.assertEqual(matrix.dtype, np.float32)
+        np.testing.assert_allclose(matrix, self.expected, rtol=1e-6)
+
+    def test_nearest_neighbours(self):
+        indices, distances = nearest_neighbours(
+            self.workers, self.locations, k=3, chunk_size=64
+        )
+        expected = np.argsort(self.expected, axis=1)[:, :3]
+        np.testing.assert_array_equal(indices, expected)
+        np.testing.assert_allclose(
+            distances, np.take_along_axis(self.expected, expected, axis=1), atol=0.01
+        )
+
+        indices, distances = nearest_neighbours(self.workers[:2], self.locations, k=100)
+        self.assertEqual(indices.shape, (2, 40))
+        np.testing.assert_array_equal(indices, np.argsort(self.expected[:2], axis=1))
+
+    def test_empty(self):
+        self.assertEqual(distance_matrix([], self.locations).shape, (0, 40))
+        self.assertEqual(distance_matrix(self.workers, []).shape, (300, 0))
@@ -0,0 +1,68 @@
+from unittest import TestCase
+
+from fielder_backend_utils import http_client
+
+from .mock_server import MockServer
+
+
+class TestHTTPClient(TestCase):
+    def setUp(self):
+        http_client.configure(backoff_factor=0)
+
+    def tearDown(self):
+        http_client.configure(
+            timeout=http_client.DEFAULT_TIMEOUT,
+            pool_maxsize=http_client.DEFAULT_POOL_MAXSIZE,
+            backoff_factor=http_client.DEFAULT_BACKOFF_FACTOR,
+        )
+
+    def test_session_per_host(self):
+        session = http_client.get_session("https://api.intercom.io/contacts")
+        self.assertIs(
+            session, http_client.get_session("https://api.intercom.io/companies")
+        )
+        self.assertIsNot(
+            session, http_client.get_session("https://api.clickup.com/api/v2")
+        )
+        adapter = session.get_adapter("https://api.intercom.io")
+        self.assertEqual(adapter.timeout, (5, 30))
+        self.assertEqual(adapter.max_retries.total, 3)
+
+    def test_retry_after_on_429(self):
+        calls = []
+
+        def handler(method, path, headers, body):
+            calls.append(path)
+            if len(calls) == 1:
+                return 429, {"Retry-After": "0"}, {"error": "rate limited"}
+            return 200, {}, {"ok": True, "body": body}
+
+        with MockServer(handler) as server:
+            response = http_client.post(server.url + "/messages", json={"a": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"ok": True, "body": {"a": 1}})
+        self.assertEqual(len(calls), 2)
+
+    def test_retry_on_5xx(self):
+        def handler(method, path, headers, body):
+            return 503, {}, {"error": "unavailable"}
+
+        with MockServer(handler) as server:
+            # idempotent methods are retried, final response is returned
+            response = http_client.get(server.url + "/users")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(len(server.requests), 4)
+
+            # POST may have been processed, it is not retried on 5xx
+            response = http_client.post(server.url + "/users", json={})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(len(server.requests), 5)
+
+    def test_configure_resets_sessions(self):
+        session = http_client.get_session("https://api.intercom.io")
+        http_client.configure(timeout=1, pool_maxsize=2)
+        new_session = http_client.get_session("https://api.intercom.io")
+        self.assertIsNot(session, new_session)
+        adapter = new_session.get_adapter("https://api.intercom.io")
+        self.assertEqual(adapter.timeout, 1)
+        self.assertEqual(adapter._pool_maxsize, 2)
@@ -0,0 +1,133 @@
+import threading
+from unittest import TestCase, mock
+
+from requests import HTTPError
+
+from fielder_backend_utils.intercom import SEARCH_MAX_FILTERS, IntercomClient
+
+from .mock_server import MockServer
+
+
+class IntercomStandIn:
+    """
+    Minimal Intercom contacts API, returning 2 search results per page
+    """
+
+    def __init__(self, existing):
+        self.contacts = {
+            external_id: {"id": f"c_{external_id}", "external_id": external_id}
+            for external_id in existing
+        }
+        self.companies = {}
+
+    def __call__(self, method, path, headers, body):
+        if path == "/contacts/search":
+            query = body["query"]
+            assert query["operator"] == "OR"
+            assert len(query["value"]) <= SEARCH_MAX_FILTERS
+            ids = [f["value"] for f in query["value"]]
+            found = [self.contacts[i] for i in ids if i in self.contacts]
+            start = int(body["pagination"].get("starting_after") or 0)
+            page = found[start : start + 2]
+            pages = {}
+            if start + 2 < len(found):
+                pages["next"] = {"starting_after": str(start + 2)}
+            return 200, {}, {"data": page, "pages": pages}
+        if path == "/contacts" and method == "POST":
+            if body["external_id"] == "broken":
+                return 400, {}, {"errors": [{"code": "parameter_invalid"}]}
+            contact = {"id": f"c_{body['external_id']}", **body}
+            self.contacts[body["external_id"]] = contact
+            return 200, {}, contact
+        if path.startswith("/contacts/") and path.endswith("/companies"):
+            contact_id = path.split("/")[2]
+            self.companies.setdefault(body["id"], []).append(contact_id)
+            return 200, {}, {"id": body["id"]}
+        if path.startswith("/contacts/") and method == "PUT":
+            return 200, {}, {"id": path.split("/")[2], **body}
+        return 404, {}, {}
+
+
+class TestIntercom(TestCase):
+    def test_sync_users(self):
+        existing = [f"w{i}" for i in range(0, 40, 2)]
+        users = {f"w{i}": {"name": f"Worker {i}"} for i in range(40)}
+        users["broken"] = {"name": "Broken"}
+        stand_in = IntercomStandIn(existing)
+
+        with MockServer(stand_in) as server:
+            client = IntercomClient("TOKEN")
+            client.base_url = server.url
+            report = client.sync_users(users, intercom_company_id="company_1")
+
+        self.assertEqual(len(report.results), 41)
+        for i in range(40):
+            result = report.results[f"w{i}"]
+            self.assertIsNone(result.error)
+            self.assertEqual(result.intercom_user_id, f"c_w{i}")
+            self.assertEqual(result.created, i % 2 == 1)
+            self.assertEqual(result.updated, i % 2 == 0)
+            self.assertTrue(result.added_to_company)
+        self.assertEqual([r.external_user_id for r in report.failed], ["broken"])
+        self.assertEqual(len(stand_in.companies["company_1"]), 40)
+
+        # 3 search chunks, 4 + 4 + 3 pages, 21 creates, 20 updates, 40 attachments
+        search_calls = sum(1 for r in server.requests if r[1] == "/contacts/search")
+        self.assertEqual(search_calls, 11)
+        self.assertEqual(report.api_calls, len(server.requests))
+        self.assertEqual(report.api_calls, 11 + 21 + 20 + 40)
+        # sequentially: 41 searches, 21 creates, 41 updates, 41 attachments
+        self.assertEqual(report.sequential_api_calls, 41 + 21 + 41 + 41)
+        self.assertEqual(report.api_calls_saved, 144 - 92)
+
+    def test_search_users(self):
+        with MockServer(IntercomStandIn(["a", "b", "c"])) as server:
+            client = IntercomClient("TOKEN")
+            client.base_url = server.url
+            contacts = client.search_users(["a", "b", "c", "d", "a"])
+        self.assertEqual(sorted(contacts), ["a", "b", "c"])
+        self.assertEqual(contacts["b"]["id"], "c_b")
+        self.assertEqual(len(server.requests), 2)
+
+    def test_unexpected_search_status(self):
+        stand_in = IntercomStandIn([])
+
+        def handler(method, path, headers, body):
+            if path == "/contacts/search":
+                return 202, {}, {}
+            return stand_in(method, path, headers, body)
+
+        with MockServer(handler) as server:
+            client = IntercomClient("TOKEN")
+            client.base_url = server.url
+            with self.assertRaises(HTTPError):
+                client.search_users(["a"])
+            report = client.sync_users({"a": {"name": "A"}})
+        # an unusable search must not be mistaken for "no such user"
+        self.assertIsInstance(report.results["a"].error, HTTPError)
+        self.assertEqual(stand_in.contacts, {})
+
+    def test_upserts_pipelined_with_searches(self):
+        client = IntercomClient("TOKEN")
+        users = {f"w{i}": {} for i in range(2 * SEARCH_MAX_FILTERS)}
+        last_chunk = list(users)[SEARCH_MAX_FILTERS:]
+        created = threading.Event()
+        created_during_search = []
+
+        def search_chunk(chunk):
+            if chunk == last_chunk:
+                created_during_search.append(created.wait(5))
+            return {}, 1
+
+        def create_user(external_user_id, **attributes):
+            created.set()
+            return {"id": f"c_{external_user_id}"}
+
+        with mock.patch.object(
+            client, "_search_users_chunk", search_chunk
+        ), mock.patch.object(client, "create_user", create_user):
+            report = client.sync_users(users)
+        # the first chunk's users are created while the last chunk is searched
+        self.assertEqual(created_during_search, [True])
+        self.assertEqual(report.failed, [])
+        self.assertTrue(all(r.created for r in report.results.values()))
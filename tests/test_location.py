@@ -1,6 +1,10 @@
+import copy
+import random
+import types
 from unittest import TestCase, mock
 
 import django
+import requests
 from django.conf import settings
 
 if not settings.configured:
@@ -160,6 +164,7 @@ class TestLocation(TestCase):
                 "country": "country",
             },
             "coords": GeoPoint("1", "2"),
+            "geohash": "s01mtw037m",
             "organisation_ref": None,
             "archived": False,
             "is_live": True,
@@ -193,6 +198,7 @@ class TestLocation(TestCase):
                 "postal_code": "postal_code",
             },
             "coords": GeoPoint("1", "2"),
+            "geohash": "s01mtw037m",
             "organisation_ref": None,
             "archived": False,
             "is_live": True,
@@ -203,7 +209,9 @@ class TestLocation(TestCase):
         location_data = generate_location(initial_location, None)
         self.assertDictEqual(location_data, expected_location)
 
-    @mock.patch("requests.get", side_effect=mocked_requests_get)
+    @mock.patch(
+        "fielder_backend_utils.http_client.get", side_effect=mocked_requests_get
+    )
     def test_google_location_api(self, mock_get):
 
         expected_location = {
@@ -223,7 +231,9 @@ class TestLocation(TestCase):
             google_place_details("GOOGLE_PLACE_ID", "API_SECRET"), expected_location
         )
 
-    @mock.patch("requests.get", side_effect=mocked_requests_get)
+    @mock.patch(
+        "fielder_backend_utils.http_client.get", side_effect=mocked_requests_get
+    )
     def test_geocode_api(self, mock_get):
         expected_coorsd = {"lat": 37.4224764, "lng": -122.0842499}
 
@@ -233,3 +243,167 @@ class TestLocation(TestCase):
             ),
             expected_coorsd,
         )
+
+    @mock.patch(
+        "fielder_backend_utils.http_client.get", side_effect=mocked_requests_get
+    )
+    def test_geocode_many(self, mock_get):
+        address = "1600 Amphitheatre Parkway, Mountain View, CA 94043, USA"
+        addresses = [address, address, address.lower(), "nowhere"]
+        results = {
+            result.address: result
+            for result in geocode_many(addresses, "API_SECRET", max_workers=4)
+        }
+        # the same address is only geocoded once
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(list(sorted(results)), sorted(set(addresses)))
+        for key in (address, address.lower()):
+            self.assertEqual(results[key].status, "OK")
+            self.assertEqual(
+                results[key].coords, {"lat": 37.4224764, "lng": -122.0842499}
+            )
+        self.assertFalse(results["nowhere"].ok)
+        self.assertEqual(results["nowhere"].status, "HTTP_404")
+
+    def test_geocode_many_errors(self):
+        def get(*args, **kwargs):
+            address = kwargs["params"]["address"]
+            if address == "timeout":
+                raise requests.exceptions.Timeout("timed out")
+            if address in ("not json", "no geometry"):
+                response = mock.Mock(ok=True, status_code=200, url=args[0])
+                if address == "not json":
+                    response.json.side_effect = ValueError("Expecting value")
+                else:
+                    response.json.return_value = {"status": "OK", "results": [{}]}
+                return response
+            return mocked_requests_get(*args, **kwargs)
+
+        with mock.patch("fielder_backend_utils.http_client.get", side_effect=get):
+            results = {
+                result.address: result
+                for result in geocode_many(
+                    [
+                        "timeout",
+                        "not json",
+                        "no geometry",
+                        "1600 Amphitheatre Parkway, Mountain View, CA 94043, USA",
+                    ],
+                    "API_SECRET",
+                )
+            }
+        self.assertEqual(results["timeout"].status, "ERROR")
+        self.assertIsInstance(results["timeout"].error, requests.exceptions.Timeout)
+        self.assertEqual(results["not json"].status, "INVALID_RESPONSE")
+        self.assertIsInstance(results["not json"].error, ValueError)
+        self.assertEqual(results["no geometry"].status, "INVALID_RESPONSE")
+        self.assertIsInstance(results["no geometry"].error, KeyError)
+        self.assertTrue(
+            results["1600 Amphitheatre Parkway, Mountain View, CA 94043, USA"].ok
+        )
+
+    def test_parse_address_components(self):
+        def old_parse(info):
+            building = [
+                _["long_name"]
+                for _ in info
+                if "street_number" in _["types"] or "premise" in _["types"]
+            ]
+            street = [_["long_name"] for _ in info if "route" in _["types"]]
+            city = [_["long_name"] for _ in info if "postal_town" in _["types"]]
+            administrative_areas_names = [
+                _["long_name"]
+                for _ in info
+                if "administrative_area_level_2" in _["types"]
+            ] + [
+                _["long_name"]
+                for _ in info
+                if "administrative_area_level_1" in _["types"]
+            ]
+            country = [_["long_name"] for _ in info if "country" in _["types"]]
+            postal_code = [_["long_name"] for _ in info if "postal_code" in _["types"]]
+            return {
+                "building": building[0] if building else None,
+                "street": street[0] if street else None,
+                "city": city[0] if city else None,
+                "county": ", ".join(administrative_areas_names)
+                if administrative_areas_names
+                else None,
+                "country": country[0] if country else None,
+                "postal_code": postal_code[0] if postal_code else None,
+            }
+
+        types = [
+            "street_number",
+            "premise",
+            "route",
+            "locality",
+            "postal_town",
+            "administrative_area_level_1",
+            "administrative_area_level_2",
+            "country",
+            "postal_code",
+            "political",
+        ]
+        rng = random.Random(0)
+        results = [
+            google_palce_api_response["result"],
+            geocode_api_response["results"][0],
+            {"address_components": []},
+        ] + [
+            {
+                "address_components": [
+                    {"long_name": str(i), "types": rng.sample(types, rng.randint(0, 3))}
+                    for i in range(rng.randint(0, 10))
+                ]
+            }
+            for _ in range(500)
+        ]
+        expected = [old_parse(result["address_components"]) for result in results]
+        self.assertEqual(parse_address_components_many(results), expected)
+        for result, address in zip(results, expected):
+            self.assertEqual(
+                list(parse_address_components(result["address_components"]).items()),
+                list(address.items()),
+            )
+
+    def test_generate_locations(self):
+        records = [
+            {
+                "address": {
+                    "building": f"{i}",
+                    "street": "street" if i % 2 else None,
+                    "city": "city",
+                    "county": None,
+                    "country": "country",
+                    "postal_code": "postal_code",
+                },
+                "coords": {"lat": 51.5 + i / 100, "lng": -0.1},
+                "formatted_address": "formatted_address",
+            }
+            for i in range(10)
+        ]
+        records.append(
+            {
+                "name": "name",
+                "address": dict.fromkeys(records[0]["address"]),
+                "coords": GeoPoint(51.5, -0.1),
+                "formatted_address": "formatted_address",
+            }
+        )
+        originals = copy.deepcopy(records)
+        locations = generate_locations(records, "organisation_ref")
+        self.assertIsInstance(locations, types.GeneratorType)
+        locations = list(locations)
+
+        self.assertEqual(records, originals)
+        self.assertEqual(
+            locations,
+            [generate_location(record, "organisation_ref") for record in originals],
+        )
+        self.assertEqual(locations[1]["short_name"], "1 street")
+        self.assertEqual(
+            locations[1]["formatted_address"], "1, street, city, postal_code, country"
+        )
+        self.assertEqual(locations[-1]["formatted_address"], "formatted_address")
+        self.assertEqual(locations[-1]["coords"], GeoPoint(51.5, -0.1))
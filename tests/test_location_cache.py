@@ -0,0 +1,154 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+    django.setup()
+
+from fielder_backend_utils.location import GEOCODE_BOUNDS, geocode
+from fielder_backend_utils.location_cache import (
+    LocationCache,
+    SQLiteLocationStore,
+    geocode_key,
+    normalize_address,
+    place_details_key,
+)
+
+from .test_location import mocked_requests_get
+
+
+class TestLocationCache(TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def fetch(self, value={"lat": 1, "lng": 2}):
+        def func():
+            self.calls += 1
+            return value
+
+        return func
+
+    def test_keys(self):
+        self.assertEqual(
+            normalize_address("  50 Kensington  Ct,London ,, W8 5DB, UK "),
+            "50 kensington ct, london, w8 5db, uk",
+        )
+        self.assertEqual(
+            geocode_key("50 Kensington Ct, LONDON", "bounds"),
+            geocode_key("50  kensington ct ,london", "bounds"),
+        )
+        self.assertNotEqual(geocode_key("a", "bounds"), geocode_key("a"))
+        self.assertEqual(place_details_key("PLACE_ID"), "place:PLACE_ID")
+
+    def test_hit_and_miss(self):
+        cache = LocationCache()
+        self.assertEqual(cache.get_or_fetch("a", self.fetch()), {"lat": 1, "lng": 2})
+        self.assertEqual(cache.get_or_fetch("a", self.fetch()), {"lat": 1, "lng": 2})
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_none_not_cached(self):
+        cache = LocationCache()
+        cache.get_or_fetch("a", self.fetch(None))
+        cache.get_or_fetch("a", self.fetch(None))
+        self.assertEqual(self.calls, 2)
+
+    def test_returns_copies(self):
+        cache = LocationCache()
+        cache.get_or_fetch("a", self.fetch({"coords": {"lat": 1}}))["coords"] = None
+        cache.get_or_fetch("a", self.fetch())["coords"]["lat"] = None
+        self.assertEqual(cache.get_or_fetch("a", self.fetch()), {"coords": {"lat": 1}})
+
+    def test_sqlite_store(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite3")
+            LocationCache(store=SQLiteLocationStore(path)).get_or_fetch(
+                "a", self.fetch()
+            )
+            cache = LocationCache(store=SQLiteLocationStore(path))
+            self.assertEqual(
+                cache.get_or_fetch("a", self.fetch()), {"lat": 1, "lng": 2}
+            )
+            self.assertEqual(self.calls, 1)
+            self.assertEqual(cache.store_hits, 1)
+
+            # expired in the store
+            cache.store.set("b", {"lat": 0}, time.time() - 100)
+            cache = LocationCache(ttl=10, store=cache.store)
+            self.assertEqual(
+                cache.get_or_fetch("b", self.fetch()), {"lat": 1, "lng": 2}
+            )
+            self.assertEqual(self.calls, 2)
+
+            cache.invalidate("b")
+            self.assertIsNone(cache.store.get("b"))
+
+    def test_single_flight(self):
+        cache = LocationCache()
+        release = threading.Event()
+        results = []
+
+        def fetch():
+            self.calls += 1
+            release.wait(5)
+            return {"lat": 1}
+
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(cache.get_or_fetch("a", fetch))
+            )
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        while cache.coalesced < 9:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{"lat": 1}] * 10)
+
+    def test_single_flight_error(self):
+        cache = LocationCache()
+        release = threading.Event()
+        errors = []
+
+        def fetch():
+            release.wait(5)
+            raise ValueError("upstream error")
+
+        def run():
+            try:
+                cache.get_or_fetch("a", fetch)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while cache.coalesced < 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+
+    @mock.patch(
+        "fielder_backend_utils.http_client.get", side_effect=mocked_requests_get
+    )
+    def test_geocode(self, mock_get):
+        cache = LocationCache()
+        address = "1600 Amphitheatre Parkway, Mountain View, CA 94043, USA"
+        expected = {"lat": 37.4224764, "lng": -122.0842499}
+        self.assertEqual(geocode(address, "API_SECRET", cache=cache), expected)
+        self.assertEqual(geocode(address.upper(), "API_SECRET", cache=cache), expected)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIn(geocode_key(address, GEOCODE_BOUNDS), cache._cache)
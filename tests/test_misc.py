@@ -0,0 +1,221 @@
+import random
+import string
+from hashlib import sha256
+from itertools import islice
+from unittest import TestCase
+
+from google.api_core.exceptions import AlreadyExists
+
+from fielder_backend_utils.misc import (
+    ALPHABET,
+    allocate_ids,
+    baseNDecode,
+    baseNDecodeMany,
+    baseNEncode,
+    baseNEncodeMany,
+    make_id,
+    make_ids,
+)
+
+
+def old_baseNEncode(number, *, base=36):
+    letters = ALPHABET[0:base]
+    if not isinstance(number, int):
+        raise TypeError("number must be an integer")
+    base36 = ""
+    if number < 0:
+        raise ValueError("number cannot be less than 0")
+    if 0 <= number < base:
+        return letters[number]
+    while number != 0:
+        number, i = divmod(number, len(letters))
+        base36 = letters[i] + base36
+    return base36
+
+
+def old_make_id(str_val, length, attempts_before_fallback=None):
+    attempts_before_fallback = attempts_before_fallback or length * 3
+    input_bytes = bytearray(str_val, "utf-8")
+    random.seed(str_val)
+    try_count = 0
+    while True:
+        if try_count < attempts_before_fallback:
+            try_count += 1
+        else:
+            yield "".join(random.choice(ALPHABET) for i in range(length))
+        h = sha256()
+        h.update(input_bytes)
+        hash_bytes_as_int = int.from_bytes(h.digest(), "big", signed=False)
+        yield baseNEncode(hash_bytes_as_int, base=36)[:length]
+        input_bytes = h.digest()
+
+
+class TestBaseN(TestCase):
+    def numbers(self, base):
+        rng = random.Random(base)
+        edges = [0, 1, base - 1, base, base + 1]
+        for k in (2, 3, 12, 13, 24, 100, 101):
+            edges += [base**k - 1, base**k, base**k + 1]
+        return edges + [rng.getrandbits(bits) for bits in range(1, 1200, 5)]
+
+    def test_same_output_as_before(self):
+        for base in range(2, 37):
+            for number in self.numbers(base):
+                self.assertEqual(
+                    baseNEncode(number, base=base),
+                    old_baseNEncode(number, base=base),
+                    (number, base),
+                )
+
+    def test_bulk(self):
+        for base in (2, 10, 16, 36):
+            numbers = self.numbers(base)
+            encoded = baseNEncodeMany(numbers, base=base)
+            self.assertEqual(
+                encoded, [old_baseNEncode(number, base=base) for number in numbers]
+            )
+            self.assertEqual(baseNDecodeMany(encoded, base=base), numbers)
+            self.assertEqual(
+                [baseNDecode(value, base=base) for value in encoded], numbers
+            )
+
+    def test_errors(self):
+        for encode in (baseNEncode, lambda n: baseNEncodeMany([n])):
+            with self.assertRaises(TypeError):
+                encode(1.0)
+            with self.assertRaises(ValueError):
+                encode(-1)
+        with self.assertRaises(ValueError):
+            baseNEncode(100, base=37)
+
+
+class TestMakeId(TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.values = [
+            "".join(rng.choices(string.printable + "éß✓", k=rng.randint(0, 30)))
+            for _ in range(200)
+        ]
+
+    def test_same_ids_as_before(self):
+        for value in self.values:
+            for length in (1, 6, 10, 49, 50, 60):
+                self.assertEqual(
+                    list(islice(make_id(value, length), 3 * length + 10)),
+                    list(islice(old_make_id(value, length), 3 * length + 10)),
+                )
+
+    def test_attempts_before_fallback(self):
+        self.assertEqual(
+            list(islice(make_id("shift", 8, 2), 10)),
+            list(islice(old_make_id("shift", 8, 2), 10)),
+        )
+
+    def test_does_not_reseed_random_module(self):
+        random.seed(1)
+        expected = random.random()
+        random.seed(1)
+        list(islice(make_id("shift", 4, 1), 10))
+        self.assertEqual(random.random(), expected)
+
+    def test_make_ids(self):
+        self.assertEqual(
+            make_ids(self.values, 8),
+            [next(old_make_id(value, 8)) for value in self.values],
+        )
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeRef:
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+
+class FakeCollection:
+    def document(self, doc_id):
+        return FakeRef(doc_id)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self._write_pbs = []
+
+    def create(self, ref, data):
+        self._write_pbs.append((ref.id, data))
+
+    def commit(self):
+        self.db.before_commit()
+        if any(doc_id in self.db.docs for doc_id, _ in self._write_pbs):
+            raise AlreadyExists("document already exists")
+        self.db.docs.update(self._write_pbs)
+        self.db.commits += 1
+
+
+class FakeFirestore:
+    def __init__(self, docs=None):
+        self.docs = dict(docs or {})
+        self.get_all_calls = 0
+        self.commits = 0
+
+    def collection(self, name):
+        return FakeCollection()
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def before_commit(self):
+        pass
+
+    def get_all(self, refs, field_paths=None):
+        self.get_all_calls += 1
+        return [FakeSnapshot(ref.id, self.docs.get(ref.id)) for ref in refs]
+
+
+class TestAllocateIds(TestCase):
+    def test_allocates_unique_ids(self):
+        values = [f"shift-{i}" for i in range(10000)]
+        db = FakeFirestore()
+        ids = allocate_ids(db, "codes", values, 3)
+        self.assertEqual(list(ids), values)
+        self.assertEqual(len(set(ids.values())), len(values))
+        self.assertEqual(db.docs, {i: {"value": v} for v, i in ids.items()})
+        # 30k candidates in chunks of 1000, plus the values that collided
+        self.assertLessEqual(db.get_all_calls, 32)
+
+    def test_skips_taken_ids(self):
+        first, second, third = islice(make_id("a", 6), 3)
+        db = FakeFirestore({first: {"value": "other"}, second: {}})
+        self.assertEqual(allocate_ids(db, "codes", ["a"], 6), {"a": third})
+
+    def test_resolves_collisions_in_memory(self):
+        values = [str(i) for i in range(20)]
+        ids = allocate_ids(FakeFirestore(), "codes", values, 1, max_rounds=100)
+        self.assertEqual(len(set(ids.values())), 20)
+
+    def test_idempotent(self):
+        db = FakeFirestore({next(make_id("a", 6)): {"value": "other"}})
+        ids = allocate_ids(db, "codes", ["a", "b"], 6)
+        commits = db.commits
+        self.assertEqual(allocate_ids(db, "codes", ["b", "a"], 6), ids)
+        self.assertEqual(db.commits, commits)
+
+    def test_retries_on_conflict(self):
+        db = FakeFirestore()
+        first, second = islice(make_id("a", 6), 2)
+
+        def before_commit():
+            db.before_commit = lambda: None
+            db.docs[first] = {"value": "other"}
+
+        db.before_commit = before_commit
+        self.assertEqual(allocate_ids(db, "codes", ["a"], 6), {"a": second})
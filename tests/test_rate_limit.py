@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase, mock
+
+from fielder_backend_utils import http_client
+from fielder_backend_utils.intercom import IntercomClient
+from fielder_backend_utils.rate_limit import RateLimiter, get_rate_limiter
+
+from .mock_server import MockServer
+
+
+class TestRateLimiter(TestCase):
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=100, capacity=5)
+        start = time.monotonic()
+        waits = [limiter.acquire() for _ in range(15)]
+        elapsed = time.monotonic() - start
+        # burst of 5, then 10 more at 100/s
+        self.assertEqual(waits[:5], [0] * 5)
+        self.assertGreaterEqual(elapsed, 0.09)
+        self.assertLess(elapsed, 0.5)
+
+    def test_shared_across_threads(self):
+        limiter = RateLimiter(rate=200, capacity=1, max_concurrency=2)
+        in_flight = 0
+        max_in_flight = 0
+        lock = threading.Lock()
+
+        def work():
+            nonlocal in_flight, max_in_flight
+            for _ in range(10):
+                with limiter.limit():
+                    with lock:
+                        in_flight += 1
+                        max_in_flight = max(max_in_flight, in_flight)
+                    time.sleep(0.001)
+                    with lock:
+                        in_flight -= 1
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # 40 requests at 200/s
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+        self.assertLessEqual(max_in_flight, 2)
+
+    def test_limit_async(self):
+        limiter = RateLimiter(rate=1000, max_concurrency=2)
+        in_flight = 0
+        max_in_flight = 0
+
+        async def work():
+            nonlocal in_flight, max_in_flight
+            async with limiter.limit_async():
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        async def main():
+            await asyncio.gather(*(work() for _ in range(6)))
+
+        asyncio.run(main())
+        self.assertEqual(max_in_flight, 2)
+        # every slot was released
+        with limiter.limit(), limiter.limit():
+            pass
+
+    def test_update_from_headers(self):
+        limiter = RateLimiter(rate=50)
+        now = time.time()
+        limiter.update(
+            200,
+            {
+                "X-RateLimit-Limit": "166",
+                "X-RateLimit-Remaining": "20",
+                "X-RateLimit-Reset": str(int(now + 10)),
+            },
+        )
+        self.assertAlmostEqual(limiter.rate, 2, delta=0.3)
+        self.assertLessEqual(limiter.tokens, 20)
+
+        # CometChat headers, reset as a delay
+        limiter.update(200, {"X-Rate-Limit-Remaining": "0", "X-Rate-Limit-Reset": "5"})
+        self.assertEqual(limiter.rate, limiter.min_rate)
+
+        # never faster than the configured rate
+        limiter = RateLimiter(rate=50)
+        limiter.update(
+            200, {"X-RateLimit-Remaining": "10000", "X-RateLimit-Reset": "10"}
+        )
+        self.assertEqual(limiter.rate, 50)
+
+        limiter = RateLimiter(rate=50)
+        limiter.update(429, {"Retry-After": "0.2"})
+        self.assertEqual(limiter.throttled, 1)
+        self.assertGreaterEqual(limiter.acquire(), 0.15)
+
+    def test_get_rate_limiter(self):
+        limiter = get_rate_limiter("test:api.intercom.io", rate=10)
+        self.assertIs(limiter, get_rate_limiter("test:api.intercom.io", rate=20))
+        self.assertEqual(limiter.rate, 10)
+        self.assertIsNot(limiter, get_rate_limiter("test:api.clickup.com", rate=10))
+
+    def test_client_integration(self):
+        remaining = iter(range(100, 0, -1))
+
+        def handler(method, path, headers, body):
+            return (
+                200,
+                {
+                    "X-RateLimit-Remaining": str(next(remaining)),
+                    "X-RateLimit-Reset": str(int(time.time()) + 60),
+                },
+                {"type": "company", "id": path.split("/")[-1]},
+            )
+
+        limiter = RateLimiter(rate=1000)
+        client = IntercomClient("TOKEN", rate_limiter=limiter)
+        with MockServer(handler) as server:
+            client.base_url = server.url
+            self.assertEqual(client.get_company("org_1")["id"], "org_1")
+            self.assertEqual(client.get_company("org_2")["id"], "org_2")
+        # 99 requests left for the next ~60 seconds
+        self.assertLess(limiter.rate, 2)
+        self.assertLessEqual(limiter.tokens, 99)
+
+    def test_429_seen_by_limiter(self):
+        calls = []
+
+        def handler(method, path, headers, body):
+            calls.append(path)
+            if len(calls) == 1:
+                return 429, {"Retry-After": "0.2"}, {"error": "rate limited"}
+            return 200, {}, {"ok": True}
+
+        limiter = RateLimiter(rate=1000)
+        http_client.configure(backoff_factor=0)
+        self.addCleanup(
+            http_client.configure, backoff_factor=http_client.DEFAULT_BACKOFF_FACTOR
+        )
+        with MockServer(handler) as server:
+            start = time.monotonic()
+            response = http_client.post(
+                server.url + "/messages", json={}, rate_limiter=limiter
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(limiter.throttled, 1)
+        # the retry waited for Retry-After in the limiter
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
@@ -1,3 +1,4 @@
+from unittest import mock
 from unittest.case import TestCase
 
 import django
@@ -7,7 +8,13 @@ if not settings.configured:
     settings.configure()
     django.setup()
 
-from fielder_backend_utils.rest_utils import GeoPointField
+from fielder_backend_utils.rest_utils import (
+    DocumentReferenceField,
+    DocumentReferenceListField,
+    GeoPointField,
+    PrefetchDocumentReferencesListSerializer,
+    PrefetchDocumentReferencesMixin,
+)
 from google.cloud.firestore import GeoPoint
 from rest_framework import serializers
 
@@ -17,6 +24,12 @@ class GeoPointTestSerializer(serializers.Serializer):
     point = GeoPointField()
 
 
+class PrefetchTestSerializer(PrefetchDocumentReferencesMixin, serializers.Serializer):
+    location = DocumentReferenceField(prefetch=True)
+    workers = DocumentReferenceListField(prefetch=True)
+    other = DocumentReferenceField(required=False)
+
+
 class TestShift(TestCase):
     def test_geopoint_field(self):
 
@@ -31,3 +44,88 @@ class TestShift(TestCase):
         serializer.is_valid(raise_exception=True)
         # we assert against serializer.validated_data to get the internal data
         self.assertDictEqual(data2, serializer.validated_data)
+
+    @mock.patch("fielder_backend_utils.rest_utils.FirebaseHelper")
+    def test_prefetch_document_references(self, FirebaseHelperMock):
+        db = mock.Mock()
+        db.document.side_effect = lambda path: mock.Mock(path=path)
+        existing = {"workers/1", "workers/2", "locations/1"}
+        db.get_all.side_effect = lambda refs: [
+            mock.Mock(reference=ref, exists=ref.path in existing) for ref in refs
+        ]
+        FirebaseHelperMock.getInstance.return_value.db = db
+
+        serializer = PrefetchTestSerializer(
+            data={
+                "location": "locations/1",
+                "workers": ["workers/1", "workers/2", "workers/1"],
+                "other": "workers/3",
+            }
+        )
+        serializer.is_valid(raise_exception=True)
+        # a single round-trip for all unique prefetched references
+        db.get_all.assert_called_once()
+        self.assertEqual(len(db.get_all.call_args[0][0]), 3)
+        snapshots = serializer.prefetched_snapshots
+        self.assertEqual(set(snapshots), existing)
+        # validated_data only holds the serializer's fields
+        self.assertEqual(
+            set(serializer.validated_data), {"location", "workers", "other"}
+        )
+        self.assertEqual(snapshots["workers/2"].reference.path, "workers/2")
+
+        db.get_all.reset_mock()
+        serializer = PrefetchTestSerializer(
+            data={"location": "locations/2", "workers": ["workers/1", "workers/4"]}
+        )
+        self.assertFalse(serializer.is_valid())
+        db.get_all.assert_called_once()
+        self.assertEqual(
+            serializer.errors["location"], ["Document locations/2 does not exist."]
+        )
+        self.assertEqual(
+            serializer.errors["workers"], ["Document workers/4 does not exist."]
+        )
+
+        # no prefetched references, nothing is fetched
+        db.get_all.reset_mock()
+        serializer = PrefetchTestSerializer(data={"workers": []}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        db.get_all.assert_not_called()
+        self.assertEqual(serializer.validated_data, {"workers": []})
+        self.assertEqual(serializer.prefetched_snapshots, {})
+
+    @mock.patch("fielder_backend_utils.rest_utils.FirebaseHelper")
+    def test_prefetch_document_references_many(self, FirebaseHelperMock):
+        db = mock.Mock()
+        db.document.side_effect = lambda path: mock.Mock(path=path)
+        existing = {"workers/1", "workers/2", "locations/1", "locations/2"}
+        db.get_all.side_effect = lambda refs: [
+            mock.Mock(reference=ref, exists=ref.path in existing) for ref in refs
+        ]
+        FirebaseHelperMock.getInstance.return_value.db = db
+
+        data = [
+            {"location": f"locations/{i % 2 + 1}", "workers": [f"workers/{i % 2 + 1}"]}
+            for i in range(5)
+        ]
+        serializer = PrefetchTestSerializer(data=data, many=True)
+        self.assertIsInstance(serializer, PrefetchDocumentReferencesListSerializer)
+        serializer.is_valid(raise_exception=True)
+        # one round-trip for the unique references of every item
+        db.get_all.assert_called_once()
+        self.assertEqual(len(db.get_all.call_args[0][0]), 4)
+        self.assertEqual(set(serializer.prefetched_snapshots), existing)
+        self.assertIs(
+            serializer.prefetched_snapshots, serializer.child.prefetched_snapshots
+        )
+
+        db.get_all.reset_mock()
+        data[3] = {"location": "locations/3", "workers": ["workers/1"]}
+        serializer = PrefetchTestSerializer(data=data, many=True)
+        self.assertFalse(serializer.is_valid())
+        db.get_all.assert_called_once()
+        self.assertEqual(
+            serializer.errors,
+            [{}, {}, {}, {"location": ["Document locations/3 does not exist."]}, {}],
+        )
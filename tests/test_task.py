@@ -0,0 +1,344 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from unittest import TestCase, mock, skipUnless
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+    django.setup()
+
+from google.api_core.exceptions import AlreadyExists, ServiceUnavailable
+
+from fielder_backend_utils import task
+from fielder_backend_utils.task import (
+    CoalescingScheduler,
+    HttpTaskSpec,
+    create_http_task,
+    create_http_tasks,
+    get_client,
+    merge_payloads,
+    task_name,
+)
+
+
+class CloudTasksTestMixin:
+    def setUp(self):
+        self.credentials = mock.Mock(service_account_email="tasks@example.com")
+        default = mock.patch.object(
+            task.google.auth,
+            "default",
+            return_value=(self.credentials, "project"),
+        )
+        client_class = mock.patch.object(task.tasks, "CloudTasksClient")
+        self.default = default.start()
+        self.client_class = client_class.start()
+        self.client = self.client_class.return_value
+        self.client.queue_path.side_effect = lambda *args: "/".join(args)
+        self.addCleanup(default.stop)
+        self.addCleanup(client_class.stop)
+        task.reset()
+        self.addCleanup(task.reset)
+
+
+class TestCreateHttpTask(CloudTasksTestMixin, TestCase):
+    def create(self, **kwargs):
+        return create_http_task(
+            "https://example.com/run", "queue", "europe-west2", "audience", **kwargs
+        )
+
+    def test_create_http_task(self):
+        scheduled_at = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        self.create(payload={"id": 1}, scheduled_at=scheduled_at)
+        request = self.client.create_task.call_args[1]["request"]
+        self.assertEqual(request["parent"], "project/europe-west2/queue")
+        http_request = request["task"]["http_request"]
+        self.assertEqual(http_request["http_method"], "POST")
+        self.assertEqual(json.loads(http_request["body"]), {"id": 1})
+        self.assertEqual(
+            http_request["oidc_token"],
+            {"service_account_email": "tasks@example.com", "audience": "audience"},
+        )
+        self.assertEqual(request["task"]["schedule_time"].seconds, 1640995200)
+
+    def test_shared_client(self):
+        threads = [threading.Thread(target=self.create) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.create()
+        self.default.assert_called_once()
+        self.client_class.assert_called_once_with(credentials=self.credentials)
+        self.assertEqual(self.client.create_task.call_count, 9)
+        self.assertIs(get_client(), self.client)
+
+    def test_default_service_account(self):
+        self.credentials.service_account_email = "default"
+        with self.settings_email("app@example.com"):
+            self.create()
+        request = self.client.create_task.call_args[1]["request"]
+        oidc_token = request["task"]["http_request"]["oidc_token"]
+        self.assertEqual(oidc_token["service_account_email"], "app@example.com")
+
+    def test_reset(self):
+        self.create()
+        task.reset()
+        self.create()
+        self.assertEqual(self.default.call_count, 2)
+        self.assertEqual(self.client_class.call_count, 2)
+
+    @skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_reset_after_fork(self):
+        self.create()
+        pid = os.fork()
+        if pid == 0:
+            # exit code tells the parent whether the child dropped the client
+            os._exit(0 if task._context is None else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        self.assertIsNotNone(task._context)
+
+    def test_named_task(self):
+        self.create(name="reminder-1")
+        request = self.client.create_task.call_args[1]["request"]
+        self.assertEqual(
+            request["task"]["name"], "project/europe-west2/queue/tasks/reminder-1"
+        )
+
+    def settings_email(self, email):
+        return mock.patch.object(settings, "SERVICE_ACCOUNT_EMAIL", email, create=True)
+
+
+class TestCreateHttpTasks(CloudTasksTestMixin, TestCase):
+    def create_many(self, specs, **kwargs):
+        return create_http_tasks(
+            specs, "queue", "europe-west2", "audience", max_workers=4, **kwargs
+        )
+
+    def test_create_http_tasks(self):
+        self.client.create_task.side_effect = lambda request: request["task"]
+        specs = [
+            HttpTaskSpec(f"https://example.com/{i}", payload={"i": i})
+            for i in range(20)
+        ]
+        results = self.create_many(specs)
+        self.assertEqual([r.spec for r in results], specs)
+        self.assertTrue(all(r.ok for r in results))
+        for i, result in enumerate(results):
+            self.assertEqual(
+                result.task["http_request"]["url"], f"https://example.com/{i}"
+            )
+            self.assertEqual(json.loads(result.task["http_request"]["body"]), {"i": i})
+            self.assertNotIn("name", result.task)
+        self.default.assert_called_once()
+        self.client.queue_path.assert_called_once()
+
+    def test_errors(self):
+        def create_task(request):
+            if request["task"]["http_request"]["url"].endswith("/1"):
+                raise ServiceUnavailable("unavailable")
+            return request["task"]
+
+        self.client.create_task.side_effect = create_task
+        with self.assertLogs(task.logger, "ERROR"):
+            results = self.create_many(
+                [HttpTaskSpec(f"https://example.com/{i}") for i in range(3)]
+            )
+        self.assertEqual([r.ok for r in results], [True, False, True])
+        self.assertIsInstance(results[1].error, ServiceUnavailable)
+        self.assertIsNone(results[1].task)
+
+    def test_deterministic_names(self):
+        created = set()
+
+        def create_task(request):
+            name = request["task"]["name"]
+            if name in created:
+                raise AlreadyExists(name)
+            created.add(name)
+            return request["task"]
+
+        self.client.create_task.side_effect = create_task
+        scheduled_at = datetime(2022, 1, 1, 9, tzinfo=timezone.utc)
+        specs = [
+            HttpTaskSpec("https://example.com/remind", {"shift": 1}, scheduled_at),
+            HttpTaskSpec("https://example.com/remind", {"shift": 2}, scheduled_at),
+            HttpTaskSpec("https://example.com/remind", name="custom"),
+        ]
+        first = self.create_many(specs, deterministic_names=True)
+        self.assertFalse(any(r.already_exists for r in first))
+        self.assertEqual(
+            first[0].task["name"],
+            "project/europe-west2/queue/tasks/"
+            + task_name("https://example.com/remind", {"shift": 1}, scheduled_at),
+        )
+        self.assertTrue(first[2].task["name"].endswith("/tasks/custom"))
+        self.assertEqual(len(created), 3)
+
+        retry = self.create_many(specs, deterministic_names=True)
+        self.assertTrue(all(r.ok and r.already_exists for r in retry))
+
+    def test_task_name(self):
+        name = task_name("https://example.com", {"a": 1, "b": 2})
+        self.assertRegex(name, r"^[0-9a-f]{64}$")
+        self.assertEqual(name, task_name("https://example.com", {"b": 2, "a": 1}))
+        self.assertNotEqual(name, task_name("https://example.com", {"a": 2, "b": 2}))
+        self.assertNotEqual(
+            name, task_name("https://example.com", {"a": 1, "b": 2}, http_method="PUT")
+        )
+
+
+class TestCoalescingScheduler(CloudTasksTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.created = {}
+
+        def create_task(request):
+            name = request["task"]["name"]
+            if name in self.created:
+                raise AlreadyExists(name)
+            self.created[name] = json.loads(request["task"]["http_request"]["body"])
+            return request["task"]
+
+        self.client.create_task.side_effect = create_task
+        self.now = 1000.0
+
+    def scheduler(self, **kwargs):
+        kwargs.setdefault("auto_flush", False)
+        kwargs.setdefault("timer", lambda: self.now)
+        return CoalescingScheduler("europe-west2", "audience", window=10, **kwargs)
+
+    def test_merge_payloads(self):
+        self.assertEqual(merge_payloads({"a": 1, "b": 1}, {"b": 2}), {"a": 1, "b": 2})
+        self.assertEqual(merge_payloads(None, {"a": 1}), {"a": 1})
+        self.assertEqual(merge_payloads({"a": 1}, None), {"a": 1})
+
+    def test_coalesce(self):
+        scheduler = self.scheduler()
+        for i in range(5):
+            scheduler.enqueue(
+                "https://example.com/notify", "queue", {"edit": i}, "interview-1"
+            )
+        scheduler.enqueue("https://example.com/notify", "queue", {"edit": 0}, "other")
+        self.assertEqual(scheduler.flush(), [])  # the window is not over
+
+        self.now += 10
+        results = scheduler.flush()
+        self.assertEqual(len(results), 2)
+        self.assertEqual(
+            sorted(self.created.values(), key=str), [{"edit": 0}, {"edit": 4}]
+        )
+        self.assertEqual(
+            scheduler.stats(),
+            {
+                "enqueued": 6,
+                "collapsed": 4,
+                "created": 2,
+                "deduplicated": 0,
+                "retried": 0,
+                "failed": 0,
+                "pending": 0,
+            },
+        )
+
+    def test_custom_merge(self):
+        scheduler = self.scheduler(
+            merge=lambda old, new: {"ids": old["ids"] + new["ids"]}
+        )
+        for i in range(3):
+            scheduler.enqueue("https://example.com/notify", "queue", {"ids": [i]}, "k")
+        scheduler.close()
+        self.assertEqual(list(self.created.values()), [{"ids": [0, 1, 2]}])
+
+    def test_server_side_deduplication(self):
+        # two processes coalescing the same key in the same window
+        schedulers = [self.scheduler(), self.scheduler()]
+        for scheduler in schedulers:
+            scheduler.enqueue("https://example.com/notify", "queue", {"a": 1}, "k")
+        self.now += 10
+        for scheduler in schedulers:
+            scheduler.flush()
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(schedulers[0].created, 1)
+        self.assertEqual(schedulers[1].deduplicated, 1)
+
+    def test_enqueue_after_flush(self):
+        scheduler = self.scheduler()
+        scheduler.enqueue("https://example.com/notify", "queue", {"edit": 1}, "k")
+        scheduler.flush(force=True)
+        # same window, the task must not be rejected as a duplicate
+        scheduler.enqueue("https://example.com/notify", "queue", {"edit": 2}, "k")
+        scheduler.flush(force=True)
+        self.assertEqual(scheduler.created, 2)
+        self.assertEqual(len(self.created), 2)
+
+    def test_failed_flush(self):
+        scheduler = self.scheduler()
+        scheduler.enqueue("https://example.com/notify", "queue", {"edit": 1}, "k")
+        self.default.side_effect = RuntimeError("no credentials")
+        with self.assertRaises(RuntimeError):
+            scheduler.flush(force=True)
+        self.assertEqual(scheduler.stats()["pending"], 1)
+        self.default.side_effect = None
+        scheduler.flush(force=True)
+        self.assertEqual(list(self.created.values()), [{"edit": 1}])
+
+    def test_auto_flush(self):
+        scheduler = CoalescingScheduler("europe-west2", "audience", window=0.1)
+        with scheduler:
+            for i in range(3):
+                scheduler.enqueue("https://example.com/notify", "queue", {"i": i}, "k")
+            deadline = time.monotonic() + 2
+            while not self.created and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(list(self.created.values()), [{"i": 2}])
+        self.assertEqual(scheduler.stats()["pending"], 0)
+
+    def test_retry_failed_tasks(self):
+        create_task = self.client.create_task.side_effect
+        self.client.create_task.side_effect = ServiceUnavailable("unavailable")
+        scheduler = self.scheduler(max_attempts=3)
+        scheduler.enqueue("https://example.com/notify", "queue", {"edit": 1}, "k")
+        with self.assertLogs(task.logger, "ERROR"):
+            [result] = scheduler.flush(force=True)
+        self.assertFalse(result.ok)
+        self.assertEqual(scheduler.retried, 1)
+        self.assertEqual(scheduler.stats()["pending"], 1)
+
+        # edits made meanwhile are merged into the retried task
+        scheduler.enqueue("https://example.com/notify", "queue", {"other": 2}, "k")
+        self.client.create_task.side_effect = create_task
+        scheduler.flush(force=True)
+        self.assertEqual(list(self.created.values()), [{"edit": 1, "other": 2}])
+        self.assertEqual(scheduler.created, 1)
+        self.assertEqual(scheduler.failed, 0)
+
+    def test_max_attempts(self):
+        self.client.create_task.side_effect = ServiceUnavailable("unavailable")
+        scheduler = self.scheduler(max_attempts=3)
+        scheduler.enqueue("https://example.com/notify", "queue", {"edit": 1}, "k")
+        with self.assertLogs(task.logger, "ERROR"):
+            for _ in range(3):
+                scheduler.flush(force=True)
+        self.assertEqual(scheduler.retried, 2)
+        self.assertEqual(scheduler.failed, 1)
+        self.assertEqual(scheduler.stats()["pending"], 0)
+
+    def test_auto_flush_backoff(self):
+        self.default.side_effect = RuntimeError("no credentials")
+        scheduler = CoalescingScheduler(
+            "europe-west2", "audience", window=0.05, max_attempts=100
+        )
+        with self.assertLogs(task.logger, "ERROR"):
+            scheduler.enqueue("https://example.com/notify", "queue", {"i": 1}, "k")
+            time.sleep(0.5)
+            scheduler._stop_timer()
+        # flushes at about 0.05, 0.1, 0.2 and 0.4s, not in a loop
+        self.assertGreaterEqual(self.default.call_count, 2)
+        self.assertLessEqual(self.default.call_count, 6)
+        self.assertEqual(scheduler.stats()["pending"], 1)